@@ -14,7 +14,7 @@ def check_requirements():
     
     required_packages = [
         "PyQt5", "pandas", "numpy", "openpyxl", 
-        "xlsxwriter", "folium", "shapely", "geopy", "pyinstaller"
+        "xlsxwriter", "folium", "shapely", "geopy", "scipy", "pyinstaller"
     ]
     
     missing_packages = []
@@ -53,6 +53,22 @@ a = Analysis(
         ('04_tam_analysis.py', '.'),
         ('05_generate_map.py', '.'),
         ('06_export_excel.py', '.'),
+        ('distance_engine.py', '.'),
+        ('spatial_index.py', '.'),
+        ('membership.py', '.'),
+        ('data_cache.py', '.'),
+        ('data_loader.py', '.'),
+        ('schema.py', '.'),
+        ('pipeline.py', '.'),
+        ('radius_sweep.py', '.'),
+        ('tam_grid.py', '.'),
+        ('tam_simulation.py', '.'),
+        ('site_selection.py', '.'),
+        ('heat_surface.py', '.'),
+        ('student_assignment.py', '.'),
+        ('capacity_allocation.py', '.'),
+        ('penetration_calibration.py', '.'),
+        ('road_network.py', '.'),
         ('campus_icon.png', '.'),
     ],
     hiddenimports=[
@@ -63,6 +79,8 @@ a = Analysis(
         'folium.plugins',
         'shapely.geometry',
         'geopy.distance',
+        'scipy.spatial',
+        'scipy.sparse',
         'xlsxwriter.workbook',
         'openpyxl.chart',
     ],
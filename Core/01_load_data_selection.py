@@ -3,6 +3,10 @@ import numpy as np
 import os
 import math
 
+from spatial_index import SchoolSpatialIndex
+from student_assignment import assign_students, transfer_suggestions, campus_distance_percentiles
+from data_loader import load_inputs, INPUT_FILES
+
 print("📂 Đang load dữ liệu từ các file Excel với CAMPUS SELECTION...")
 
 # Lấy cấu hình từ main.py
@@ -10,22 +14,57 @@ STUDENTS_PER_ROOM = globals().get('STUDENTS_PER_ROOM', 100)
 USE_CAMPUS_SELECTION = globals().get('USE_CAMPUS_SELECTION', False)
 SELECTED_CAMPUSES = globals().get('SELECTED_CAMPUSES', [])
 NEW_CAMPUSES = globals().get('NEW_CAMPUSES', [])
+DISTANCE_METRIC = globals().get('DISTANCE_METRIC', 'haversine')
+USE_INPUT_CACHE = globals().get('USE_INPUT_CACHE', True)
+INPUT_DIR = globals().get('INPUT_DIR', './Input')
+STUDENT_CHUNK_SIZE = globals().get('STUDENT_CHUNK_SIZE', 50000)
+TRANSFER_MIN_SAVING_KM = globals().get('TRANSFER_MIN_SAVING_KM', 1.0)
 
 print(f"🔧 Campus selection mode: {'✅ ENABLED' if USE_CAMPUS_SELECTION else '❌ DISABLED'}")
 
 # Kiểm tra và tạo thư mục Input nếu cần
-input_dir = "./Input"
+input_dir = INPUT_DIR
 if not os.path.exists(input_dir):
     input_dir = "."
     print("⚠️  Không tìm thấy thư mục Input, sử dụng thư mục hiện tại")
 
+# Load song song 3 file Excel (campus / học viên / trường công)
+# Dữ liệu đã load từ lần chạy trước (pipeline.run_pipeline inputs) -> dùng lại
+loaded_inputs = globals().get('loaded_inputs')
+
+# Warm start (pipeline previous=): dùng lại nếu cùng file và file chưa đổi
+previous_loaded_inputs = globals().get('previous_loaded_inputs')
+if loaded_inputs is None and previous_loaded_inputs is not None and all(
+    name in previous_loaded_inputs
+    and previous_loaded_inputs[name].is_current()
+    and os.path.abspath(previous_loaded_inputs[name].path) == os.path.abspath(os.path.join(input_dir, filename))
+    for name, filename in INPUT_FILES.items()
+):
+    loaded_inputs = previous_loaded_inputs
+
+if loaded_inputs is None:
+    loaded_inputs, load_seconds = load_inputs(input_dir, use_cache=USE_INPUT_CACHE)
+    print(f"⏱️  Load input: {load_seconds:.2f}s (song song)")
+else:
+    print("♻️  Dùng lại dữ liệu input đã load")
+for loaded in loaded_inputs.values():
+    status = "❌ lỗi" if loaded.error is not None else ("⚡ cache" if loaded.source == 'cache' else "📄 excel")
+    print(f"   • {os.path.basename(loaded.path)}: {loaded.seconds:.2f}s ({status})")
+    # Cột lấy từ alias / giá trị mặc định (schema.py)
+    for column, source in loaded.schema_report.items():
+        if source == 'default':
+            print(f"     ⚠️  Không có cột '{column}', tạo giá trị mặc định")
+        elif source is not None and source != column:
+            print(f"     🔁 '{source}' -> '{column}'")
+
 # ============================================================================
 # LOAD DỮ LIỆU CAMPUS VỚI SELECTION
 # ============================================================================
 
 try:
     # Load toàn bộ campus từ Excel
-    full_campuses_df = pd.read_excel(f"{input_dir}/Campuses_with_latlon.xlsx")
+    # Copy: frame gốc có thể được dùng chung giữa nhiều lần chạy
+    full_campuses_df = loaded_inputs['campuses'].result().copy()
     full_campuses_df['Campus Code'] = full_campuses_df['Campus Code'].astype(str).str.strip()
     print(f"📋 Loaded {len(full_campuses_df)} campus từ Excel")
     
@@ -141,49 +180,62 @@ try:
     
 except FileNotFoundError:
     print("❌ Không tìm thấy file Campuses_with_latlon.xlsx")
-    exit()
+    raise
 except Exception as e:
     print(f"❌ Lỗi khi load campus data: {e}")
-    exit()
+    raise
 
 # ============================================================================
 # LOAD DỮ LIỆU HỌC VIÊN (KHÔNG THAY ĐỔI)
 # ============================================================================
 
 try:
-    students_df = pd.read_excel(f"{input_dir}/Students_with_latlon.xlsx")
-    # Chuẩn hóa studycampuscode
-    if 'studycampuscode' in students_df.columns:
-        students_df['studycampuscode'] = students_df['studycampuscode'].astype(str).str.strip()
+    students_df = loaded_inputs['students'].result()
     print(f"✅ Students: {len(students_df)} records")
 except FileNotFoundError:
     print("❌ Không tìm thấy file Students_with_latlon.xlsx")
-    exit()
+    raise
 
 # ============================================================================
 # LOAD DỮ LIỆU TRƯỜNG CÔNG (KHÔNG THAY ĐỔI)
 # ============================================================================
 
 try:
-    schools_df = pd.read_excel(f"{input_dir}/Public_Schools_with_latlon.xlsx")
-    schools_df['Tên trường'] = schools_df['Tên trường'].astype(str)
-    print(f"✅ Public Schools: {len(schools_df)} records")
+    schools_df = loaded_inputs['schools'].result()
     
-    # Đảm bảo có cột số học sinh
-    if 'Tổng học sinh 2023' not in schools_df.columns:
-        print("⚠️  Không có cột 'Tổng học sinh 2023', tạo giá trị mặc định")
-        schools_df['Tổng học sinh 2023'] = 500
+    # ID trường ổn định (= vị trí dòng): key cho classification / coverage / export
+    schools_df = schools_df.reset_index(drop=True)
+    schools_df.insert(0, 'school_id', np.arange(len(schools_df)))
+    print(f"✅ Public Schools: {len(schools_df)} records")
         
 except FileNotFoundError:
     print("❌ Không tìm thấy file Public_Schools_with_latlon.xlsx")
-    exit()
+    raise
+
+# Spatial index (KD-tree) cho truy vấn bán kính / k-nearest - build 1 lần mỗi lần load
+school_index = SchoolSpatialIndex.from_dataframe(schools_df, metric=DISTANCE_METRIC)
+print(f"✅ Spatial index: {len(school_index)} trường có tọa độ hợp lệ (metric: {school_index.metric})")
 
 # ============================================================================
 # TẠO TRANSFER SUGGESTION CHO CAMPUS ĐÃ CHỌN
 # ============================================================================
 
-print("⚠️  Bỏ qua tạo transfer suggestion - sẽ tạo on-demand nếu cần")
-transfer_df = pd.DataFrame()  # Empty for now
+# Campus gần nhất / gần nhì cho từng học viên (KD-tree trên campus, theo khối học viên)
+if {'lat', 'lon'}.issubset(students_df.columns) and len(campuses_df) > 0:
+    student_assignment_df = assign_students(
+        students_df, campuses_df, current_campuses_df=full_campuses_df,
+        metric=DISTANCE_METRIC, chunk_size=STUDENT_CHUNK_SIZE
+    )
+    transfer_df = transfer_suggestions(student_assignment_df, min_saving_km=TRANSFER_MIN_SAVING_KM)
+    campus_distance_df = campus_distance_percentiles(student_assignment_df, transfer_df)
+    located = student_assignment_df['Nearest Campus'].notna().sum()
+    print(f"✅ Student assignment: {located:,}/{len(student_assignment_df):,} học viên có tọa độ")
+    print(f"   • Transfer suggestions (tiết kiệm >= {TRANSFER_MIN_SAVING_KM} km): {len(transfer_df):,} học viên")
+else:
+    print("⚠️  Học viên không có tọa độ - bỏ qua transfer suggestion")
+    student_assignment_df = None
+    transfer_df = pd.DataFrame()
+    campus_distance_df = None
 
 # ============================================================================
 # HIỂN thị THÔNG TIN CẤU TRÚC DỮ LIỆU
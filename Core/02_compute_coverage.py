@@ -3,102 +3,173 @@
 FIXED VERSION: Compute coverage with proper student count column
 """
 
+import hashlib
+import os
+
 import pandas as pd
 import numpy as np
-from math import radians, sin, cos, sqrt, asin
+from distance_engine import distance_matrix
+from spatial_index import SchoolSpatialIndex, candidate_pairs
+from membership import CoverageMembership
+from road_network import RoadGraph
 
 # ===== BƯỚC 2: TÍNH VÙNG PHỦ CHO MỖI CAMPUS =====
 print("\n" + "="*80)
 print("BƯỚC 2: TÍNH VÙNG PHỦ CHO MỖI CAMPUS")
 print("="*80)
 
-# 2.1. Hàm tính khoảng cách haversine
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """Tính khoảng cách giữa 2 điểm theo công thức haversine (km)"""
-    R = 6371  # Radius of Earth in km
-    
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    
-    return R * c
+# 2.1. Truy vấn bán kính qua spatial index (build ở bước 1)
+campus_rows = [
+    campuses_df[campuses_df['Campus Code'] == campus_code].iloc[0]
+    for campus_code in campus_codes
+]
+campus_lats = np.array([float(row['lat']) for row in campus_rows])
+campus_lons = np.array([float(row['lon']) for row in campus_rows])
+
+DISTANCE_METRIC = globals().get('DISTANCE_METRIC', 'haversine')
+CATCHMENT_MODE = globals().get('CATCHMENT_MODE', 'radius')
+ROAD_NETWORK_FILE = globals().get('ROAD_NETWORK_FILE')
+CATCHMENT_MINUTES = globals().get('CATCHMENT_MINUTES', 15)
+ROAD_PROFILE = globals().get('ROAD_PROFILE', 'motorbike')
+
+school_index = globals().get('school_index')
+if school_index is None or school_index.metric != DISTANCE_METRIC:
+    school_index = SchoolSpatialIndex.from_dataframe(schools_df, metric=DISTANCE_METRIC)
+
+# Vùng phủ theo thời gian di chuyển trên mạng đường (OSM offline) thay vì bán kính đường thẳng
+road_graph = None
+catchment_key = ('radius', COVERAGE_RADIUS_KM)
+if CATCHMENT_MODE == 'road':
+    if ROAD_NETWORK_FILE and os.path.exists(ROAD_NETWORK_FILE):
+        road_graph = RoadGraph.load(ROAD_NETWORK_FILE, ROAD_PROFILE)
+        road_stat = os.stat(ROAD_NETWORK_FILE)
+        catchment_key = ('road', os.path.abspath(ROAD_NETWORK_FILE), road_stat.st_mtime_ns, road_stat.st_size,
+                         ROAD_PROFILE, CATCHMENT_MINUTES)
+        print(f"🛣️  Road network: {road_graph.n_nodes:,} nút, {road_graph.n_edges:,} cạnh ({ROAD_PROFILE})")
+    else:
+        print(f"⚠️  Không tìm thấy ROAD_NETWORK_FILE ({ROAD_NETWORK_FILE}), dùng bán kính {COVERAGE_RADIUS_KM} km")
+
+# Warm start (pipeline previous=): campus giữ nguyên tọa độ -> dùng lại cột khoảng cách cũ,
+# chỉ truy vấn campus mới / đổi tọa độ. Hợp lệ khi cùng dữ liệu trường, vùng phủ, metric.
+schools_fingerprint = hashlib.sha1(
+    pd.util.hash_pandas_object(schools_df, index=True).to_numpy().tobytes()
+).hexdigest()
+previous_cache = globals().get('previous_campus_coverage_cache')
+if previous_cache is not None and (
+    previous_cache['schools_fingerprint'], previous_cache.get('catchment'), previous_cache['metric']
+) != (schools_fingerprint, catchment_key, school_index.metric):
+    previous_cache = None
+previous_campuses = previous_cache['campuses'] if previous_cache is not None else {}
+
+campus_neighbors = [None] * len(campus_codes)
+campus_minutes = [None] * len(campus_codes)
+query_positions = []
+for campus_pos, campus_code in enumerate(campus_codes):
+    previous = previous_campuses.get(campus_code)
+    if previous is not None and (previous['lat'], previous['lon']) == (campus_lats[campus_pos], campus_lons[campus_pos]):
+        campus_neighbors[campus_pos] = previous['neighbors']
+        campus_minutes[campus_pos] = previous.get('minutes')
+    else:
+        query_positions.append(campus_pos)
+
+if road_graph is not None:
+    # Dijkstra giới hạn CATCHMENT_MINUTES từ từng campus; khoảng cách lưu vẫn là km đường thẳng
+    school_lats = pd.to_numeric(schools_df['lat'], errors='coerce').to_numpy(dtype=float)
+    school_lons = pd.to_numeric(schools_df['lon'], errors='coerce').to_numpy(dtype=float)
+    for campus_pos, (positions, minutes) in zip(query_positions, road_graph.catchments(
+        campus_lats[query_positions], campus_lons[query_positions], school_lats, school_lons, CATCHMENT_MINUTES
+    )):
+        distances = distance_matrix([campus_lats[campus_pos]], [campus_lons[campus_pos]],
+                                    school_lats[positions], school_lons[positions], school_index.metric)[0]
+        campus_neighbors[campus_pos] = (positions, distances)
+        campus_minutes[campus_pos] = minutes
+else:
+    for campus_pos, neighbors in zip(query_positions, school_index.query_radius_many(
+        campus_lats[query_positions], campus_lons[query_positions], COVERAGE_RADIUS_KM
+    )):
+        campus_neighbors[campus_pos] = neighbors
 
-# 2.2. Tính coverage cho mỗi campus
+# Cặp campus cách nhau > 2 × tầm xa nhất chắc chắn không overlap -> loại trước
+if road_graph is not None:
+    reach_km = max((distances.max() for _, distances in campus_neighbors if len(distances)), default=0.0)
+else:
+    reach_km = COVERAGE_RADIUS_KM
+campus_overlap_pairs = [
+    (campus_codes[i], campus_codes[j])
+    for i, j in candidate_pairs(campus_lats, campus_lons, 2 * reach_km, school_index.metric)
+]
+
+# 2.2. Membership thưa trường × campus (cấu trúc gốc cho các bước sau)
+# Số học sinh: cột chuẩn 'Tổng học sinh 2023' (schema đã resolve alias/mặc định khi load)
+school_students = schools_df['Tổng học sinh 2023'].to_numpy(dtype=float)
+
+coverage_membership = CoverageMembership.from_neighbors(campus_neighbors, campus_codes, school_students)
+
+# 2.3. Tính coverage cho mỗi campus (DataFrame theo campus cho map/Excel)
 coverage_results = {}
 
-print(f"\n📏 Coverage radius: {COVERAGE_RADIUS_KM} km")
+if road_graph is not None:
+    print(f"\n🛣️  Catchment: {CATCHMENT_MINUTES} phút ({ROAD_PROFILE}, mạng đường OSM)")
+else:
+    print(f"\n📏 Coverage radius: {COVERAGE_RADIUS_KM} km ({school_index.metric})")
 print(f"🏫 Computing coverage for {len(campus_codes)} campuses...")
+print(f"   Spatial index: {len(school_index)} trường")
+print(f"   Cặp campus có thể overlap: {len(campus_overlap_pairs)}/{len(campus_codes) * (len(campus_codes) - 1) // 2}")
+print(f"   Membership: {coverage_membership.n_schools} × {coverage_membership.n_campuses} ({coverage_membership.nnz} cặp phủ)")
+if previous_cache is not None:
+    removed_campuses = [code for code in previous_campuses if code not in coverage_membership.campus_index]
+    print(f"   ♻️  Incremental: truy vấn {len(query_positions)}/{len(campus_codes)} campus"
+          f"{f', bỏ {removed_campuses}' if removed_campuses else ''}")
 
-for campus_code in campus_codes:
+for campus_pos, campus_code in enumerate(campus_codes):
     # Get campus info
-    campus_info = campuses_df[campuses_df['Campus Code'] == campus_code].iloc[0]
+    campus_info = campus_rows[campus_pos]
     campus_lat = campus_info['lat']
     campus_lon = campus_info['lon']
     
     print(f"\n📍 {campus_code}: {campus_info['Campus Name']}")
     print(f"   Location: ({campus_lat:.6f}, {campus_lon:.6f})")
     
-    # Find schools within coverage radius
-    schools_in_coverage = []
-    
-    for idx, school in schools_df.iterrows():
-        # Calculate distance
-        distance_km = haversine_distance(
-            campus_lat, campus_lon,
-            school['lat'], school['lon']
-        )
+    # Find schools within coverage radius (kết quả truy vấn spatial index)
+    school_positions, school_distances = campus_neighbors[campus_pos]
+    previous = previous_campuses.get(campus_code)
+    if (previous is not None and previous['neighbors'] is campus_neighbors[campus_pos]
+            and previous['coverage']['campus_info'].equals(campus_info)):
+        # Campus không đổi -> dùng lại kết quả cũ
+        coverage_results[campus_code] = previous['coverage']
+        schools_in_coverage_df = previous['coverage']['schools_df']
+    else:
+        schools_in_coverage_df = schools_df.iloc[school_positions].copy()
+        schools_in_coverage_df[f'dist_to_{campus_code}'] = school_distances
+        if campus_minutes[campus_pos] is not None:
+            schools_in_coverage_df[f'minutes_to_{campus_code}'] = campus_minutes[campus_pos]
         
-        # Check if within radius
-        if distance_km <= COVERAGE_RADIUS_KM:
-            # Create school copy with distance info
-            school_copy = school.copy()
-            school_copy[f'dist_to_{campus_code}'] = distance_km
-            
-            # IMPORTANT: Ensure student count column is included
-            # Check multiple possible column names
-            student_count_found = False
-            for col in ['Tổng học sinh 2023', 'Số lượng', 'Số học sinh', 'Total Students']:
-                if col in school:
-                    school_copy['Số lượng'] = school[col]  # Standardize to 'Số lượng'
-                    student_count_found = True
-                    break
-            
-            if not student_count_found:
-                # Use default from file 01
-                school_copy['Số lượng'] = 500
-            
-            schools_in_coverage.append(school_copy)
-    
-    # Convert to DataFrame
-    schools_in_coverage_df = pd.DataFrame(schools_in_coverage)
-    
-    # Store results
-    coverage_results[campus_code] = {
-        'campus_info': campus_info,
-        'schools_df': schools_in_coverage_df,
-        'num_schools': len(schools_in_coverage_df),
-        'total_students': schools_in_coverage_df['Số lượng'].sum() if len(schools_in_coverage_df) > 0 else 0
-    }
+        # 'Số lượng' = số học sinh (giữ tên cột cũ cho các bước/print phía sau)
+        schools_in_coverage_df['Số lượng'] = school_students[school_positions]
+        
+        # Store results
+        coverage_results[campus_code] = {
+            'campus_info': campus_info,
+            'schools_df': schools_in_coverage_df,
+            'num_schools': len(schools_in_coverage_df),
+            'total_students': schools_in_coverage_df['Số lượng'].sum() if len(schools_in_coverage_df) > 0 else 0
+        }
     
-    print(f"   ✅ Found {len(schools_in_coverage_df)} schools in {COVERAGE_RADIUS_KM}km radius")
+    if road_graph is not None:
+        print(f"   ✅ Found {len(schools_in_coverage_df)} schools trong {CATCHMENT_MINUTES} phút")
+    else:
+        print(f"   ✅ Found {len(schools_in_coverage_df)} schools in {COVERAGE_RADIUS_KM}km radius")
     if len(schools_in_coverage_df) > 0:
         print(f"   📊 Total students: {schools_in_coverage_df['Số lượng'].sum():,}")
         print(f"   📊 Avg distance: {schools_in_coverage_df[f'dist_to_{campus_code}'].mean():.2f}km")
         print(f"   📊 Max distance: {schools_in_coverage_df[f'dist_to_{campus_code}'].max():.2f}km")
 
-# 2.3. Summary
+# 2.4. Summary
 print("\n" + "="*50)
 print("📊 COVERAGE SUMMARY:")
 print("="*50)
 
-total_unique_schools = len(set(
-    school_name 
-    for data in coverage_results.values() 
-    for school_name in data['schools_df']['Tên trường'] if len(data['schools_df']) > 0
-))
+total_unique_schools = schools_df['Tên trường'].iloc[np.nonzero(coverage_membership.covered_mask)[0]].nunique(dropna=False)
 
 for campus_code, data in coverage_results.items():
     print(f"\n{campus_code}:")
@@ -107,6 +178,19 @@ for campus_code, data in coverage_results.items():
 
 print(f"\n📊 Total unique schools covered: {total_unique_schools}")
 
+# Campus gần nhất theo đường đi (multi-source Dijkstra) vs theo đường thẳng: sông / cầu làm lệch
+if road_graph is not None:
+    road_minutes, road_nearest = road_graph.nearest_campus(
+        campus_lats, campus_lons, school_lats, school_lons, CATCHMENT_MINUTES
+    )
+    straight_nearest = np.argmin(
+        distance_matrix(campus_lats, campus_lons, school_lats, school_lons, school_index.metric), axis=0
+    )
+    reachable = road_nearest >= 0
+    print(f"🛣️  {reachable.sum():,} trường tới được campus trong {CATCHMENT_MINUTES} phút; "
+          f"{(road_nearest[reachable] != straight_nearest[reachable]).sum():,} trường có campus gần nhất "
+          f"theo đường đi khác theo đường thẳng")
+
 # Debug: Check if student counts are correct
 print("\n🔍 DEBUG: Student count verification")
 for campus_code, data in coverage_results.items():
@@ -122,4 +206,27 @@ for campus_code, data in coverage_results.items():
             for _, row in sample.iterrows():
                 print(f"    - {row['Tên trường']}: {row['Số lượng']} students")
 
+# Cache theo campus cho lần chạy sau (thêm / bớt campus chỉ tính campus thay đổi)
+campus_coverage_cache = {
+    'schools_fingerprint': schools_fingerprint,
+    'radius_km': COVERAGE_RADIUS_KM,
+    'catchment': catchment_key,
+    'metric': school_index.metric,
+    'campuses': {
+        campus_code: {
+            'lat': campus_lats[campus_pos],
+            'lon': campus_lons[campus_pos],
+            'neighbors': campus_neighbors[campus_pos],
+            'minutes': campus_minutes[campus_pos],
+            'coverage': coverage_results[campus_code],
+        }
+        for campus_pos, campus_code in enumerate(campus_codes)
+    },
+}
+
+globals()['coverage_membership'] = coverage_membership
+globals()['campus_overlap_pairs'] = campus_overlap_pairs
+globals()['campus_coverage_cache'] = campus_coverage_cache
+globals()['coverage_catchment'] = catchment_key
+
 print("\n✅ Hoàn thành tính vùng phủ!")
\ No newline at end of file
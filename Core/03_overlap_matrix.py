@@ -2,106 +2,147 @@
 
 import pandas as pd
 import numpy as np
-from geopy.distance import geodesic
 
 print("\n" + "="*80)
 print("BƯỚC 3: TÍNH MA TRẬN OVERLAP (FIXED VERSION)")
 print("="*80)
 
-# Hàm tính khoảng cách
-def haversine_distance(lat1, lon1, lat2, lon2):
-    return geodesic((lat1, lon1), (lat2, lon2)).km
-
-# 3.1. Tạo ma trận overlap giữa các campus
+# 3.1. Danh sách campus cho ma trận overlap
 campus_list = list(coverage_results.keys())
 n_campuses = len(campus_list)
-overlap_matrix = np.zeros((n_campuses, n_campuses))
 
 # 3.2. Dictionary lưu chi tiết overlap
 overlap_details = {}
 
-# 3.3. Tạo school classification với unique identifier
+# Warm start (pipeline previous=): so cột membership với lần chạy trước (cột dùng lại ở
+# bước 2 là cùng object) -> chỉ các trường thuộc campus thêm / bớt / đổi tọa độ bị tính lại
+campus_coverage_cache = globals().get('campus_coverage_cache')
+previous_overlap_cache = globals().get('previous_overlap_cache')
+changed_schools = None
+unchanged_campuses = set()
+
+if campus_coverage_cache is not None and previous_overlap_cache is not None \
+        and previous_overlap_cache['schools_fingerprint'] == campus_coverage_cache['schools_fingerprint']:
+    previous_membership = previous_overlap_cache['membership']
+    previous_neighbors = previous_overlap_cache['neighbors']
+    unchanged_campuses = {
+        code for code, cached in campus_coverage_cache['campuses'].items()
+        if previous_neighbors.get(code) is cached['neighbors']
+    }
+    # Thứ tự tương đối các campus giữ lại phải như cũ (thứ tự list campus của từng trường)
+    kept_previous = [code for code in previous_membership.campus_codes if code in unchanged_campuses]
+    kept_current = [code for code in coverage_membership.campus_codes if code in unchanged_campuses]
+    if kept_previous == kept_current:
+        changed_schools = np.zeros(coverage_membership.n_schools, dtype=bool)
+        for code in previous_membership.campus_codes:
+            if code not in unchanged_campuses:
+                changed_schools[previous_membership.campus_schools(code)[0]] = True
+        for code in coverage_membership.campus_codes:
+            if code not in unchanged_campuses:
+                changed_schools[coverage_membership.campus_schools(code)[0]] = True
+    else:
+        unchanged_campuses = set()
+
+# 3.3. Tạo school classification theo school_id (từ membership bước 2)
 school_classification = {}
+previous_classification = previous_overlap_cache['classification'] if changed_schools is not None else {}
+
+# Duyệt theo thứ tự campus đầu tiên phủ -> giữ nguyên thứ tự như khi duyệt từng campus
+for pos in coverage_membership.first_seen_order():
+    if changed_schools is not None and not changed_schools[pos] and pos in previous_classification:
+        # Trường không thuộc campus nào thay đổi -> phân loại giữ nguyên (school_id = vị trí)
+        school_classification[int(pos)] = previous_classification[pos]
+        continue
+    school = schools_df.iloc[pos]
+    school_id = int(school['school_id'])
+    school_classification[school_id] = {
+        'school_id': school_id,
+        'name': school['Tên trường'],
+        'lat': school['lat'],
+        'lon': school['lon'],
+        'campuses': coverage_membership.school_campuses(pos),
+        'type': coverage_membership.school_type(pos),
+        'students': school['Tổng học sinh 2023']
+    }
 
-# Tạo dictionary mapping tên trường -> dữ liệu để tối ưu truy vấn
-schools_dict = {idx: row for idx, row in schools_df.iterrows()}
+if changed_schools is not None:
+    print(f"♻️  Incremental: tính lại {int(changed_schools.sum())} trường, "
+          f"giữ {len(unchanged_campuses)}/{coverage_membership.n_campuses} campus")
 
-for campus_code, coverage_data in coverage_results.items():
-    schools_in_coverage = coverage_data['schools_df']
-    
-    for idx, school in schools_in_coverage.iterrows():
-        school_name = school['Tên trường']
-        school_lat = school['lat']
-        school_lon = school['lon']
-        
-        # Sử dụng index làm unique identifier
-        school_key = f"{school_name}_{idx}"
-        
-        if school_key not in school_classification:
-            school_classification[school_key] = {
-                'original_name': school_name,
-                'lat': school_lat,
-                'lon': school_lon,
-                'campuses': [],
-                'type': None,
-                'index': idx,
-                'students': school.get('Tổng học sinh 2023', 0)
-            }
-        
-        if campus_code not in school_classification[school_key]['campuses']:
-            school_classification[school_key]['campuses'].append(campus_code)
-
-# 3.4. Phân loại trường dựa trên số campus phủ sóng
+# 3.4. Phân loại trường dựa trên số campus phủ sóng (rút gọn theo dòng)
 print("\n🔍 Xác định loại trường dựa trên số campus phủ sóng:")
-exclusive_count = 0
-shared_count = 0
-
-for school_key, data in school_classification.items():
-    num_campuses = len(data['campuses'])
-    
-    if num_campuses == 1:
-        data['type'] = 'exclusive'
-        exclusive_count += 1
-    elif num_campuses > 1:
-        data['type'] = 'shared'
-        shared_count += 1
+exclusive_count = int(coverage_membership.exclusive_mask.sum())
+shared_count = int(coverage_membership.shared_mask.sum())
 
 print(f"\n✅ Đã tạo school_classification cho {len(school_classification)} trường:")
 print(f"   - Exclusive: {exclusive_count}")
 print(f"   - Shared: {shared_count}")
 
 # 3.5. Tính overlap matrix và details (SỬA LẠI để lưu số học sinh)
+# Mᵀ·diag(students)·M trên membership; danh sách trường chung chỉ tạo cho cặp có overlap
 print("\n📊 Tính ma trận overlap (lưu số học sinh)...")
 
-for i in range(n_campuses):
-    for j in range(i+1, n_campuses):
-        campus1 = campus_list[i]
-        campus2 = campus_list[j]
-        
-        shared_students = 0
-        shared_schools = []
-        
-        for school_key, classification in school_classification.items():
-            if (campus1 in classification['campuses'] and 
-                campus2 in classification['campuses']):
-                shared_schools.append(classification['original_name'])
-                shared_students += classification['students']
-        
-        # SỬA: Lưu số học sinh thay vì số trường
-        overlap_matrix[i][j] = shared_students
-        overlap_matrix[j][i] = shared_students
-        
-        overlap_key = f"{campus1}_{campus2}"
+# Chỉ xét các cặp campus có thể overlap (bước 2 đã loại cặp cách nhau > 2 × bán kính)
+candidate_campus_pairs = globals().get('campus_overlap_pairs')
+if candidate_campus_pairs is not None:
+    candidate_campus_pairs = [
+        (coverage_membership.campus_index[c1], coverage_membership.campus_index[c2])
+        for c1, c2 in candidate_campus_pairs
+    ]
+    print(f"   Cặp campus cần xét: {len(candidate_campus_pairs)}/{n_campuses * (n_campuses - 1) // 2}")
+
+if unchanged_campuses and candidate_campus_pairs is not None:
+    # Chỉ tính cặp có campus mới / thay đổi (+ đường chéo, O(nnz));
+    # cặp 2 campus đều không đổi -> lấy giá trị cũ
+    changed_pairs = [(i, j) for i, j in candidate_campus_pairs
+                     if coverage_membership.campus_codes[i] not in unchanged_campuses
+                     or coverage_membership.campus_codes[j] not in unchanged_campuses]
+    pair_students, pair_schools = coverage_membership.overlap(pairs=changed_pairs)
+    
+    kept = [(j, previous_membership.campus_index[code]) for code, j in coverage_membership.campus_index.items()
+            if code in unchanged_campuses]
+    kept_new = np.array([j for j, _ in kept], dtype=int)
+    kept_old = np.array([k for _, k in kept], dtype=int)
+    pair_students[np.ix_(kept_new, kept_new)] = previous_overlap_cache['pair_students'][np.ix_(kept_old, kept_old)]
+    pair_schools[np.ix_(kept_new, kept_new)] = previous_overlap_cache['pair_schools'][np.ix_(kept_old, kept_old)]
+else:
+    pair_students, pair_schools = coverage_membership.overlap(pairs=candidate_campus_pairs)
+full_pair_students, full_pair_schools = pair_students, pair_schools
+campus_cols = [coverage_membership.campus_index[code] for code in campus_list]
+overlap_matrix = pair_students[np.ix_(campus_cols, campus_cols)]
+pair_schools = pair_schools[np.ix_(campus_cols, campus_cols)]
+np.fill_diagonal(overlap_matrix, 0)
+
+# Thứ tự trường trong danh sách = thứ tự trong school_classification
+school_order = np.empty(coverage_membership.n_schools, dtype=int)
+school_order[coverage_membership.first_seen_order()] = np.arange(len(school_classification))
+
+previous_details = previous_overlap_cache['overlap_details'] if unchanged_campuses else {}
+
+for i, j in zip(*np.nonzero(np.triu(pair_schools, k=1))):
+    campus1 = campus_list[i]
+    campus2 = campus_list[j]
+    overlap_key = f"{campus1}_{campus2}"
+    shared_students = overlap_matrix[i][j]
+
+    # Cặp không đổi và không chứa trường bị tính lại -> danh sách trường giữ nguyên
+    previous_detail = previous_details.get(overlap_key)
+    if (previous_detail is not None and campus1 in unchanged_campuses and campus2 in unchanged_campuses
+            and not changed_schools[previous_detail['school_ids']].any()):
+        overlap_details[overlap_key] = previous_detail
+    else:
+        positions = coverage_membership.shared_positions(campus1, campus2)
+        positions = positions[np.argsort(school_order[positions])]
         overlap_details[overlap_key] = {
             'campus1': campus1,
             'campus2': campus2,
-            'schools': shared_schools,
-            'num_schools': len(shared_schools),
+            'schools': schools_df['Tên trường'].iloc[positions].tolist(),
+            'school_ids': schools_df['school_id'].iloc[positions].tolist(),
+            'num_schools': len(positions),
             'total_students': shared_students
         }
-        
-        if len(shared_schools) > 0:
-            print(f"   • {campus1} ↔ {campus2}: {len(shared_schools)} trường, {shared_students:,} học sinh")
+
+    print(f"   • {campus1} ↔ {campus2}: {overlap_details[overlap_key]['num_schools']} trường, {shared_students:,} học sinh")
 
 # 3.6. Convert to DataFrame
 overlap_matrix = pd.DataFrame(
@@ -110,20 +151,45 @@ overlap_matrix = pd.DataFrame(
     columns=campus_list
 )
 
-# 3.7. Tạo school_classification đơn giản để tương thích
-school_classification_simple = {}
-for school_key, data in school_classification.items():
-    school_classification_simple[data['original_name']] = {
-        'type': data['type'],
-        'campuses': data['campuses'],
-        'lat': data['lat'],
-        'lon': data['lon'],
-        'students': data['students']
+# 3.7. Vùng overlap k-campus: nhóm trường theo bitmask tập campus phủ
+# (mỗi trường thuộc đúng 1 vùng -> không đếm lặp như overlap theo cặp)
+overlap_zones = {}
+for zone in sorted(coverage_membership.zones(), key=lambda z: (-len(z['campuses']), z['campuses'])):
+    zone_key = "_".join(zone['campuses'])
+    overlap_zones[zone_key] = {
+        'campuses': zone['campuses'],
+        'num_campuses': len(zone['campuses']),
+        'schools': schools_df['Tên trường'].iloc[zone['rows']].tolist(),
+        'school_ids': schools_df['school_id'].iloc[zone['rows']].tolist(),
+        'num_schools': len(zone['rows']),
+        'total_students': zone['weight']
     }
 
+print("\n📊 Vùng overlap theo số campus phủ (k-way):")
+for k in sorted({data['num_campuses'] for data in overlap_zones.values()}, reverse=True):
+    zones_k = [data for data in overlap_zones.values() if data['num_campuses'] == k]
+    print(f"   • {k} campus: {len(zones_k)} vùng, "
+          f"{sum(data['num_schools'] for data in zones_k)} trường, "
+          f"{np.nansum([data['total_students'] for data in zones_k]):,.0f} học sinh")
+
+# Cache cho lần chạy sau (thêm / bớt campus chỉ tính lại phần thay đổi)
+overlap_cache = {
+    'schools_fingerprint': campus_coverage_cache['schools_fingerprint'] if campus_coverage_cache is not None else None,
+    'neighbors': {
+        code: cached['neighbors'] for code, cached in campus_coverage_cache['campuses'].items()
+    } if campus_coverage_cache is not None else {},
+    'membership': coverage_membership,
+    'classification': school_classification,
+    'pair_students': full_pair_students,
+    'pair_schools': full_pair_schools,
+    'overlap_details': overlap_details,
+}
+
 # Export kết quả
+globals()["overlap_cache"] = overlap_cache
 globals()["overlap_matrix"] = overlap_matrix
 globals()["overlap_details"] = overlap_details
-globals()["school_classification"] = school_classification_simple
+globals()["overlap_zones"] = overlap_zones
+globals()["school_classification"] = school_classification
 
-print("\n✅ Hoàn thành tính ma trận overlap với UNIQUE IDENTIFIERS!")
\ No newline at end of file
+print("\n✅ Hoàn thành tính ma trận overlap với school_id!")
\ No newline at end of file
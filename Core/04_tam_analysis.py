@@ -144,6 +144,23 @@ FIXED VERSION: Tính toán TAM với proper variable initialization
 
 import pandas as pd
 
+from penetration_calibration import (
+    active_students, calibrate_penetration, distance_band_penetration, road_catchment_mask
+)
+from road_network import RoadGraph
+
+# Lấy cấu hình từ main.py
+PENETRATION_RATE = globals().get('PENETRATION_RATE', 0.0162)
+OVERLAP_SHARE = globals().get('OVERLAP_SHARE', 0.5)
+# Chia học sinh trường shared: 'flat' (mỗi campus OVERLAP_SHARE) | 'huff' (theo khoảng cách)
+ALLOCATION_MODE = globals().get('ALLOCATION_MODE', 'flat')
+HUFF_DECAY = globals().get('HUFF_DECAY', 2.0)
+HUFF_MODEL = globals().get('HUFF_MODEL', 'power')
+COVERAGE_RADIUS_KM = globals().get('COVERAGE_RADIUS_KM', 3)
+CALIBRATE_PENETRATION = globals().get('CALIBRATE_PENETRATION', False)
+USE_CALIBRATED_PENETRATION = globals().get('USE_CALIBRATED_PENETRATION', False)
+CALIBRATION_BAND_KM = globals().get('CALIBRATION_BAND_KM', 1.0)
+
 # ===== BƯỚC 4: PHÂN TÍCH TAM (TOTAL ADDRESSABLE MARKET) =====
 print("\n" + "="*80)
 print("BƯỚC 4: PHÂN TÍCH TAM (TOTAL ADDRESSABLE MARKET)")
@@ -151,107 +168,116 @@ print("="*80)
 
 print("\n📈 Đang phân tích TAM (Total Addressable Market)...")
 
-# 4.1. Tính số học sinh exclusive và shared cho mỗi campus
+# 4.1. Tính số học sinh exclusive và shared cho mỗi campus (rút gọn trên membership)
 tam_analysis = {}
 
+# Số học sinh mỗi trường: cột chuẩn từ schema (giống bước 5/6)
+school_students = coverage_membership.students
+
+exclusive_mask = coverage_membership.exclusive_mask
+shared_mask = coverage_membership.shared_mask
+
+campus_exclusive_students = coverage_membership.campus_sum(school_students, exclusive_mask)
+campus_shared_students = coverage_membership.campus_sum(school_students, shared_mask)
+campus_exclusive_schools = coverage_membership.campus_school_counts(exclusive_mask)
+campus_shared_schools = coverage_membership.campus_school_counts(shared_mask)
+
+# Phần học sinh shared tính vào TAM từng campus
+if ALLOCATION_MODE == 'huff':
+    huff_shares = coverage_membership.huff_shares(HUFF_DECAY, HUFF_MODEL)
+    campus_allocated_shared = coverage_membership.campus_allocation(huff_shares, school_students, shared_mask)
+else:
+    campus_allocated_shared = OVERLAP_SHARE * campus_shared_students
+
 for campus_code in campus_codes:
-    # Initialize counters
-    exclusive_students = 0
-    shared_students = 0
-    exclusive_schools = []
-    shared_schools = []
-    
-    # Get coverage data for this campus
-    coverage_data = coverage_results.get(campus_code, {})
-    schools_in_coverage = coverage_data.get('schools_df', pd.DataFrame())
-    
-    # Process each school in coverage
-    for idx, school in schools_in_coverage.iterrows():
-        school_name = school['Tên trường']
-        
-        # Try multiple column names for student count
-        student_count = 0
-        for col in ['Tổng học sinh 2023', 'Số lượng', 'Số học sinh']:
-            if col in school:
-                value = school.get(col, 0)
-                if pd.notna(value):
-                    try:
-                        student_count = int(value)
-                        break
-                    except:
-                        pass
-        
-        # Default if no valid count found
-        if student_count == 0:
-            student_count = 500  # Default value from your file 01
-        
-        # Find school classification
-        # Handle both simple and unique key formats
-        school_class = None
-        
-        # Try direct name lookup first (for backward compatibility)
-        if school_name in school_classification:
-            school_class = school_classification[school_name]
-        else:
-            # Try with unique key format
-            school_key = f"{school_name}_{idx}"
-            if school_key in school_classification:
-                school_class = school_classification[school_key]
-                # Extract the classification data
-                school_class = {
-                    'campuses': school_class.get('campuses', []),
-                    'type': school_class.get('type', 'unknown')
-                }
-            else:
-                # Fallback: search through all classifications
-                for key, data in school_classification.items():
-                    if isinstance(data, dict) and data.get('original_name') == school_name:
-                        if data.get('index') == idx:
-                            school_class = data
-                            break
-        
-        if school_class:
-            # Check if this school is exclusive to this campus
-            if school_class.get('type') == 'exclusive' and campus_code in school_class.get('campuses', []):
-                exclusive_students += student_count
-                exclusive_schools.append(school_name)
-            elif school_class.get('type') == 'shared' and campus_code in school_class.get('campuses', []):
-                shared_students += student_count
-                shared_schools.append(school_name)
-    
+    j = coverage_membership.campus_index[campus_code]
+    exclusive_students = int(campus_exclusive_students[j])
+    shared_students = int(campus_shared_students[j])
+
     # Store results
     tam_analysis[campus_code] = {
         'exclusive_students': exclusive_students,
         'shared_students': shared_students,
-        'exclusive_schools': len(exclusive_schools),
-        'shared_schools': len(shared_schools),
+        'exclusive_schools': int(campus_exclusive_schools[j]),
+        'shared_schools': int(campus_shared_schools[j]),
+        'allocated_shared_students': float(campus_allocated_shared[j]),
         'total_students': exclusive_students + shared_students
     }
 
 # 4.2. Calculate TAM for each campus
 print("\n📊 Công thức tính TAM:")
-print("   TAM = (Học sinh exclusive + 50% × Học sinh shared) × Penetration Rate")
-print("\n📊 Chi tiết TAM cho từng campus:")
+if ALLOCATION_MODE == 'huff':
+    print(f"   TAM = (Học sinh exclusive + Σ học sinh shared × tỷ lệ Huff) × Penetration Rate")
+    print(f"   Tỷ lệ Huff: {HUFF_MODEL}, decay = {HUFF_DECAY}")
+else:
+    print(f"   TAM = (Học sinh exclusive + {OVERLAP_SHARE:.0%} × Học sinh shared) × Penetration Rate")
+
+# Hiệu chỉnh penetration từ học viên thực tế (# of Active Students + tọa độ nhà học viên)
+campus_rates = {}
+penetration_calibration_df = penetration_band_df = None
+if CALIBRATE_PENETRATION or USE_CALIBRATED_PENETRATION:
+    student_assignment_df = globals().get('student_assignment_df')
+    campuses_df = globals().get('campuses_df')
+    if student_assignment_df is None or campuses_df is None:
+        print("\n⚠️ Thiếu tọa độ học viên / campus (bước 1), dùng PENETRATION_RATE cố định")
+    else:
+        students_df = globals().get('students_df')
+        active = active_students(campuses_df, students_df)
+
+        # Vùng phủ theo mạng đường (bước 2): học viên trong vùng phủ = tới campus đang học trong số phút
+        # catchment, cùng định nghĩa với trường trong membership (không dùng bán kính đường thẳng)
+        catchment_radius_km, student_inside = COVERAGE_RADIUS_KM, None
+        coverage_catchment = globals().get('coverage_catchment', ('radius',))
+        if coverage_catchment[0] == 'road':
+            _, road_file, _, _, road_profile, catchment_minutes = coverage_catchment
+            road_graph = RoadGraph.load(road_file, road_profile)
+            student_inside = road_catchment_mask(
+                road_graph, student_assignment_df, students_df, campuses_df, catchment_minutes
+            )
+            catchment_radius_km = None
+            print(f"\n🛣️  Hiệu chỉnh theo vùng phủ đường {catchment_minutes} phút: "
+                  f"{student_inside.sum():,} học viên trong vùng phủ campus đang học")
+
+        penetration_calibration_df = calibrate_penetration(
+            campus_codes,
+            [tam_analysis[code]['exclusive_students'] + tam_analysis[code]['allocated_shared_students']
+             for code in campus_codes],
+            active, student_assignment_df, COVERAGE_RADIUS_KM, PENETRATION_RATE, inside=student_inside
+        )
+        penetration_band_df = distance_band_penetration(
+            coverage_membership, student_assignment_df, active,
+            band_km=CALIBRATION_BAND_KM, radius_km=catchment_radius_km, inside=student_inside
+        )
+        observed = penetration_calibration_df[penetration_calibration_df['Source'] == 'observed']
+        print(f"\n🎯 Penetration hiệu chỉnh: {len(observed)}/{len(penetration_calibration_df)} campus có số liệu, "
+              f"trung vị {observed['Observed Rate'].median():.2%} (cấu hình {PENETRATION_RATE:.2%})")
+        if USE_CALIBRATED_PENETRATION:
+            campus_rates = dict(zip(penetration_calibration_df['Campus Code'],
+                                    penetration_calibration_df['Calibrated Rate']))
+            print("   • TAM dùng penetration theo từng campus")
 
-penetration_rate = 0.0162  # 1.62%
+print("\n📊 Chi tiết TAM cho từng campus:")
 
 for campus_code, data in tam_analysis.items():
     exclusive = data['exclusive_students']
     shared = data['shared_students']
+    allocated_shared = data['allocated_shared_students']
+    penetration_rate = campus_rates.get(campus_code, PENETRATION_RATE)
     
     # TAM calculation
-    tam = (exclusive + 0.5 * shared) * penetration_rate
+    tam = (exclusive + allocated_shared) * penetration_rate
     
     # Store TAM
+    data['penetration_rate'] = penetration_rate
     data['tam'] = tam
-    data['tam_base'] = exclusive + 0.5 * shared
+    data['tam_base'] = exclusive + allocated_shared
     
     # Print details
     print(f"\n📍 {campus_code}:")
     print(f"   • Exclusive: {exclusive:,} học sinh ({data['exclusive_schools']} trường)")
-    print(f"   • Shared: {shared:,} học sinh ({data['shared_schools']} trường)")
+    print(f"   • Shared: {shared:,} học sinh ({data['shared_schools']} trường), tính vào TAM: {allocated_shared:,.0f}")
     print(f"   • TAM Base: {data['tam_base']:,.0f} học sinh")
-    print(f"   • TAM (1.62%): {tam:,.0f} học sinh")
+    print(f"   • TAM ({penetration_rate:.2%}): {tam:,.0f} học sinh")
 
 # 4.3. Summary statistics
 total_tam = sum(data['tam'] for data in tam_analysis.values())
@@ -282,4 +308,6 @@ print("\n✅ Hoàn thành phân tích TAM!")
 globals()['tam_analysis'] = tam_analysis
 globals()['tam_df'] = tam_df
 # Also export as tam_results for compatibility
-globals()['tam_results'] = tam_analysis
\ No newline at end of file
+globals()['tam_results'] = tam_analysis
+globals()['penetration_calibration_df'] = penetration_calibration_df
+globals()['penetration_band_df'] = penetration_band_df
\ No newline at end of file
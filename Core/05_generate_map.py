@@ -7,28 +7,78 @@ Generate interactive map with COMPLETE VALIDATION
 """
 
 import folium
+import branca
 from folium import plugins
 import pandas as pd
 import numpy as np
 from shapely.geometry import MultiPoint
-from geopy.distance import geodesic
 import os
 
+from distance_engine import distance_km, distance_matrix, coverage_mask
+from heat_surface import heat_surface as compute_heat_surface, HEAT_COLORS as HEAT_SURFACE_COLORS
+
 print("🗺️ Đang tạo bản đồ với COMPLETE VALIDATION...")
 
+# Kernel khoảng cách dùng chung với bước 2/3 (DISTANCE_METRIC)
+DISTANCE_METRIC = globals().get('DISTANCE_METRIC', 'haversine')
+SKIP_REVALIDATION = globals().get('SKIP_REVALIDATION', False)
+ROAD_CATCHMENT = globals().get('coverage_catchment', ('radius',))[0] == 'road'
+OUTPUT_DIR = globals().get('OUTPUT_DIR', './Output')
+HEAT_SURFACE_CELL_KM = globals().get('HEAT_SURFACE_CELL_KM', 0)
+# 'markers': mỗi trường 1 marker + popup HTML riêng | 'fast': canvas + cluster, dữ liệu trường là mảng JSON theo layer
+MAP_RENDER_MODES = ('markers', 'fast')
+MAP_RENDER_MODE = globals().get('MAP_RENDER_MODE', 'markers')
+if MAP_RENDER_MODE not in MAP_RENDER_MODES:
+    raise ValueError(f"MAP_RENDER_MODE không hợp lệ: {MAP_RENDER_MODE} (chọn {MAP_RENDER_MODES})")
+FAST_RENDER = MAP_RENDER_MODE == 'fast'
+
+# Marker trường công cho FastMarkerCluster: row = [lat, lon, tên, học sinh], popup tạo khi click
+ALL_SCHOOLS_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: 3, color: 'gray', weight: 1, fillColor: 'gray', fillOpacity: 0.6});
+    marker.bindPopup(function () {
+        var popup = document.createElement('div');
+        var name = document.createElement('b');
+        name.textContent = row[2];
+        popup.append('🏫 ', name, document.createElement('br'),
+                     '👥 ' + Math.round(row[3]).toLocaleString() + ' học sinh');
+        return popup;
+    });
+    return marker;
+}
+"""
+
+# Marker trường exclusive / shared: row = [lat, lon, tên, học sinh, màu, campus phủ, khoảng cách], popup tạo khi click
+CLASSIFIED_SCHOOLS_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: Math.max(4, Math.min(12, row[3] / 300)), color: row[4], weight: 2,
+         fillColor: row[4], fillOpacity: 0.7});
+    marker.bindPopup(function () {
+        var popup = document.createElement('div');
+        var name = document.createElement('b');
+        name.textContent = row[2];
+        name.style.color = row[4];
+        popup.append(name, document.createElement('br'),
+                     (row[5].length > 1 ? 'Shared' : 'Exclusive') + ' - '
+                     + Math.round(row[3]).toLocaleString() + ' học sinh', document.createElement('br'),
+                     'Thuộc campus: ' + row[5].join(', '), document.createElement('br'),
+                     'Khoảng cách: ' + row[6]);
+        return popup;
+    }, {maxWidth: 360});
+    return marker;
+}
+"""
+
 # ===============================================================================
 # IMPORT VALIDATION MODULE
 # ===============================================================================
 
 # Embed validation functions directly
 def calculate_distance_strict(lat1, lon1, lat2, lon2):
-    """Tính khoảng cách chặt chẽ"""
-    try:
-        if pd.isna(lat1) or pd.isna(lon1) or pd.isna(lat2) or pd.isna(lon2):
-            return float('inf')
-        return geodesic((float(lat1), float(lon1)), (float(lat2), float(lon2))).km
-    except:
-        return float('inf')
+    """Tính khoảng cách chặt chẽ (cùng kernel với bước 2)"""
+    return distance_km(lat1, lon1, lat2, lon2, DISTANCE_METRIC)
 
 def validate_and_clean_school_classification(school_classification, campuses_df, schools_df, radius_km):
     """Validation 1: Lọc school_classification với CORRECT RECLASSIFICATION LOGIC"""
@@ -37,13 +87,18 @@ def validate_and_clean_school_classification(school_classification, campuses_df,
     cleaned_classification = {}
     stats = {'removed': 0, 'reclassified': 0, 'kept': 0}
     
-    for school_name, classification in school_classification.items():
-        school_data = schools_df[schools_df['Tên trường'] == school_name]
-        if school_data.empty:
+    # Tọa độ campus: tra cứu 1 lần thay vì lọc campuses_df cho từng trường
+    campus_coords = {}
+    for _, campus in campuses_df.drop_duplicates('Campus Code').iterrows():
+        campus_coords[campus['Campus Code']] = (campus['lat'], campus['lon'])
+    
+    for school_id, classification in school_classification.items():
+        if school_id < 0 or school_id >= len(schools_df):
             stats['removed'] += 1
             continue
         
-        school = school_data.iloc[0]
+        school = schools_df.iloc[school_id]
+        school_name = school['Tên trường']
         if pd.isna(school['lat']) or pd.isna(school['lon']):
             stats['removed'] += 1
             continue
@@ -53,14 +108,13 @@ def validate_and_clean_school_classification(school_classification, campuses_df,
         valid_campuses = []
         
         for campus_code in assigned_campuses:
-            campus_data = campuses_df[campuses_df['Campus Code'] == campus_code]
-            if campus_data.empty:
+            if campus_code not in campus_coords:
                 continue
             
-            campus = campus_data.iloc[0]
+            campus_lat, campus_lon = campus_coords[campus_code]
             distance = calculate_distance_strict(
                 school['lat'], school['lon'],
-                campus['lat'], campus['lon']
+                campus_lat, campus_lon
             )
             
             if distance <= radius_km:
@@ -82,7 +136,8 @@ def validate_and_clean_school_classification(school_classification, campuses_df,
                 print(f"   ✅ KEEP: {school_name} exclusive")
                 stats['kept'] += 1
             
-            cleaned_classification[school_name] = {
+            cleaned_classification[school_id] = {
+                **classification,
                 'type': 'exclusive',  # LUÔN exclusive nếu 1 campus
                 'campuses': valid_campuses
             }
@@ -96,7 +151,8 @@ def validate_and_clean_school_classification(school_classification, campuses_df,
                 print(f"   ✅ KEEP: {school_name} shared")
                 stats['kept'] += 1
             
-            cleaned_classification[school_name] = {
+            cleaned_classification[school_id] = {
+                **classification,
                 'type': 'shared',  # LUÔN shared nếu >1 campus
                 'campuses': valid_campuses
             }
@@ -123,24 +179,22 @@ def validate_and_clean_coverage_results(coverage_results, campuses_df, radius_km
             cleaned_coverage[campus_code] = coverage_data.copy()
             continue
         
-        # Filter schools
-        valid_schools = []
-        for _, school in schools_df_original.iterrows():
-            if pd.isna(school['lat']) or pd.isna(school['lon']):
-                continue
-            
-            distance = calculate_distance_strict(
-                school['lat'], school['lon'],
-                campus_lat, campus_lon
-            )
-            
-            if distance <= radius_km:
-                school_copy = school.copy()
-                school_copy['validated_distance'] = distance
-                valid_schools.append(school_copy)
+        # Filter schools (vector hóa theo campus)
+        school_lats = pd.to_numeric(schools_df_original['lat'], errors='coerce').to_numpy(dtype=float)
+        school_lons = pd.to_numeric(schools_df_original['lon'], errors='coerce').to_numpy(dtype=float)
+        distances = distance_matrix(
+            [float(campus_lat)], [float(campus_lon)], school_lats, school_lons, DISTANCE_METRIC
+        )
+        in_radius = coverage_mask(
+            distances, [float(campus_lat)], [float(campus_lon)], school_lats, school_lons,
+            radius_km, DISTANCE_METRIC
+        )[0]
         
         # Update coverage
-        valid_schools_df = pd.DataFrame(valid_schools) if valid_schools else pd.DataFrame()
+        valid_schools_df = schools_df_original[in_radius].copy()
+        valid_schools_df['validated_distance'] = distances[0, in_radius]
+        if valid_schools_df.empty:
+            valid_schools_df = pd.DataFrame()
         new_coverage = coverage_data.copy()
         new_coverage['schools_df'] = valid_schools_df
         new_coverage['num_schools'] = len(valid_schools_df)
@@ -163,7 +217,7 @@ required_vars = ['campuses_df', 'schools_df', 'coverage_results', 'tam_results',
 missing_vars = [v for v in required_vars if v not in globals()]
 if missing_vars:
     print(f"❌ Thiếu biến: {missing_vars}")
-    exit()
+    raise NameError(f"Thiếu biến: {missing_vars}")
 
 # Campus selection info
 use_selection = globals().get('USE_CAMPUS_SELECTION', False)
@@ -179,55 +233,63 @@ print(f"   • Không trường nào ngoài radius được classify")
 # RUN VALIDATION
 # ===============================================================================
 
-print("\n🚀 RUNNING COMPLETE VALIDATION...")
-
-# Step 1: Clean school_classification
-original_school_classification = school_classification.copy()
-cleaned_school_classification = validate_and_clean_school_classification(
-    school_classification, campuses_df, schools_df, COVERAGE_RADIUS_KM
-)
+if SKIP_REVALIDATION:
+    # Bước 2/3 đã dùng cùng kernel khoảng cách -> không cần tính lại
+    print(f"\n⏭️  SKIP REVALIDATION: dùng trực tiếp kết quả bước 2/3 (metric: {DISTANCE_METRIC})")
+    original_school_classification = school_classification.copy()
+elif ROAD_CATCHMENT:
+    # Vùng phủ theo thời gian đi đường (bước 2): không lọc lại theo bán kính đường thẳng
+    print(f"\n⏭️  SKIP REVALIDATION: vùng phủ theo mạng đường, không lọc theo bán kính {COVERAGE_RADIUS_KM} km")
+    original_school_classification = school_classification.copy()
+else:
+    print("\n🚀 RUNNING COMPLETE VALIDATION...")
+
+    # Step 1: Clean school_classification
+    original_school_classification = school_classification.copy()
+    cleaned_school_classification = validate_and_clean_school_classification(
+        school_classification, campuses_df, schools_df, COVERAGE_RADIUS_KM
+    )
 
-# DEBUG: Check reclassification results
-print(f"\n🔍 DEBUG RECLASSIFICATION RESULTS:")
-exclusive_count = sum(1 for d in cleaned_school_classification.values() if d['type'] == 'exclusive')
-shared_count = sum(1 for d in cleaned_school_classification.values() if d['type'] == 'shared')
-print(f"   • Final exclusive: {exclusive_count}")
-print(f"   • Final shared: {shared_count}")
-print(f"   • Total: {len(cleaned_school_classification)}")
-
-# Sample check some schools
-print(f"\n🔍 SAMPLE VALIDATION CHECK:")
-sample_schools = list(cleaned_school_classification.items())[:5]
-for school_name, classification in sample_schools:
-    school_type = classification['type']
-    campuses = classification['campuses']
-    print(f"   • {school_name}: {school_type} ({len(campuses)} campus - {campuses})")
-    
-    # Verify distances
-    school_data = schools_df[schools_df['Tên trường'] == school_name]
-    if not school_data.empty:
-        school = school_data.iloc[0]
-        distances = []
-        for campus_code in campuses:
-            campus_data = campuses_df[campuses_df['Campus Code'] == campus_code]
-            if not campus_data.empty:
-                campus = campus_data.iloc[0]
-                distance = calculate_distance_strict(
-                    school['lat'], school['lon'],
-                    campus['lat'], campus['lon']
-                )
-                distances.append(f"{campus_code}:{distance:.2f}km")
-        print(f"     Distances: {', '.join(distances)}")
-
-# Step 2: Clean coverage_results  
-original_coverage_results = coverage_results.copy()
-cleaned_coverage_results = validate_and_clean_coverage_results(
-    coverage_results, campuses_df, COVERAGE_RADIUS_KM
-)
+    # DEBUG: Check reclassification results
+    print(f"\n🔍 DEBUG RECLASSIFICATION RESULTS:")
+    exclusive_count = sum(1 for d in cleaned_school_classification.values() if d['type'] == 'exclusive')
+    shared_count = sum(1 for d in cleaned_school_classification.values() if d['type'] == 'shared')
+    print(f"   • Final exclusive: {exclusive_count}")
+    print(f"   • Final shared: {shared_count}")
+    print(f"   • Total: {len(cleaned_school_classification)}")
+
+    # Sample check some schools
+    print(f"\n🔍 SAMPLE VALIDATION CHECK:")
+    sample_schools = list(cleaned_school_classification.items())[:5]
+    for school_id, classification in sample_schools:
+        school_type = classification['type']
+        campuses = classification['campuses']
+        print(f"   • {classification.get('name', school_id)}: {school_type} ({len(campuses)} campus - {campuses})")
+    
+        # Verify distances
+        if 0 <= school_id < len(schools_df):
+            school = schools_df.iloc[school_id]
+            distances = []
+            for campus_code in campuses:
+                campus_data = campuses_df[campuses_df['Campus Code'] == campus_code]
+                if not campus_data.empty:
+                    campus = campus_data.iloc[0]
+                    distance = calculate_distance_strict(
+                        school['lat'], school['lon'],
+                        campus['lat'], campus['lon']
+                    )
+                    distances.append(f"{campus_code}:{distance:.2f}km")
+            print(f"     Distances: {', '.join(distances)}")
+
+    # Step 2: Clean coverage_results  
+    original_coverage_results = coverage_results.copy()
+    cleaned_coverage_results = validate_and_clean_coverage_results(
+        coverage_results, campuses_df, COVERAGE_RADIUS_KM
+    )
 
-# Update global variables
-school_classification = cleaned_school_classification
-coverage_results = cleaned_coverage_results
+    # Update global variables
+    school_classification = cleaned_school_classification
+    coverage_results = cleaned_coverage_results
 
 print(f"\n✅ VALIDATION COMPLETED:")
 print(f"   • school_classification: {len(original_school_classification)} → {len(school_classification)}")
@@ -263,20 +325,12 @@ def calculate_campus_stats_validated(campus_code):
     total_schools = len(schools_df_coverage)
     total_students = int(schools_df_coverage['Tổng học sinh 2023'].sum())
     
-    # Phân loại từ validated school_classification
-    exclusive_schools, shared_schools = [], []
-    
-    for _, school in schools_df_coverage.iterrows():
-        school_name = school['Tên trường']
-        classification = school_classification.get(school_name, {'type': 'exclusive'})
-        
-        if classification['type'] == 'exclusive':
-            exclusive_schools.append(school)
-        else:
-            shared_schools.append(school)
-    
-    exclusive_df = pd.DataFrame(exclusive_schools)
-    shared_df = pd.DataFrame(shared_schools)
+    # Phân loại từ validated school_classification (tra theo school_id)
+    school_types = schools_df_coverage['school_id'].map(
+        lambda school_id: school_classification.get(school_id, {'type': 'exclusive'})['type']
+    )
+    exclusive_df = schools_df_coverage[school_types == 'exclusive']
+    shared_df = schools_df_coverage[school_types != 'exclusive']
     
     exclusive_students = int(exclusive_df['Tổng học sinh 2023'].sum()) if len(exclusive_df) > 0 else 0
     shared_students = int(shared_df['Tổng học sinh 2023'].sum()) if len(shared_df) > 0 else 0
@@ -306,7 +360,8 @@ center_lon = campuses_df['lon'].mean()
 m = folium.Map(
     location=[center_lat, center_lon],
     zoom_start=12,
-    tiles='OpenStreetMap'
+    tiles='OpenStreetMap',
+    prefer_canvas=FAST_RENDER
 )
 
 # Feature groups
@@ -483,10 +538,16 @@ schools_added = 0
 schools_processed = 0
 validation_errors = 0
 
-for school_name, classification in school_classification.items():
+campus_coords = {}
+fast_school_rows = {}  # FAST_RENDER: layer -> danh sách row cho CLASSIFIED_SCHOOLS_CALLBACK
+for _, campus in campuses_df.drop_duplicates('Campus Code').iterrows():
+    campus_coords[campus['Campus Code']] = (campus['lat'], campus['lon'])
+
+for school_id, classification in school_classification.items():
     schools_processed += 1
     school_type = classification['type']
     covering_campuses = classification['campuses']
+    school_name = classification.get('name', school_id)
     
     # SAFETY CHECK: Verify logic consistency
     if len(covering_campuses) == 1 and school_type != 'exclusive':
@@ -504,11 +565,10 @@ for school_name, classification in school_classification.items():
         classification['type'] = 'shared'
     
     # Tìm school data
-    school_data = schools_df[schools_df['Tên trường'] == school_name]
-    if school_data.empty:
+    if school_id < 0 or school_id >= len(schools_df):
         continue
     
-    school = school_data.iloc[0]
+    school = schools_df.iloc[school_id]
     if pd.isna(school['lat']) or pd.isna(school['lon']):
         continue
     
@@ -517,18 +577,17 @@ for school_name, classification in school_classification.items():
     distances_info = []
     
     for campus_code in covering_campuses:
-        campus_data = campuses_df[campuses_df['Campus Code'] == campus_code]
-        if not campus_data.empty:
-            campus = campus_data.iloc[0]
+        if campus_code in campus_coords:
+            campus_lat, campus_lon = campus_coords[campus_code]
             distance = calculate_distance_strict(
                 school['lat'], school['lon'],
-                campus['lat'], campus['lon']
+                campus_lat, campus_lon
             )
             min_distance = min(min_distance, distance)
             distances_info.append((campus_code, distance))
     
-    # This should NOT happen after validation, but safety check
-    if min_distance > COVERAGE_RADIUS_KM:
+    # This should NOT happen after validation, but safety check (vùng phủ theo mạng đường: không áp bán kính)
+    if min_distance > COVERAGE_RADIUS_KM and not ROAD_CATCHMENT:
         print(f"   ❌ ERROR: {school_name} still invalid after validation! min_distance={min_distance:.2f}km")
         validation_errors += 1
         continue
@@ -536,43 +595,44 @@ for school_name, classification in school_classification.items():
     # Create popup with validation info
     distances_str = ', '.join([f"{c}:{d:.2f}km" for c, d in distances_info])
     
-    popup_content = f"""
-    <div style="width: 340px;">
-        <h4 style="margin: 0; color: {'orange' if school_type == 'shared' else get_campus_color(covering_campuses[0])};">{school['Tên trường']}</h4>
-        <hr style="margin: 5px 0;">
-        
-        <div style="background-color: #e8f5e8; padding: 6px; border-radius: 4px; margin: 5px 0;">
-            <h5 style="margin: 0 0 3px 0; color: #2e7d32;">✅ VALIDATED SCHOOL</h5>
-            <div style="font-size: 10px;">
-                <b>Classification:</b> {school_type} (validated)<br>
-                <b>Logic:</b> {len(covering_campuses)} campus → {school_type}<br>
-                <b>Guarantee:</b> Trong radius của tất cả assigned campus
+    if not FAST_RENDER:
+        popup_content = f"""
+        <div style="width: 340px;">
+            <h4 style="margin: 0; color: {'orange' if school_type == 'shared' else get_campus_color(covering_campuses[0])};">{school['Tên trường']}</h4>
+            <hr style="margin: 5px 0;">
+            
+            <div style="background-color: #e8f5e8; padding: 6px; border-radius: 4px; margin: 5px 0;">
+                <h5 style="margin: 0 0 3px 0; color: #2e7d32;">✅ VALIDATED SCHOOL</h5>
+                <div style="font-size: 10px;">
+                    <b>Classification:</b> {school_type} (validated)<br>
+                    <b>Logic:</b> {len(covering_campuses)} campus → {school_type}<br>
+                    <b>Guarantee:</b> Trong radius của tất cả assigned campus
+                </div>
             </div>
-        </div>
-        
-        <div style="background-color: #f0f8ff; padding: 6px; border-radius: 4px; margin: 5px 0;">
-            <h5 style="margin: 0 0 3px 0; color: #2e5cb8;">📏 Distance Validation</h5>
-            <div style="font-size: 10px;">
-                <b>Distances:</b> {distances_str}<br>
-                <b>Min distance:</b> {min_distance:.2f}km<br>
-                <b>Radius limit:</b> {COVERAGE_RADIUS_KM}km<br>
-                <b>Status:</b> ✅ Valid
+            
+            <div style="background-color: #f0f8ff; padding: 6px; border-radius: 4px; margin: 5px 0;">
+                <h5 style="margin: 0 0 3px 0; color: #2e5cb8;">📏 Distance Validation</h5>
+                <div style="font-size: 10px;">
+                    <b>Distances:</b> {distances_str}<br>
+                    <b>Min distance:</b> {min_distance:.2f}km<br>
+                    <b>Radius limit:</b> {COVERAGE_RADIUS_KM}km<br>
+                    <b>Status:</b> ✅ Valid
+                </div>
             </div>
+            
+            <b>Trạng thái:</b> {school_type.title()}<br>
+            <b>Số học sinh:</b> {school['Tổng học sinh 2023']:,.0f}<br>
+            <b>Thuộc campus:</b> {', '.join(covering_campuses)}<br>
+            <b>Khoảng cách min:</b> {min_distance:.2f}km<br>
+            <hr style="margin: 5px 0;">
+            <small style="color: #666;">
+                {'✅ Thị trường độc quyền' if school_type == 'exclusive' else '⚔️ Vùng cạnh tranh (validated)'}
+            </small>
+            <small style="color: #999; font-size: 9px;"><br>
+                Logic: {len(covering_campuses)} campus = {school_type}
+            </small>
         </div>
-        
-        <b>Trạng thái:</b> {school_type.title()}<br>
-        <b>Số học sinh:</b> {school['Tổng học sinh 2023']:,.0f}<br>
-        <b>Thuộc campus:</b> {', '.join(covering_campuses)}<br>
-        <b>Khoảng cách min:</b> {min_distance:.2f}km<br>
-        <hr style="margin: 5px 0;">
-        <small style="color: #666;">
-            {'✅ Thị trường độc quyền' if school_type == 'exclusive' else '⚔️ Vùng cạnh tranh (validated)'}
-        </small>
-        <small style="color: #999; font-size: 9px;"><br>
-            Logic: {len(covering_campuses)} campus = {school_type}
-        </small>
-    </div>
-    """
+        """
     
     marker_size = max(4, min(12, school['Tổng học sinh 2023'] / 300))
     
@@ -585,20 +645,34 @@ for school_name, classification in school_classification.items():
         target_group = shared_schools_group
         marker_color = 'orange'  # Màu cam cho shared
     
-    # Tạo marker với màu đúng
-    folium.CircleMarker(
-        location=[float(school['lat']), float(school['lon'])],
-        radius=marker_size,
-        color=marker_color,      # Sử dụng marker_color đã định nghĩa
-        fillColor=marker_color,  # Thêm fillColor để đảm bảo fill cùng màu
-        weight=2,
-        fill=True,
-        fillOpacity=0.7,
-        popup=folium.Popup(popup_content, max_width=360)
-    ).add_to(target_group)
+    if FAST_RENDER:
+        # Chỉ giữ dữ liệu, marker + popup tạo phía trình duyệt
+        fast_school_rows.setdefault(target_group, []).append([
+            round(float(school['lat']), 6), round(float(school['lon']), 6), str(school['Tên trường']),
+            float(school['Tổng học sinh 2023']), marker_color, list(covering_campuses), distances_str
+        ])
+    else:
+        # Tạo marker với màu đúng
+        folium.CircleMarker(
+            location=[float(school['lat']), float(school['lon'])],
+            radius=marker_size,
+            color=marker_color,      # Sử dụng marker_color đã định nghĩa
+            fillColor=marker_color,  # Thêm fillColor để đảm bảo fill cùng màu
+            weight=2,
+            fill=True,
+            fillOpacity=0.7,
+            popup=folium.Popup(popup_content, max_width=360)
+        ).add_to(target_group)
     
     schools_added += 1
 
+# 1 mảng JSON / layer; từ zoom ban đầu (12) trở lên không gom cụm để vẫn thấy màu campus từng trường
+for target_group, rows in fast_school_rows.items():
+    plugins.FastMarkerCluster(
+        rows, callback=CLASSIFIED_SCHOOLS_CALLBACK,
+        options={'disableClusteringAtZoom': 12, 'chunkedLoading': True}
+    ).add_to(target_group)
+
 print(f"\n📊 VALIDATED SCHOOL MARKERS:")
 print(f"   • Schools processed: {schools_processed}")
 print(f"   • Schools added: {schools_added}")
@@ -657,23 +731,72 @@ if 'overlap_details' in globals():
                 ).add_to(shared_schools_group)
 
 # Add all public schools layer
-for _, school in schools_df.iterrows():
-    if pd.isna(school['lat']) or pd.isna(school['lon']):
-        continue
-    
-    folium.CircleMarker(
-        location=[float(school['lat']), float(school['lon'])],
-        radius=2,
-        color="gray",
-        weight=1,
-        fill=True,
-        fill_opacity=0.6,
-        popup=folium.Popup(f"""
-        🏫 <b>{school['Tên trường']}</b><br>
-        👥 {school['Tổng học sinh 2023']:,.0f} học sinh<br>
-        <small style="color: #666;">Reference: All schools</small>
-        """, max_width=200)
+if FAST_RENDER:
+    # 1 mảng [lat, lon, tên, học sinh] + cluster: marker / popup chỉ tạo phía trình duyệt khi cần
+    located_schools = schools_df.dropna(subset=['lat', 'lon'])
+    all_schools_data = list(zip(
+        located_schools['lat'].astype(float).round(6).tolist(),
+        located_schools['lon'].astype(float).round(6).tolist(),
+        located_schools['Tên trường'].astype(str).tolist(),
+        located_schools['Tổng học sinh 2023'].fillna(0).astype(float).tolist(),
+    ))
+    plugins.FastMarkerCluster(
+        all_schools_data, callback=ALL_SCHOOLS_CALLBACK,
+        options={'disableClusteringAtZoom': 15, 'chunkedLoading': True}
     ).add_to(all_public_schools_group)
+else:
+    for _, school in schools_df.iterrows():
+        if pd.isna(school['lat']) or pd.isna(school['lon']):
+            continue
+
+        folium.CircleMarker(
+            location=[float(school['lat']), float(school['lon'])],
+            radius=2,
+            color="gray",
+            weight=1,
+            fill=True,
+            fill_opacity=0.6,
+            popup=folium.Popup(f"""
+            🏫 <b>{school['Tên trường']}</b><br>
+            👥 {school['Tổng học sinh 2023']:,.0f} học sinh<br>
+            <small style="color: #666;">Reference: All schools</small>
+            """, max_width=200)
+        ).add_to(all_public_schools_group)
+
+# TAM heat surface: TAM campus giả định tại từng ô lưới (so với các campus hiện có)
+heat_surface = None
+coverage_membership = globals().get('coverage_membership')
+if HEAT_SURFACE_CELL_KM and coverage_membership is not None:
+    print(f"\n🔥 Tạo TAM heat surface (ô {HEAT_SURFACE_CELL_KM * 1000:.0f} m)...")
+    heat_surface = compute_heat_surface(
+        schools_df['lat'], schools_df['lon'], coverage_membership.students,
+        coverage_membership.campus_counts, COVERAGE_RADIUS_KM, HEAT_SURFACE_CELL_KM,
+        overlap_share=globals().get('OVERLAP_SHARE', 0.5),
+        penetration_rate=globals().get('PENETRATION_RATE', 0.0162)
+    )
+    heat_peak_lat, heat_peak_lon, heat_peak_tam = heat_surface.peak()
+    print(f"   • Lưới {heat_surface.tam.shape[0]}×{heat_surface.tam.shape[1]}, "
+          f"TAM cao nhất {heat_peak_tam:,.0f} tại ({heat_peak_lat:.5f}, {heat_peak_lon:.5f})")
+
+    heat_surface_group = folium.FeatureGroup(name="🔥 TAM Heat Surface (campus mới)", show=True)
+    folium.raster_layers.ImageOverlay(
+        image=heat_surface.to_rgba(),
+        bounds=heat_surface.bounds,
+        mercator_project=True,
+        interactive=False,
+    ).add_to(heat_surface_group)
+    heat_surface_group.add_to(m)
+
+    heat_colormap = branca.colormap.LinearColormap(
+        [tuple(color / 255) for color in HEAT_SURFACE_COLORS[1:]], vmin=0, vmax=heat_peak_tam,
+        caption=f"TAM campus mới trong bán kính {COVERAGE_RADIUS_KM} km"
+    )
+    heat_colormap.add_to(m)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    heat_surface.save(os.path.join(OUTPUT_DIR, "TAM_Heat_Surface.npz"))
+elif HEAT_SURFACE_CELL_KM:
+    print("⚠️ Thiếu coverage_membership (bước 2), bỏ qua TAM heat surface")
 
 # Add all groups to map
 campus_locations_group.add_to(m)
@@ -779,9 +902,10 @@ m.get_root().html.add_child(folium.Element(legend_html))
 plugins.Fullscreen().add_to(m)
 
 # Save map
-os.makedirs("./Output", exist_ok=True)
-output_path = "./Output/Map_Campus_Multi_Validated.html"
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+output_path = os.path.join(OUTPUT_DIR, "Map_Campus_Multi_Validated.html")
 m.save(output_path)
+map_path = output_path
 
 print(f"\n✅ VALIDATED MAP CREATED: {output_path}")
 
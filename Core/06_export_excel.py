@@ -1,7 +1,13 @@
 import pandas as pd
 import xlsxwriter
 from datetime import datetime
+import os
 import numpy as np
+from membership import classification_matrix, overlap_products, shared_rows, mask_groups
+from radius_sweep import radius_sweep
+from tam_simulation import simulate_tam, default_spread
+from spatial_index import SchoolSpatialIndex
+from capacity_allocation import allocate_demand
 
 print("📊 Đang tạo báo cáo Excel với VALIDATED DATA...")
 
@@ -33,13 +39,26 @@ missing_vars = [v for v in required_vars if v not in globals()]
 if missing_vars:
     print(f"❌ Missing validated variables: {missing_vars}")
     print("⚠️ Run step 5 (validated map) first!")
-    exit()
+    raise NameError(f"Missing validated variables: {missing_vars}")
 
 # Get configuration
 PENETRATION_RATE = globals().get('PENETRATION_RATE', 0.0162)
 OVERLAP_SHARE = globals().get('OVERLAP_SHARE', 0.5)
 STUDENTS_PER_ROOM = globals().get('STUDENTS_PER_ROOM', 100)
 COVERAGE_RADIUS_KM = globals().get('COVERAGE_RADIUS_KM', 3)
+OUTPUT_DIR = globals().get('OUTPUT_DIR', './Output')
+SWEEP_RADII = globals().get('SWEEP_RADII', [])
+DISTANCE_METRIC = globals().get('DISTANCE_METRIC', 'haversine')
+ALLOCATION_MODE = globals().get('ALLOCATION_MODE', 'flat')
+HUFF_DECAY = globals().get('HUFF_DECAY', 2.0)
+HUFF_MODEL = globals().get('HUFF_MODEL', 'power')
+MONTE_CARLO_DRAWS = globals().get('MONTE_CARLO_DRAWS', 0)
+MONTE_CARLO_PENETRATION = globals().get('MONTE_CARLO_PENETRATION') or default_spread(PENETRATION_RATE, 0.3)
+MONTE_CARLO_OVERLAP = globals().get('MONTE_CARLO_OVERLAP') or default_spread(OVERLAP_SHARE, 0.4, upper=1.0)
+MONTE_CARLO_ENROLLMENT_CV = globals().get('MONTE_CARLO_ENROLLMENT_CV', 0.1)
+MONTE_CARLO_SEED = globals().get('MONTE_CARLO_SEED', 42)
+CAPACITY_ALLOCATION = globals().get('CAPACITY_ALLOCATION', False)
+USE_CALIBRATED_PENETRATION = globals().get('USE_CALIBRATED_PENETRATION', False)
 
 print(f"📋 Using validated data:")
 print(f"   • school_classification: {len(school_classification)} schools")
@@ -62,18 +81,16 @@ def recalculate_exclusive_students_validated():
         coverage_data = coverage_results[campus_code]
         schools_in_coverage = coverage_data.get('schools_df', pd.DataFrame())
         
-        for _, school in schools_in_coverage.iterrows():
-            school_name = school['Tên trường']
-            
+        for school_id, students in zip(schools_in_coverage.get('school_id', []),
+                                       schools_in_coverage.get('Tổng học sinh 2023', [])):
             # Check classification in validated school_classification
-            classification = school_classification.get(school_name, {})
+            classification = school_classification.get(school_id, {})
             school_type = classification.get('type', 'unknown')
             school_campuses = classification.get('campuses', [])
             
             # Only count if exclusive AND assigned to this campus
             if school_type == 'exclusive' and campus_code in school_campuses:
-                students = clean_numeric_value(school.get('Tổng học sinh 2023', 0))
-                exclusive_count += students
+                exclusive_count += clean_numeric_value(students)
         
         validated_exclusive_students[campus_code] = int(exclusive_count)
         print(f"   📍 {campus_code}: {exclusive_count:,} exclusive students")
@@ -90,6 +107,19 @@ def recalculate_tam_validated(validated_exclusive_students):
     
     validated_tam_results = {}
     
+    # Huff: học sinh trường shared chia theo khoảng cách (membership bước 2) thay vì OVERLAP_SHARE
+    huff_allocated = None
+    membership = globals().get('coverage_membership')
+    if huff_shares is not None:
+        allocated = membership.campus_allocation(huff_shares, school_mask=membership.shared_mask)
+        huff_allocated = dict(zip(membership.campus_codes, allocated))
+        print(f"   • Allocation: Huff ({HUFF_MODEL}, decay = {HUFF_DECAY})")
+    elif ALLOCATION_MODE == 'huff':
+        print("   ⚠️ Thiếu coverage_membership (bước 2), dùng OVERLAP_SHARE cho trường shared")
+    
+    if campus_rates:
+        print(f"   • Penetration: hiệu chỉnh theo campus ({len(campus_rates)} campus)")
+    
     for campus_code, coverage_data in coverage_results.items():
         # Get capacity
         campus_data = campuses_df[campuses_df['Campus Code'] == campus_code]
@@ -108,8 +138,11 @@ def recalculate_tam_validated(validated_exclusive_students):
         competition_students = max(0, total_students - exclusive_students)
         
         # Calculate TAM
-        addressable_market = exclusive_students + (competition_students * OVERLAP_SHARE)
-        tam = addressable_market * PENETRATION_RATE
+        if huff_allocated is not None and campus_code in huff_allocated:
+            addressable_market = exclusive_students + huff_allocated[campus_code]
+        else:
+            addressable_market = exclusive_students + (competition_students * OVERLAP_SHARE)
+        tam = addressable_market * campus_rates.get(campus_code, PENETRATION_RATE)
         
         # Calculate utilization
         utilization = tam / capacity if capacity > 0 else 0
@@ -138,7 +171,7 @@ def recalculate_tam_validated(validated_exclusive_students):
 # ===============================================================================
 
 def recalculate_overlap_matrix_validated():
-    """Tính lại overlap matrix từ validated data"""
+    """Tính lại overlap matrix từ validated data (Mᵀ·diag(students)·M)"""
     print("\n🔄 RECALCULATING overlap matrix từ validated data...")
     
     campus_codes = list(coverage_results.keys())
@@ -153,55 +186,168 @@ def recalculate_overlap_matrix_validated():
     
     validated_overlap_details = {}
     
-    # Calculate overlap between each pair of campuses
-    for i, campus1 in enumerate(campus_codes):
-        for j, campus2 in enumerate(campus_codes):
-            if i >= j:
-                if i == j:
-                    # Diagonal = total students of that campus
-                    validated_overlap_matrix.loc[campus1, campus2] = coverage_results[campus1]['total_students']
-                continue
-            
-            # Find schools that are shared between campus1 and campus2
-            shared_schools = []
-            
-            for school_name, classification in school_classification.items():
-                if classification.get('type') == 'shared':
-                    school_campuses = classification.get('campuses', [])
-                    if campus1 in school_campuses and campus2 in school_campuses:
-                        shared_schools.append(school_name)
-            
-            if shared_schools:
-                # Calculate overlap students
-                overlap_df = schools_df[schools_df['Tên trường'].isin(shared_schools)]
-                overlap_students = int(overlap_df['Tổng học sinh 2023'].sum())
-                
-                # Update matrix (symmetric)
-                validated_overlap_matrix.loc[campus1, campus2] = overlap_students
-                validated_overlap_matrix.loc[campus2, campus1] = overlap_students
-                
-                # Store details
-                overlap_key = f"{campus1}-{campus2}"
-                validated_overlap_details[overlap_key] = {
-                    'campus1': campus1,
-                    'campus2': campus2,
-                    'num_schools': len(shared_schools),
-                    'total_students': overlap_students,
-                    'schools': shared_schools
-                }
-                
-                print(f"   🟠 {campus1} ↔ {campus2}: {len(shared_schools)} schools, {overlap_students:,} students")
+    # Diagonal = total students of that campus
+    for campus_code in campus_codes:
+        validated_overlap_matrix.loc[campus_code, campus_code] = coverage_results[campus_code]['total_students']
+    
+    # Membership trường shared × campus + số học sinh theo school_id
+    shared_ids, shared_matrix = classification_matrix(school_classification, campus_codes, school_type='shared')
+    school_students = schools_df['Tổng học sinh 2023'].to_numpy(dtype=float)[shared_ids]
+    school_names = schools_df['Tên trường'].to_numpy()[shared_ids]
+    
+    # Bỏ qua cặp campus cách nhau > 2 × bán kính (tính ở bước 2)
+    candidate_campus_pairs = globals().get('campus_overlap_pairs')
+    if candidate_campus_pairs is not None:
+        campus_pos = {code: i for i, code in enumerate(campus_codes)}
+        candidate_campus_pairs = [
+            (campus_pos[c1], campus_pos[c2]) for c1, c2 in candidate_campus_pairs
+            if c1 in campus_pos and c2 in campus_pos
+        ]
+    
+    pair_students, pair_schools = overlap_products(shared_matrix, school_students, candidate_campus_pairs)
+    shared_csc = shared_matrix.tocsc()
+    
+    # Chỉ các cặp có trường chung
+    for i, j in zip(*np.nonzero(np.triu(pair_schools, k=1))):
+        campus1 = campus_codes[i]
+        campus2 = campus_codes[j]
+        
+        rows = shared_rows(shared_csc, i, j)
+        shared_schools = school_names[rows].tolist()
+        overlap_students = int(pair_students[i, j])
+        
+        # Update matrix (symmetric)
+        validated_overlap_matrix.loc[campus1, campus2] = overlap_students
+        validated_overlap_matrix.loc[campus2, campus1] = overlap_students
+        
+        # Store details
+        overlap_key = f"{campus1}-{campus2}"
+        validated_overlap_details[overlap_key] = {
+            'campus1': campus1,
+            'campus2': campus2,
+            'num_schools': len(shared_schools),
+            'total_students': overlap_students,
+            'schools': shared_schools,
+            'school_ids': [shared_ids[row] for row in rows]
+        }
+        
+        print(f"   🟠 {campus1} ↔ {campus2}: {len(shared_schools)} schools, {overlap_students:,} students")
     
     return validated_overlap_matrix, validated_overlap_details
 
+def recalculate_overlap_zones_validated():
+    """Vùng overlap k-campus từ validated data (nhóm trường theo bitmask tập campus)"""
+    print("\n🔄 RECALCULATING overlap zones từ validated data...")
+    
+    campus_codes = list(coverage_results.keys())
+    
+    school_ids, school_matrix = classification_matrix(school_classification, campus_codes)
+    school_students = schools_df['Tổng học sinh 2023'].to_numpy(dtype=float)[school_ids]
+    school_names = schools_df['Tên trường'].to_numpy()[school_ids]
+    
+    validated_overlap_zones = {}
+    for zone in mask_groups(school_matrix, school_students):
+        zone_campuses = [campus_codes[j] for j in zone['columns']]
+        validated_overlap_zones["_".join(zone_campuses)] = {
+            'campuses': zone_campuses,
+            'num_campuses': len(zone_campuses),
+            'num_schools': len(zone['rows']),
+            'total_students': int(zone['weight']),
+            'schools': school_names[zone['rows']].tolist(),
+            'school_ids': [school_ids[r] for r in zone['rows']]
+        }
+    
+    # Sắp: nhiều campus trước, rồi nhiều học sinh
+    validated_overlap_zones = dict(sorted(
+        validated_overlap_zones.items(),
+        key=lambda item: (-item[1]['num_campuses'], -item[1]['total_students'])
+    ))
+    
+    multi_way = [z for z in validated_overlap_zones.values() if z['num_campuses'] >= 3]
+    print(f"   🟣 {len(validated_overlap_zones)} zones, {len(multi_way)} zones ≥ 3 campuses")
+    
+    return validated_overlap_zones
+
 # ===============================================================================
 # RUN RECALCULATIONS
 # ===============================================================================
 
+# Huff: tỷ lệ chia trường shared dùng chung cho TAM validated và Monte Carlo
+coverage_membership = globals().get('coverage_membership')
+huff_shares = None
+if ALLOCATION_MODE == 'huff' and coverage_membership is not None:
+    huff_shares = coverage_membership.huff_shares(HUFF_DECAY, HUFF_MODEL)
+
+# Penetration hiệu chỉnh theo campus (bước 4), thiếu -> PENETRATION_RATE: TAM, Monte Carlo, capacity allocation
+campus_rates = {}
+calibration_df = globals().get('penetration_calibration_df')
+if USE_CALIBRATED_PENETRATION and calibration_df is not None:
+    campus_rates = dict(zip(calibration_df['Campus Code'], calibration_df['Calibrated Rate']))
+membership_rates = None
+if coverage_membership is not None:
+    membership_rates = np.array([campus_rates.get(code, PENETRATION_RATE) for code in coverage_membership.campus_codes])
+
 # Recalculate all metrics with validated data
 validated_exclusive_students = recalculate_exclusive_students_validated()
 validated_tam_results = recalculate_tam_validated(validated_exclusive_students)
 validated_overlap_matrix, validated_overlap_details = recalculate_overlap_matrix_validated()
+validated_overlap_zones = recalculate_overlap_zones_validated()
+
+# Sweep bán kính: coverage / overlap / TAM cho nhiều bán kính trong 1 lần truy vấn
+radius_sweep_df = radius_sweep_system_df = None
+if SWEEP_RADII:
+    print(f"\n📏 RADIUS SWEEP: {sorted(SWEEP_RADII)} km")
+    sweep_codes = [code for code in campus_codes if code in coverage_results]
+    sweep_rows = [campuses_df[campuses_df['Campus Code'] == code].iloc[0] for code in sweep_codes]
+    school_index = globals().get('school_index')
+    if school_index is None or school_index.metric != DISTANCE_METRIC:
+        school_index = SchoolSpatialIndex.from_dataframe(schools_df, metric=DISTANCE_METRIC)
+    radius_sweep_df, radius_sweep_system_df = radius_sweep(
+        school_index, sweep_codes,
+        [float(row['lat']) for row in sweep_rows], [float(row['lon']) for row in sweep_rows],
+        schools_df['Tổng học sinh 2023'].to_numpy(), SWEEP_RADII,
+        overlap_share=OVERLAP_SHARE, penetration_rate=PENETRATION_RATE
+    )
+    for _, sweep in radius_sweep_system_df.iterrows():
+        print(f"   • {sweep['Radius (km)']:g} km: {int(sweep['Covered Schools'])} trường, "
+              f"{int(sweep['Shared Schools'])} shared, TAM {sweep['Total TAM']:,.0f}")
+
+# Monte Carlo TAM: percentile theo campus, dùng lại membership của bước 2
+tam_simulation_df = tam_simulation_system_df = None
+if MONTE_CARLO_DRAWS and coverage_membership is not None:
+    print(f"\n🎲 MONTE CARLO TAM: {MONTE_CARLO_DRAWS:,} lượt rút (enrollment CV {MONTE_CARLO_ENROLLMENT_CV:.0%})")
+    simulation_capacity = (
+        campuses_df.drop_duplicates('Campus Code').set_index('Campus Code')
+        .get('capacity', pd.Series(dtype=float))
+        .reindex(coverage_membership.campus_codes).fillna(800).to_numpy()
+    )
+    tam_simulation_df, tam_simulation_system_df = simulate_tam(
+        coverage_membership, simulation_capacity, MONTE_CARLO_DRAWS,
+        MONTE_CARLO_PENETRATION, MONTE_CARLO_OVERLAP, MONTE_CARLO_ENROLLMENT_CV,
+        seed=MONTE_CARLO_SEED, shared_shares=huff_shares,
+        rate_scale=membership_rates / PENETRATION_RATE if campus_rates else None
+    )
+    total_row = tam_simulation_system_df.iloc[0]
+    print(f"   • Tổng TAM P5 / P50 / P95: {total_row['P5']:,.0f} / {total_row['P50']:,.0f} / {total_row['P95']:,.0f}")
+elif MONTE_CARLO_DRAWS:
+    print("⚠️ Thiếu coverage_membership (bước 2), bỏ qua Monte Carlo TAM")
+
+# Phân bổ nhu cầu trường -> campus trong bán kính theo capacity (min-cost, 2 pha LP)
+capacity_allocation_df = capacity_allocation_summary = None
+if CAPACITY_ALLOCATION and coverage_membership is not None:
+    allocation = allocate_demand(
+        coverage_membership,
+        coverage_membership.students * coverage_membership.school_mean(membership_rates, huff_shares),
+        [validated_tam_results.get(code, {}).get('capacity', 800) for code in coverage_membership.campus_codes]
+    )
+    capacity_allocation_df = allocation.campus_frame()
+    capacity_allocation_summary = allocation.summary()
+    print(f"\n🚚 CAPACITY ALLOCATION: phân bổ {capacity_allocation_summary['allocated']:,.0f}"
+          f"/{capacity_allocation_summary['demand']:,.0f} nhu cầu, "
+          f"không đáp ứng {capacity_allocation_summary['unserved']:,.0f}, "
+          f"quãng đường TB {capacity_allocation_summary['avg_distance_km']:.2f} km")
+elif CAPACITY_ALLOCATION:
+    print("⚠️ Thiếu coverage_membership (bước 2), bỏ qua capacity allocation")
 
 # ===============================================================================
 # GENERATE EXCEL REPORT WITH VALIDATED DATA
@@ -210,7 +356,9 @@ validated_overlap_matrix, validated_overlap_details = recalculate_overlap_matrix
 print(f"\n📊 Generating Excel report với validated data...")
 
 # File output
-output_path = "./Output/Report_Campus_Multi_Validated.xlsx"
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+output_path = os.path.join(OUTPUT_DIR, "Report_Campus_Multi_Validated.xlsx")
+report_path = output_path
 
 # Create workbook
 workbook = xlsxwriter.Workbook(output_path, {'nan_inf_to_errors': True})
@@ -242,6 +390,8 @@ subheader_format = workbook.add_format({
 
 number_format = workbook.add_format({'num_format': '#,##0', 'border': 1})
 percent_format = workbook.add_format({'num_format': '0.0%', 'border': 1})
+km_format = workbook.add_format({'num_format': '#,##0.00', 'border': 1})
+rate_format = workbook.add_format({'num_format': '0.00%', 'border': 1})
 text_format = workbook.add_format({'border': 1})
 
 # ===============================================================================
@@ -272,6 +422,10 @@ ws_overview.write(row, 1, clean_numeric_value(COVERAGE_RADIUS_KM))
 row += 1
 ws_overview.write(row, 0, "Overlap Share")
 ws_overview.write(row, 1, clean_numeric_value(OVERLAP_SHARE), percent_format)
+if ALLOCATION_MODE == 'huff':
+    row += 1
+    ws_overview.write(row, 0, "Shared Allocation")
+    ws_overview.write(row, 1, f"Huff ({HUFF_MODEL}, decay {HUFF_DECAY})")
 
 # System Summary with validated data
 row += 2
@@ -416,7 +570,12 @@ for campus_code, validated_tam in validated_tam_results.items():
 # Add formula explanation
 row += 2
 ws_tam.write(row, 0, "Validated TAM Formula:", validated_header_format)
-formula_text = f"TAM = (Validated Exclusive + {clean_numeric_value(OVERLAP_SHARE):.0%} × Competition) × {clean_numeric_value(PENETRATION_RATE):.2%}"
+rate_text = ("Calibrated rate/campus" if USE_CALIBRATED_PENETRATION and globals().get('penetration_calibration_df') is not None
+             else f"{clean_numeric_value(PENETRATION_RATE):.2%}")
+if ALLOCATION_MODE == 'huff':
+    formula_text = f"TAM = (Validated Exclusive + Σ Competition × Huff share) × {rate_text}"
+else:
+    formula_text = f"TAM = (Validated Exclusive + {clean_numeric_value(OVERLAP_SHARE):.0%} × Competition) × {rate_text}"
 ws_tam.merge_range(row, 0, row, 9, formula_text, validated_header_format)
 
 # ===============================================================================
@@ -456,6 +615,32 @@ for overlap_key, overlap_data in validated_overlap_details.items():
     ws_comp.write(row, 6, "✅ Validated")
     row += 1
 
+# ===============================================================================
+# 4b. VALIDATED OVERLAP ZONES (K-WAY)
+# ===============================================================================
+
+ws_zones = workbook.add_worksheet("Validated_Overlap_Zones")
+ws_zones.write(0, 0, "VALIDATED K-WAY OVERLAP ZONES", validated_header_format)
+ws_zones.merge_range(0, 0, 0, 5, "VALIDATED K-WAY OVERLAP ZONES", validated_header_format)
+
+row = 2
+zone_headers = ["Campuses", "# Campuses", "Schools", "Students", "Zone Type", "Status"]
+for col, header in enumerate(zone_headers):
+    ws_zones.write(row, col, header, header_format)
+row += 1
+
+for zone_key, zone_data in validated_overlap_zones.items():
+    num_campuses = zone_data['num_campuses']
+    zone_type = "Exclusive" if num_campuses == 1 else f"{num_campuses}-way shared"
+    
+    ws_zones.write(row, 0, clean_string_value(" ↔ ".join(zone_data['campuses'])))
+    ws_zones.write(row, 1, num_campuses, number_format)
+    ws_zones.write(row, 2, clean_numeric_value(zone_data['num_schools']), number_format)
+    ws_zones.write(row, 3, clean_numeric_value(zone_data['total_students']), number_format)
+    ws_zones.write(row, 4, zone_type)
+    ws_zones.write(row, 5, "✅ Validated")
+    row += 1
+
 # ===============================================================================
 # 5. VALIDATED SCHOOL CLASSIFICATION
 # ===============================================================================
@@ -472,12 +657,11 @@ row += 1
 
 # Export validated school classification
 validated_schools = []
-for school_name, classification in school_classification.items():
-    try:
-        school_data = schools_df[schools_df['Tên trường'] == school_name]
-        students = clean_numeric_value(school_data.iloc[0]['Tổng học sinh 2023']) if not school_data.empty else 0
-    except:
-        students = 0
+school_students = schools_df['Tổng học sinh 2023'].to_numpy(dtype=float)
+school_names = schools_df['Tên trường'].to_numpy()
+for school_id, classification in school_classification.items():
+    school_name = school_names[school_id]
+    students = clean_numeric_value(school_students[school_id])
     
     school_type = clean_string_value(classification.get('type', 'unknown'))
     school_campuses = classification.get('campuses', [])
@@ -546,7 +730,7 @@ for campus_code, coverage_data in coverage_results.items():
             students = clean_numeric_value(school.get('Tổng học sinh 2023', 0))
             
             # Get validated classification
-            classification = school_classification.get(school_name, {'type': 'exclusive', 'campuses': [campus_code]})
+            classification = school_classification.get(school['school_id'], {'type': 'exclusive', 'campuses': [campus_code]})
             school_type = clean_string_value(classification.get('type', 'exclusive')).title()
             school_campuses = classification.get('campuses', [])
             other_campuses = [c for c in school_campuses if c != campus_code]
@@ -555,7 +739,7 @@ for campus_code, coverage_data in coverage_results.items():
             ws_campus.write(row, 1, students, number_format)
             
             # Distance column (if available)
-            distance_value = school.get('validated_distance', school.get('distance_km', 'N/A'))
+            distance_value = school.get('validated_distance', school.get(f'dist_to_{campus_code}', school.get('distance_km', 'N/A')))
             if distance_value != 'N/A':
                 ws_campus.write(row, 2, clean_numeric_value(distance_value), number_format)
             else:
@@ -652,6 +836,39 @@ for campus_code, validated_tam in underutil_campuses:
     ws_opp.write(row, 6, "✅ Validated")
     row += 1
 
+# Phân bổ lại nhu cầu theo capacity: overflow được chuyển sang campus còn chỗ trong bán kính
+if capacity_allocation_df is not None:
+    row += 2
+    ws_opp.merge_range(row, 0, row, 6, "CAPACITY-CONSTRAINED REDISTRIBUTION (Min Travel Distance)",
+                       validated_header_format)
+    row += 1
+    ws_opp.write(row, 0, "Allocated / Demand", header_format)
+    ws_opp.write(row, 1, clean_numeric_value(capacity_allocation_summary['allocated']), number_format)
+    ws_opp.write(row, 2, clean_numeric_value(capacity_allocation_summary['demand']), number_format)
+    ws_opp.write(row, 3, "Unserved", header_format)
+    ws_opp.write(row, 4, clean_numeric_value(capacity_allocation_summary['unserved']), number_format)
+    ws_opp.write(row, 5, "Avg km", header_format)
+    ws_opp.write(row, 6, clean_numeric_value(capacity_allocation_summary['avg_distance_km']), km_format)
+    row += 2
+
+    allocation_headers = ["Campus", "Validated TAM", "Capacity", "Allocated", "Utilization",
+                          "Spare Capacity", "Avg Distance (km)"]
+    for col, header in enumerate(allocation_headers):
+        ws_opp.write(row, col, header, header_format)
+    row += 1
+
+    for allocation_row in capacity_allocation_df.itertuples(index=False):
+        campus_code = allocation_row[0]
+        ws_opp.write(row, 0, clean_string_value(campus_code))
+        ws_opp.write(row, 1, clean_numeric_value(validated_tam_results.get(campus_code, {}).get('tam', 0)),
+                     number_format)
+        ws_opp.write(row, 2, clean_numeric_value(allocation_row[2]), number_format)
+        ws_opp.write(row, 3, clean_numeric_value(allocation_row[3]), number_format)
+        ws_opp.write(row, 4, clean_numeric_value(allocation_row[4]), percent_format)
+        ws_opp.write(row, 5, clean_numeric_value(allocation_row[5]), number_format)
+        ws_opp.write(row, 6, clean_numeric_value(allocation_row[6]), km_format)
+        row += 1
+
 # ===============================================================================
 # 8. VALIDATED RECOMMENDATIONS
 # ===============================================================================
@@ -735,7 +952,181 @@ ws_rec.set_column('D:D', 40)
 ws_rec.set_column('E:E', 15)
 
 # ===============================================================================
-# 9. VALIDATION SUMMARY SHEET
+# 9. RADIUS SWEEP (bảng + biểu đồ)
+# ===============================================================================
+
+if radius_sweep_system_df is not None:
+    ws_sweep = workbook.add_worksheet("Radius_Sweep")
+    radius_format = workbook.add_format({'num_format': '0.0', 'border': 1})
+    ws_sweep.merge_range(0, 0, 0, len(radius_sweep_system_df.columns) - 1,
+                         "RADIUS SWEEP - COVERAGE / OVERLAP / TAM THEO BÁN KÍNH", validated_header_format)
+
+    row = 2
+    for col, header in enumerate(radius_sweep_system_df.columns):
+        ws_sweep.write(row, col, header, header_format)
+    row += 1
+    system_first_row = row
+    for values in radius_sweep_system_df.itertuples(index=False):
+        for col, value in enumerate(values):
+            ws_sweep.write(row, col, clean_numeric_value(value), radius_format if col == 0 else number_format)
+        row += 1
+    system_last_row = row - 1
+
+    row += 2
+    ws_sweep.merge_range(row, 0, row, len(radius_sweep_df.columns) - 1,
+                         "CHI TIẾT TỪNG CAMPUS", validated_header_format)
+    row += 1
+    for col, header in enumerate(radius_sweep_df.columns):
+        ws_sweep.write(row, col, header, header_format)
+    row += 1
+    for values in radius_sweep_df.itertuples(index=False):
+        for col, value in enumerate(values):
+            if isinstance(value, str):
+                ws_sweep.write(row, col, clean_string_value(value))
+            else:
+                ws_sweep.write(row, col, clean_numeric_value(value), radius_format if col == 0 else number_format)
+        row += 1
+
+    ws_sweep.set_column('A:A', 12)
+    ws_sweep.set_column('B:J', 18)
+
+    # Chart sheet: học sinh phủ / exclusive / shared theo bán kính, TAM trên trục phụ
+    sweep_chart = workbook.add_chart({'type': 'line'})
+    for col, header in enumerate(radius_sweep_system_df.columns):
+        if header not in ('Covered Students', 'Exclusive Students', 'Shared Students', 'Total TAM'):
+            continue
+        sweep_chart.add_series({
+            'name': ['Radius_Sweep', 2, col],
+            'categories': ['Radius_Sweep', system_first_row, 0, system_last_row, 0],
+            'values': ['Radius_Sweep', system_first_row, col, system_last_row, col],
+            'marker': {'type': 'circle'},
+            'y2_axis': header == 'Total TAM',
+        })
+    sweep_chart.set_title({'name': 'Coverage & TAM theo bán kính'})
+    sweep_chart.set_x_axis({'name': 'Radius (km)'})
+    sweep_chart.set_y_axis({'name': 'Students'})
+    sweep_chart.set_y2_axis({'name': 'TAM'})
+    sweep_chart.set_legend({'position': 'bottom'})
+
+    ws_sweep_chart = workbook.add_chartsheet("Radius_Sweep_Chart")
+    ws_sweep_chart.set_chart(sweep_chart)
+
+# ===============================================================================
+# 10. MONTE CARLO TAM (percentile theo campus)
+# ===============================================================================
+
+if tam_simulation_df is not None:
+    ws_mc = workbook.add_worksheet("TAM_Monte_Carlo")
+    ws_mc.merge_range(0, 0, 0, len(tam_simulation_df.columns) - 1,
+                      f"MONTE CARLO TAM - {MONTE_CARLO_DRAWS:,} DRAWS", validated_header_format)
+
+    row = 2
+    for col, header in enumerate(tam_simulation_system_df.columns):
+        ws_mc.write(row, col, header, header_format)
+    row += 1
+    for values in tam_simulation_system_df.itertuples(index=False):
+        ws_mc.write(row, 0, clean_string_value(values[0]))
+        for col, value in enumerate(values[1:], start=1):
+            ws_mc.write(row, col, clean_numeric_value(value), number_format)
+        row += 1
+
+    row += 1
+    ws_mc.write(row, 0, "Penetration rate", header_format)
+    ws_mc.write(row, 1, clean_string_value(
+        f"Calibrated rate/campus × ({MONTE_CARLO_PENETRATION} / {PENETRATION_RATE:g})" if campus_rates
+        else MONTE_CARLO_PENETRATION
+    ))
+    ws_mc.write(row + 1, 0, "Overlap share", header_format)
+    ws_mc.write(row + 1, 1, clean_string_value(
+        f"Huff ({HUFF_MODEL}, decay {HUFF_DECAY})" if huff_shares is not None else MONTE_CARLO_OVERLAP
+    ))
+    ws_mc.write(row + 2, 0, "Enrollment CV", header_format)
+    ws_mc.write(row + 2, 1, clean_numeric_value(MONTE_CARLO_ENROLLMENT_CV), percent_format)
+    row += 5
+
+    for col, header in enumerate(tam_simulation_df.columns):
+        ws_mc.write(row, col, header, header_format)
+    row += 1
+    for values in tam_simulation_df.itertuples(index=False):
+        ws_mc.write(row, 0, clean_string_value(values[0]))
+        for col, (header, value) in enumerate(zip(tam_simulation_df.columns[1:], values[1:]), start=1):
+            is_ratio = header.startswith('Utilization') or header == 'P(Overflow)'
+            ws_mc.write(row, col, clean_numeric_value(value), percent_format if is_ratio else number_format)
+        row += 1
+
+    ws_mc.set_column('A:A', 18)
+    ws_mc.set_column('B:O', 14)
+
+# ===============================================================================
+# 11. STUDENT TRAVEL DISTANCE + TRANSFER SUGGESTIONS (bước 1)
+# ===============================================================================
+
+transfer_df = globals().get('transfer_df')
+campus_distance_df = globals().get('campus_distance_df')
+if campus_distance_df is not None and len(campus_distance_df) > 0:
+    ws_travel = workbook.add_worksheet("Student_Distance")
+    ws_travel.merge_range(0, 0, 0, len(campus_distance_df.columns) - 1,
+                          "QUÃNG ĐƯỜNG HỌC VIÊN -> CAMPUS ĐANG HỌC (KM)", validated_header_format)
+    for col, header in enumerate(campus_distance_df.columns):
+        ws_travel.write(2, col, header, header_format)
+    for row, values in enumerate(campus_distance_df.itertuples(index=False), start=3):
+        ws_travel.write(row, 0, clean_string_value(values[0]))
+        for col, (header, value) in enumerate(zip(campus_distance_df.columns[1:], values[1:]), start=1):
+            ws_travel.write(row, col, clean_numeric_value(value), percent_format if header.endswith('%')
+                            else km_format if header.endswith('(km)') else number_format)
+    ws_travel.set_column('A:A', 18)
+    ws_travel.set_column('B:K', 14)
+
+if transfer_df is not None and len(transfer_df) > 0:
+    ws_transfer = workbook.add_worksheet("Student_Transfers")
+    ws_transfer.merge_range(0, 0, 0, len(transfer_df.columns) - 1,
+                            f"GỢI Ý CHUYỂN CAMPUS - {len(transfer_df):,} HỌC VIÊN", validated_header_format)
+    for col, header in enumerate(transfer_df.columns):
+        ws_transfer.write(2, col, header, header_format)
+    for row, values in enumerate(transfer_df.itertuples(index=False), start=3):
+        for col, (header, value) in enumerate(zip(transfer_df.columns, values)):
+            if header.endswith('(km)'):
+                ws_transfer.write(row, col, clean_numeric_value(value), km_format)
+            else:
+                ws_transfer.write(row, col, clean_string_value(value))
+    ws_transfer.set_column('A:H', 16)
+
+# ===============================================================================
+# 12. PENETRATION CALIBRATION (bước 4)
+# ===============================================================================
+
+penetration_calibration_df = globals().get('penetration_calibration_df')
+penetration_band_df = globals().get('penetration_band_df')
+if penetration_calibration_df is not None:
+    ws_calib = workbook.add_worksheet("Penetration_Calibration")
+    ws_calib.merge_range(0, 0, 0, len(penetration_calibration_df.columns) - 1,
+                         f"PENETRATION QUAN SÁT (cấu hình {clean_numeric_value(PENETRATION_RATE):.2%})",
+                         validated_header_format)
+    rate_columns = ('Within Catchment %', 'Observed Rate', 'Calibrated Rate', 'Penetration')
+
+    row = 2
+    for table in (penetration_calibration_df, penetration_band_df):
+        if table is None:
+            continue
+        for col, header in enumerate(table.columns):
+            ws_calib.write(row, col, header, header_format)
+        row += 1
+        for values in table.itertuples(index=False):
+            for col, (header, value) in enumerate(zip(table.columns, values)):
+                if isinstance(value, str):
+                    ws_calib.write(row, col, clean_string_value(value))
+                elif header in rate_columns:
+                    ws_calib.write(row, col, clean_numeric_value(value), rate_format)
+                else:
+                    ws_calib.write(row, col, clean_numeric_value(value), number_format)
+            row += 1
+        row += 2
+
+    ws_calib.set_column('A:B', 16)
+    ws_calib.set_column('C:I', 16)
+
+# ===============================================================================
+# 13. VALIDATION SUMMARY SHEET
 # ===============================================================================
 
 ws_validation = workbook.add_worksheet("Validation_Summary")
@@ -754,7 +1145,20 @@ validation_steps = [
     ["Exclusive Students", "Recalculate từ validated classification", f"{sum(validated_exclusive_students.values()):,} students", "✅ Recalculated"],
     ["TAM Analysis", "Recalculate với validated data", f"{total_validated_tam:,.0f} TAM", "✅ Recalculated"],
     ["Overlap Matrix", "Recalculate từ validated shared schools", f"{len(validated_overlap_details)} overlaps", "✅ Recalculated"],
+    ["Overlap Zones", "Nhóm trường theo tập campus phủ (k-way)", f"{len(validated_overlap_zones)} zones", "✅ Recalculated"],
     ["Data Integrity", "Đảm bảo logic đồng nhất radius", "100% consistency", "✅ Guaranteed"],
+    *([["Radius Sweep", "Coverage/overlap/TAM theo nhiều bán kính",
+         f"{len(radius_sweep_system_df)} radii", "✅ Computed"]] if radius_sweep_system_df is not None else []),
+    *([["Monte Carlo TAM", "Percentile TAM/utilization theo campus",
+         f"{MONTE_CARLO_DRAWS:,} draws", "✅ Simulated"]] if tam_simulation_df is not None else []),
+    *([["Capacity Allocation", "Phân bổ nhu cầu theo capacity, tối thiểu quãng đường",
+         f"{capacity_allocation_summary['allocated']:,.0f} allocated", "✅ Solved"]]
+      if capacity_allocation_summary is not None else []),
+    *([["Penetration Calibration", "Penetration quan sát theo campus / dải khoảng cách",
+         f"{(penetration_calibration_df['Source'] == 'observed').sum()} campuses", "✅ Calibrated"]]
+      if penetration_calibration_df is not None else []),
+    *([["Student Transfers", "Campus gần nhất / gần nhì cho từng học viên",
+         f"{len(transfer_df):,} suggestions", "✅ Computed"]] if transfer_df is not None and len(transfer_df) > 0 else []),
     ["Report Generation", "Excel report với validated data", "All sheets validated", "✅ Complete"]
 ]
 
@@ -801,12 +1205,26 @@ sheets = [
     "Validated_Overlap_Matrix - Ma trận overlap validated",
     "Validated_TAM_Analysis - TAM tính từ validated data",
     "Validated_Competition - Competition analysis validated",
+    "Validated_Overlap_Zones - Vùng overlap k-campus validated",
     "Validated_School_Class - School classification validated",
     f"{len(coverage_results)} Campus sheets - Chi tiết từng campus validated",
     "Validated_Market_Opp - Market opportunity validated",
     "Validated_Recommendations - Strategic recommendations validated",
     "Validation_Summary - Validation process summary"
 ]
+if radius_sweep_system_df is not None:
+    sheets[-1:-1] = [
+        "Radius_Sweep - Coverage/overlap/TAM theo bán kính",
+        "Radius_Sweep_Chart - Biểu đồ sweep bán kính",
+    ]
+if tam_simulation_df is not None:
+    sheets.insert(-1, "TAM_Monte_Carlo - Percentile TAM/utilization (Monte Carlo)")
+if campus_distance_df is not None and len(campus_distance_df) > 0:
+    sheets.insert(-1, "Student_Distance - Percentile quãng đường học viên theo campus")
+if transfer_df is not None and len(transfer_df) > 0:
+    sheets.insert(-1, "Student_Transfers - Gợi ý chuyển campus gần hơn")
+if penetration_calibration_df is not None:
+    sheets.insert(-1, "Penetration_Calibration - Penetration quan sát theo campus / dải khoảng cách")
 
 for sheet in sheets:
     print(f"   • {sheet}")
@@ -13,6 +13,8 @@ import traceback
 from datetime import datetime
 from pathlib import Path
 
+from pipeline import run_pipeline, StageMemo, STAGES
+
 try:
     from PyQt5.QtWidgets import (
         QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
@@ -34,9 +36,12 @@ class AnalysisWorker(QThread):
     finished = pyqtSignal(bool, str)
     log_updated = pyqtSignal(str)
 
-    def __init__(self, config):
+    def __init__(self, config, memo=None, previous=None):
         super().__init__()
         self.config = config
+        self.memo = memo
+        self.previous = previous
+        self.result = None
 
     def run(self):
         """Chạy analysis pipeline"""
@@ -48,60 +53,26 @@ class AnalysisWorker(QThread):
             self.log_updated.emit("🚀 Bắt đầu phân tích...")
             self.log_updated.emit(f"📁 Working directory: {os.getcwd()}")
             
-            # Setup global variables
-            globals().update(self.config)
+            # Tiến độ + log theo từng bước pipeline
+            stage_progress = {'load': 10, 'coverage': 25, 'overlap': 45, 'tam': 65, 'map': 80, 'export': 95}
+            stage_icons = {'load': '📂', 'coverage': '🗺️', 'overlap': '🔄', 'tam': '📈', 'map': '🎨', 'export': '📊'}
             
-            # Step 1: Load data
-            self.progress_updated.emit(10, "Đang load dữ liệu...")
-            self.log_updated.emit("📂 BƯỚC 1: Load dữ liệu từ Excel...")
+            def on_stage_start(stage):
+                step_num = STAGES.index(stage) + 1
+                self.progress_updated.emit(stage_progress.get(stage.name, 0), f"{stage.title}...")
+                self.log_updated.emit(f"{stage_icons.get(stage.name, '▶️')} BƯỚC {step_num}: {stage.title}...")
             
             # Check if analysis files exist
-            required_files = [
-                "01_load_data_selection.py",
-                "02_compute_coverage.py", 
-                "03_overlap_matrix.py",
-                "04_tam_analysis.py",
-                "05_generate_map.py",
-                "06_export_excel.py"
-            ]
-            
-            for file in required_files:
-                if not os.path.exists(file):
-                    raise FileNotFoundError(f"Không tìm thấy file: {file}")
-            
-            # Execute analysis steps
-            with open("01_load_data_selection.py", "r", encoding="utf-8") as f:
-                exec(f.read(), globals())
-            
-            # Step 2: Coverage
-            self.progress_updated.emit(25, "Tính vùng phủ...")
-            self.log_updated.emit("🗺️ BƯỚC 2: Tính vùng phủ từng campus...")
-            with open("02_compute_coverage.py", "r", encoding="utf-8") as f:
-                exec(f.read(), globals())
-            
-            # Step 3: Overlap
-            self.progress_updated.emit(45, "Tính ma trận overlap...")
-            self.log_updated.emit("🔄 BƯỚC 3: Tính ma trận overlap...")
-            with open("03_overlap_matrix.py", "r", encoding="utf-8") as f:
-                exec(f.read(), globals())
+            for stage in STAGES:
+                if not os.path.exists(stage.path):
+                    raise FileNotFoundError(f"Không tìm thấy file: {stage.script}")
             
-            # Step 4: TAM
-            self.progress_updated.emit(65, "Phân tích TAM...")
-            self.log_updated.emit("📈 BƯỚC 4: Phân tích TAM...")
-            with open("04_tam_analysis.py", "r", encoding="utf-8") as f:
-                exec(f.read(), globals())
-            
-            # Step 5: Map
-            self.progress_updated.emit(80, "Tạo bản đồ...")
-            self.log_updated.emit("🎨 BƯỚC 5: Tạo bản đồ interactive...")
-            with open("05_generate_map.py", "r", encoding="utf-8") as f:
-                exec(f.read(), globals())
-            
-            # Step 6: Excel
-            self.progress_updated.emit(95, "Xuất báo cáo Excel...")
-            self.log_updated.emit("📊 BƯỚC 6: Xuất báo cáo Excel...")
-            with open("06_export_excel.py", "r", encoding="utf-8") as f:
-                exec(f.read(), globals())
+            # Memo theo bước: đổi rate chỉ chạy lại TAM trở đi, không load / tính vùng phủ lại
+            # previous: thêm / bớt 1 campus chỉ tính lại phần liên quan tới campus đó
+            self.result = run_pipeline(self.config, on_stage_start=on_stage_start, memo=self.memo,
+                                       previous=self.previous)
+            if self.result.cached:
+                self.log_updated.emit(f"♻️ Dùng lại kết quả: {', '.join(self.result.cached)}")
             
             self.progress_updated.emit(100, "Hoàn thành!")
             self.log_updated.emit("✅ Phân tích hoàn tất thành công!")
@@ -121,6 +92,9 @@ class CampusAnalysisGUI(QMainWindow):
     def __init__(self):
         super().__init__()
         self.analysis_worker = None
+        # Memo kết quả từng bước, dùng chung giữa các lần phân tích
+        self.stage_memo = StageMemo()
+        self.last_result = None
         self.init_ui()
         self.setup_default_config()
 
@@ -224,6 +198,39 @@ class CampusAnalysisGUI(QMainWindow):
         self.students_per_room.setMinimumHeight(35)  # Tăng chiều cao
         sys_layout.addWidget(self.students_per_room, 3, 1)
         
+        # Distance metric (kernel dùng chung mọi bước)
+        sys_layout.addWidget(QLabel("Distance metric:"), 4, 0)
+        self.distance_metric = QComboBox()
+        self.distance_metric.addItems(["haversine", "vincenty"])
+        self.distance_metric.setMinimumHeight(35)
+        sys_layout.addWidget(self.distance_metric, 4, 1)
+        
+        # Skip revalidation ở bước 5
+        self.skip_revalidation = QCheckBox("Bỏ qua validate lại khoảng cách (bước 5)")
+        self.skip_revalidation.setChecked(False)
+        sys_layout.addWidget(self.skip_revalidation, 5, 0, 1, 2)
+        
+        # Cache cột cho file Excel input
+        self.use_input_cache = QCheckBox("Cache dữ liệu input (Input/.cache)")
+        self.use_input_cache.setChecked(True)
+        sys_layout.addWidget(self.use_input_cache, 6, 0, 1, 2)
+        
+        # Sweep nhiều bán kính (sheet Radius_Sweep)
+        sys_layout.addWidget(QLabel("Sweep bán kính (km):"), 7, 0)
+        self.sweep_radii = QLineEdit("1, 2, 3, 4, 5")
+        self.sweep_radii.setPlaceholderText("1, 2, 3, 4, 5 (để trống = tắt)")
+        self.sweep_radii.setMinimumHeight(35)
+        sys_layout.addWidget(self.sweep_radii, 7, 1)
+        
+        # Monte Carlo TAM (sheet TAM_Monte_Carlo)
+        sys_layout.addWidget(QLabel("Monte Carlo (lượt rút):"), 8, 0)
+        self.monte_carlo_draws = QSpinBox()
+        self.monte_carlo_draws.setRange(0, 1000000)
+        self.monte_carlo_draws.setSingleStep(10000)
+        self.monte_carlo_draws.setValue(100000)
+        self.monte_carlo_draws.setMinimumHeight(35)
+        sys_layout.addWidget(self.monte_carlo_draws, 8, 1)
+        
         scroll_layout.addWidget(sys_group)
         
         # Campus Selection Group
@@ -542,6 +549,14 @@ class CampusAnalysisGUI(QMainWindow):
         if self.selected_campuses.text().strip():
             selected_campuses = [c.strip() for c in self.selected_campuses.text().split(",")]
         
+        # Parse sweep radii
+        sweep_radii = []
+        for value in self.sweep_radii.text().split(","):
+            try:
+                sweep_radii.append(float(value))
+            except ValueError:
+                continue
+        
         # Parse new campuses
         new_campuses = []
         for row in range(self.new_campuses_table.rowCount()):
@@ -568,6 +583,11 @@ class CampusAnalysisGUI(QMainWindow):
             "COVERAGE_RADIUS_KM": self.coverage_radius.value(),
             "OVERLAP_SHARE": self.overlap_share.value() / 100,
             "STUDENTS_PER_ROOM": self.students_per_room.value(),
+            "SWEEP_RADII": sweep_radii,
+            "MONTE_CARLO_DRAWS": self.monte_carlo_draws.value(),
+            "DISTANCE_METRIC": self.distance_metric.currentText(),
+            "SKIP_REVALIDATION": self.skip_revalidation.isChecked(),
+            "USE_INPUT_CACHE": self.use_input_cache.isChecked(),
             "USE_CAMPUS_SELECTION": self.use_campus_selection.isChecked(),
             "SELECTED_CAMPUSES": selected_campuses,
             "NEW_CAMPUSES": new_campuses,
@@ -604,6 +624,11 @@ class CampusAnalysisGUI(QMainWindow):
                 self.coverage_radius.setValue(config.get("COVERAGE_RADIUS_KM", 3.0))
                 self.overlap_share.setValue(config.get("OVERLAP_SHARE", 0.5) * 100)
                 self.students_per_room.setValue(config.get("STUDENTS_PER_ROOM", 100))
+                self.sweep_radii.setText(", ".join(f"{r:g}" for r in config.get("SWEEP_RADII", [])))
+                self.monte_carlo_draws.setValue(config.get("MONTE_CARLO_DRAWS", 0))
+                self.distance_metric.setCurrentText(config.get("DISTANCE_METRIC", "haversine"))
+                self.skip_revalidation.setChecked(config.get("SKIP_REVALIDATION", False))
+                self.use_input_cache.setChecked(config.get("USE_INPUT_CACHE", True))
                 self.use_campus_selection.setChecked(config.get("USE_CAMPUS_SELECTION", True))
                 
                 selected_campuses = config.get("SELECTED_CAMPUSES", [])
@@ -635,6 +660,11 @@ class CampusAnalysisGUI(QMainWindow):
         self.coverage_radius.setValue(3.0)
         self.overlap_share.setValue(50.0)
         self.students_per_room.setValue(100)
+        self.sweep_radii.setText("1, 2, 3, 4, 5")
+        self.monte_carlo_draws.setValue(100000)
+        self.distance_metric.setCurrentText("haversine")
+        self.skip_revalidation.setChecked(False)
+        self.use_input_cache.setChecked(True)
         self.use_campus_selection.setChecked(True)
         self.selected_campuses.setText("HCM_GR, HCM_TQB")
         self.new_campuses_table.setRowCount(0)
@@ -681,7 +711,7 @@ class CampusAnalysisGUI(QMainWindow):
         self.log_text.append(f"🚀 Bắt đầu phân tích lúc {datetime.now().strftime('%H:%M:%S')}")
         
         # Start worker thread
-        self.analysis_worker = AnalysisWorker(config)
+        self.analysis_worker = AnalysisWorker(config, memo=self.stage_memo, previous=self.last_result)
         self.analysis_worker.progress_updated.connect(self.update_progress)
         self.analysis_worker.log_updated.connect(self.update_log)
         self.analysis_worker.finished.connect(self.analysis_finished)
@@ -703,6 +733,7 @@ class CampusAnalysisGUI(QMainWindow):
         self.start_btn.setEnabled(True)
         
         if success:
+            self.last_result = self.analysis_worker.result
             self.progress_bar.setValue(100)
             self.progress_label.setText("✅ Hoàn thành!")
             self.status_bar.showMessage("Phân tích hoàn thành thành công!")
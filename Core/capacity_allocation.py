@@ -0,0 +1,117 @@
+# capacity_allocation.py
+"""
+Phân bổ nhu cầu trường -> campus có ràng buộc capacity (bài toán vận tải / min-cost flow)
+- Cạnh = cặp (trường, campus) trong bán kính: danh sách cạnh thưa lấy từ membership bước 2
+- Nhu cầu trường = học sinh × PENETRATION_RATE (TAM-weighted), cung campus = capacity
+- 2 pha LP (HiGHS, ma trận ràng buộc thưa):
+  1. Tối đa tổng nhu cầu được phục vụ
+  2. Giữ tổng đó, tối thiểu tổng quãng đường (học viên × km)
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+
+# Nới nhẹ ràng buộc tổng phục vụ ở pha 2 để tránh infeasible do sai số float
+SERVED_TOLERANCE = 1e-9
+
+
+class CapacityAllocation:
+    """Kết quả phân bổ: flow trên từng cạnh (trường, campus) + bảng tổng hợp"""
+
+    def __init__(self, membership, demand, capacity, flow):
+        self.membership = membership
+        self.demand = demand
+        self.capacity = capacity
+        self.flow = flow
+
+    @property
+    def edges(self):
+        """(school, campus, distance) của từng cạnh, cùng thứ tự flow"""
+        matrix = self.membership.distances
+        schools = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        return schools, matrix.indices, matrix.data
+
+    def campus_frame(self):
+        """1 dòng / campus: nhu cầu trong bán kính, được phân bổ, utilization, quãng đường TB"""
+        schools, campuses, distances = self.edges
+        n_campuses = self.membership.n_campuses
+        allocated = np.bincount(campuses, weights=self.flow, minlength=n_campuses)
+        student_km = np.bincount(campuses, weights=self.flow * distances, minlength=n_campuses)
+        reachable = np.bincount(campuses, weights=self.demand[schools], minlength=n_campuses)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            utilization = np.where(self.capacity > 0, allocated / self.capacity, 0.0)
+            mean_distance = np.where(allocated > 0, student_km / allocated, 0.0)
+        return pd.DataFrame({
+            'Campus Code': self.membership.campus_codes,
+            'Reachable Demand': reachable,
+            'Capacity': self.capacity,
+            'Allocated': allocated,
+            'Utilization': utilization,
+            'Spare Capacity': np.maximum(self.capacity - allocated, 0.0),
+            'Avg Distance (km)': mean_distance,
+        })
+
+    def school_frame(self):
+        """1 dòng / trường được phủ: nhu cầu, được phân bổ, không đáp ứng được"""
+        schools, _, _ = self.edges
+        allocated = np.bincount(schools, weights=self.flow, minlength=self.membership.n_schools)
+        covered = np.nonzero(self.membership.covered_mask)[0]
+        return pd.DataFrame({
+            'school_position': covered,
+            'Demand': self.demand[covered],
+            'Allocated': allocated[covered],
+            'Unserved': np.maximum(self.demand[covered] - allocated[covered], 0.0),
+        })
+
+    def summary(self):
+        """Tổng hệ thống: nhu cầu, phục vụ được, không đáp ứng, quãng đường TB"""
+        _, _, distances = self.edges
+        covered = self.membership.covered_mask
+        served = self.flow.sum()
+        return {
+            'demand': self.demand[covered].sum(),
+            'capacity': self.capacity.sum(),
+            'allocated': served,
+            'unserved': self.demand[covered].sum() - served,
+            'avg_distance_km': (self.flow * distances).sum() / served if served > 0 else 0.0,
+        }
+
+
+def allocate_demand(membership, demand, capacity):
+    """Phân bổ demand (mảng theo trường) vào campus trong bán kính, tôn trọng capacity (mảng theo campus)
+
+    Pha 1 tối đa tổng phục vụ, pha 2 tối thiểu học viên × km với tổng phục vụ cố định.
+    """
+    demand = np.asarray(demand, dtype=float)
+    capacity = np.asarray(capacity, dtype=float)
+    matrix = membership.distances
+    n_schools, n_campuses = matrix.shape
+    n_edges = matrix.nnz
+    if n_edges == 0:
+        return CapacityAllocation(membership, demand, capacity, np.zeros(0))
+
+    # Ràng buộc: Σ flow theo trường <= demand, Σ flow theo campus <= capacity
+    schools = np.repeat(np.arange(n_schools), np.diff(matrix.indptr))
+    edge_ids = np.arange(n_edges)
+    constraints = sparse.vstack([
+        sparse.csr_matrix((np.ones(n_edges), (schools, edge_ids)), shape=(n_schools, n_edges)),
+        sparse.csr_matrix((np.ones(n_edges), (matrix.indices, edge_ids)), shape=(n_campuses, n_edges)),
+    ]).tocsr()
+    bounds_ub = np.concatenate([demand, np.maximum(capacity, 0.0)])
+
+    phase1 = linprog(-np.ones(n_edges), A_ub=constraints, b_ub=bounds_ub, bounds=(0, None), method='highs')
+    if phase1.status != 0:
+        raise RuntimeError(f"Không giải được bài toán phân bổ (pha 1): {phase1.message}")
+    served = -phase1.fun
+
+    phase2 = linprog(
+        matrix.data.astype(float),
+        A_ub=sparse.vstack([constraints, -sparse.csr_matrix(np.ones((1, n_edges)))]).tocsr(),
+        b_ub=np.append(bounds_ub, -served * (1 - SERVED_TOLERANCE)),
+        bounds=(0, None), method='highs'
+    )
+    if phase2.status != 0:
+        raise RuntimeError(f"Không giải được bài toán phân bổ (pha 2): {phase2.message}")
+    return CapacityAllocation(membership, demand, capacity, np.maximum(phase2.x, 0.0))
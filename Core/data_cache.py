@@ -0,0 +1,137 @@
+# data_cache.py
+"""
+Cache dạng cột (.npy) cho các file Excel input
+- Lần đầu: đọc Excel, lưu mỗi cột 1 file .npy + meta.json vào <Input>/.cache/<tên file>/
+- Lần sau: cột số được np.load(mmap_mode='r'), không parse lại Excel
+- Hợp lệ khi mtime/size khớp; nếu mtime đổi thì so hash nội dung (sha256)
+"""
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR_NAME = ".cache"
+CACHE_VERSION = 1
+
+# Kiểu dữ liệu lưu được dạng .npy thuần (memory-map được); còn lại lưu object (pickle)
+NUMERIC_KINDS = "biufcmM"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """sha256 nội dung file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_dir_for(path):
+    """Thư mục cache của 1 file input"""
+    return os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME, os.path.basename(path))
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(cache_dir, meta):
+    tmp_path = os.path.join(cache_dir, "meta.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(cache_dir, "meta.json"))
+
+
+def _write_cache(df, cache_dir, meta):
+    """Ghi từng cột ra .npy, meta.json ghi sau cùng (cache dở dang = không hợp lệ)"""
+    os.makedirs(cache_dir, exist_ok=True)
+    old_meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(old_meta_path):
+        os.remove(old_meta_path)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        values = df[col].to_numpy()
+        pickled = values.dtype.kind not in NUMERIC_KINDS
+        if pickled:
+            values = values.astype(object)
+        np.save(os.path.join(cache_dir, f"col_{i}.npy"), values, allow_pickle=pickled)
+        columns.append({"name": col, "file": f"col_{i}.npy", "pickled": pickled})
+
+    meta["columns"] = columns
+    meta["rows"] = len(df)
+    _write_meta(cache_dir, meta)
+
+
+def _load_cache(cache_dir, meta):
+    data = {}
+    for col in meta["columns"]:
+        col_path = os.path.join(cache_dir, col["file"])
+        if col["pickled"]:
+            data[col["name"]] = np.load(col_path, allow_pickle=True)
+        else:
+            data[col["name"]] = np.load(col_path, mmap_mode="r")
+    # DataFrame copy khỏi memmap -> các bước sau sửa frame thoải mái
+    return pd.DataFrame(data, columns=[col["name"] for col in meta["columns"]], copy=True)
+
+
+def read_excel_cached(path, use_cache=True, **read_kwargs):
+    """pd.read_excel có cache cột trên đĩa
+
+    Trả về (DataFrame, source) với source = 'cache' hoặc 'excel'.
+    read_kwargs (sheet_name, usecols, dtype, ...) là một phần của key cache.
+    Lỗi ghi cache (thư mục chỉ đọc, ...) không làm hỏng việc load.
+    """
+    if not use_cache:
+        return pd.read_excel(path, **read_kwargs), "excel"
+
+    stat = os.stat(path)
+    cache_dir = cache_dir_for(path)
+    read_args = repr(sorted(read_kwargs.items()))
+    meta = _read_meta(cache_dir)
+
+    valid_meta = (
+        meta is not None
+        and meta.get("version") == CACHE_VERSION
+        and meta.get("read_args") == read_args
+    )
+
+    if valid_meta:
+        try:
+            if meta.get("mtime_ns") == stat.st_mtime_ns and meta.get("size") == stat.st_size:
+                return _load_cache(cache_dir, meta), "cache"
+
+            # mtime đổi nhưng nội dung có thể giữ nguyên (copy/touch file)
+            if meta.get("sha256") == file_hash(path):
+                df = _load_cache(cache_dir, meta)
+                meta["mtime_ns"], meta["size"] = stat.st_mtime_ns, stat.st_size
+                try:
+                    _write_meta(cache_dir, meta)
+                except OSError:
+                    pass
+                return df, "cache"
+        except (OSError, ValueError, KeyError):
+            pass
+
+    df = pd.read_excel(path, **read_kwargs)
+
+    try:
+        _write_cache(df, cache_dir, {
+            "version": CACHE_VERSION,
+            "source": os.path.basename(path),
+            "read_args": read_args,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": file_hash(path),
+        })
+    except (OSError, ValueError, TypeError):
+        pass
+
+    return df, "excel"
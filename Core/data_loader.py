@@ -0,0 +1,101 @@
+# data_loader.py
+"""
+Loader cho các file Excel input: load song song campus / học viên / trường công
+- Mỗi file là 1 job độc lập (đọc file + parse XML hoặc đọc cache .npy)
+- Schema cột (schema.py) được resolve ngay khi load: alias -> tên chuẩn, ép kiểu
+- Trả về frame + nguồn (excel/cache) + thời gian load từng file
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from data_cache import read_excel_cached
+from schema import INPUT_SCHEMAS
+
+INPUT_FILES = {
+    'campuses': 'Campuses_with_latlon.xlsx',
+    'students': 'Students_with_latlon.xlsx',
+    'schools': 'Public_Schools_with_latlon.xlsx',
+}
+
+
+def file_signature(path):
+    """(mtime_ns, size) của file, None nếu không đọc được"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class LoadedInput:
+    """Kết quả load 1 file: df / source ('excel' | 'cache') / seconds / error / schema_report
+
+    signature: (mtime_ns, size) của file lúc load -> is_current() kiểm tra file chưa đổi
+    """
+
+    def __init__(self, name, path, df=None, source=None, seconds=0.0, error=None, schema_report=None,
+                 signature=None):
+        self.name = name
+        self.path = path
+        self.df = df
+        self.source = source
+        self.seconds = seconds
+        self.error = error
+        self.schema_report = schema_report or {}
+        self.signature = signature
+
+    def result(self):
+        """DataFrame đã load, raise lại lỗi gốc nếu load thất bại"""
+        if self.error is not None:
+            raise self.error
+        return self.df
+
+    def is_current(self):
+        """Load thành công và file trên đĩa chưa thay đổi từ lúc load"""
+        return self.error is None and self.signature is not None and file_signature(self.path) == self.signature
+
+
+def _load_one(name, path, use_cache, read_kwargs, schema=None):
+    start = time.perf_counter()
+    signature = file_signature(path)
+    try:
+        if schema is not None:
+            read_kwargs = {**schema.read_kwargs(), **read_kwargs}
+        df, source = read_excel_cached(path, use_cache=use_cache, **read_kwargs)
+        schema_report = None
+        if schema is not None:
+            df, schema_report = schema.resolve(df)
+        return LoadedInput(name, path, df, source, time.perf_counter() - start, schema_report=schema_report,
+                           signature=signature)
+    except Exception as e:
+        return LoadedInput(name, path, seconds=time.perf_counter() - start, error=e)
+
+
+def load_inputs(input_dir, use_cache=True, files=None, read_kwargs=None, schemas=None, use_processes=False):
+    """Load song song các file input, trả về (dict name -> LoadedInput, tổng thời gian)
+
+    - files: {name: tên file} (mặc định INPUT_FILES)
+    - read_kwargs: {name: kwargs cho pd.read_excel}
+    - schemas: {name: TableSchema} (mặc định INPUT_SCHEMAS)
+    - use_processes: dùng process pool (parse openpyxl bị giới hạn bởi GIL khi dùng thread)
+    Lỗi từng file được giữ trong LoadedInput.error, không làm hỏng các file khác.
+    """
+    files = INPUT_FILES if files is None else files
+    schemas = INPUT_SCHEMAS if schemas is None else schemas
+    read_kwargs = read_kwargs or {}
+
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    start = time.perf_counter()
+    with executor_cls(max_workers=len(files)) as executor:
+        futures = {
+            name: executor.submit(
+                _load_one, name, os.path.join(input_dir, filename), use_cache,
+                read_kwargs.get(name, {}), schemas.get(name)
+            )
+            for name, filename in files.items()
+        }
+        loaded = {name: future.result() for name, future in futures.items()}
+
+    return loaded, time.perf_counter() - start
@@ -0,0 +1,162 @@
+# distance_engine.py
+"""
+Distance engine: tính ma trận khoảng cách campus × trường bằng NumPy (1 lần gọi)
+- Kernel dùng chung cho mọi bước: 'haversine' (mặt cầu) hoặc 'vincenty' (WGS-84)
+- Chọn kernel qua cấu hình DISTANCE_METRIC
+"""
+
+import numpy as np
+from math import radians, sin, cos, sqrt, asin
+
+EARTH_RADIUS_KM = 6371
+
+# Ellipsoid WGS-84 (cho Vincenty)
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+DISTANCE_METRICS = ('haversine', 'vincenty')
+DEFAULT_DISTANCE_METRIC = 'haversine'
+
+# Chênh lệch tối đa giữa khoảng cách ellipsoid và mặt cầu (~0.56%), dùng khi lọc sơ bộ
+METRIC_SLACK = {'haversine': 0.0, 'vincenty': 0.01}
+
+# Sai số cho phép giữa bản vector hóa và bản scalar (km).
+# Các cặp nằm trong dải này quanh bán kính sẽ được tính lại bằng hàm scalar
+# để membership tại biên giống hệt haversine_distance().
+BOUNDARY_TOLERANCE_KM = 1e-9
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Tính khoảng cách giữa 2 điểm theo công thức haversine (km)"""
+    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+    c = 2 * asin(sqrt(a))
+
+    return EARTH_RADIUS_KM * c
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2):
+    """Ma trận khoảng cách haversine (km), shape = (len(lat1), len(lat2))
+
+    Dòng = điểm gốc (campus), cột = điểm đích (trường). NaN -> NaN.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=float))[:, None]
+    lon1 = np.radians(np.asarray(lon1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lat2, dtype=float))[None, :]
+    lon2 = np.radians(np.asarray(lon2, dtype=float))[None, :]
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    return EARTH_RADIUS_KM * c
+
+
+def vincenty_matrix(lat1, lon1, lat2, lon2, max_iter=200, tol=1e-12):
+    """Ma trận khoảng cách Vincenty (inverse, WGS-84) theo km, vector hóa toàn bộ
+
+    Cặp điểm gần đối cực (không hội tụ) được thay bằng haversine.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=float))[:, None]
+    lon1 = np.radians(np.asarray(lon1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lat2, dtype=float))[None, :]
+    lon2 = np.radians(np.asarray(lon2, dtype=float))[None, :]
+
+    L = lon2 - lon1
+    U1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    converged = np.zeros(np.broadcast(lat1, lat2).shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cosU2 * sin_lam) ** 2 +
+                                (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Đường xích đạo: cos2_alpha = 0 -> cos_2sigma_m = 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0,
+                                    cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+
+            converged = np.abs(lam - lam_prev) < tol
+            if np.all(converged | np.isnan(lam)):
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        ))
+        distances = WGS84_B * A * (sigma - delta_sigma) / 1000
+
+    distances = np.where(sin_sigma == 0, 0.0, distances)
+    distances = np.where(np.isnan(lam), np.nan, distances)
+
+    not_converged = ~converged & ~np.isnan(distances)
+    if np.any(not_converged):
+        fallback = haversine_matrix(np.degrees(lat1[:, 0]), np.degrees(lon1[:, 0]),
+                                    np.degrees(lat2[0]), np.degrees(lon2[0]))
+        distances = np.where(not_converged, fallback, distances)
+
+    return distances
+
+
+def check_metric(metric):
+    """Kiểm tra tên kernel khoảng cách"""
+    metric = (metric or DEFAULT_DISTANCE_METRIC).lower()
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(f"DISTANCE_METRIC không hợp lệ: {metric} (chọn {DISTANCE_METRICS})")
+    return metric
+
+
+def distance_matrix(lat1, lon1, lat2, lon2, metric=DEFAULT_DISTANCE_METRIC):
+    """Ma trận khoảng cách (km) theo kernel đã cấu hình"""
+    if check_metric(metric) == 'vincenty':
+        return vincenty_matrix(lat1, lon1, lat2, lon2)
+    return haversine_matrix(lat1, lon1, lat2, lon2)
+
+
+def distance_km(lat1, lon1, lat2, lon2, metric=DEFAULT_DISTANCE_METRIC):
+    """Khoảng cách giữa 2 điểm (km) theo kernel đã cấu hình, NaN -> inf"""
+    try:
+        distance = float(distance_matrix([float(lat1)], [float(lon1)],
+                                         [float(lat2)], [float(lon2)], metric)[0, 0])
+    except (TypeError, ValueError):
+        return float('inf')
+    return float('inf') if np.isnan(distance) else distance
+
+
+def coverage_mask(distances, lat1, lon1, lat2, lon2, radius_km, metric=DEFAULT_DISTANCE_METRIC):
+    """Mask (distance <= radius_km) với biên được đối chiếu lại bằng hàm scalar
+
+    Sửa trực tiếp các giá trị gần biên trong `distances` và trả về mask boolean.
+    Chỉ áp dụng cho haversine (Vincenty không có bản scalar riêng).
+    """
+    if check_metric(metric) != 'haversine':
+        return distances <= radius_km
+
+    near_boundary = np.abs(distances - radius_km) <= BOUNDARY_TOLERANCE_KM
+    for i, j in zip(*np.nonzero(near_boundary)):
+        distances[i, j] = haversine_distance(lat1[i], lon1[i], lat2[j], lon2[j])
+
+    return distances <= radius_km
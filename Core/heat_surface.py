@@ -0,0 +1,120 @@
+# heat_surface.py
+"""
+Bản đồ nhiệt TAM: TAM 1 campus giả định sẽ có nếu đặt tại từng ô lưới lat/lon
+- Rasterize học sinh lên lưới (chiếu phẳng cục bộ quanh vĩ độ giữa), tách 2 lớp:
+  trường chưa campus nào phủ (exclusive cho campus mới) và đã được phủ (tính theo OVERLAP_SHARE)
+- Tổng trong đĩa bán kính r quanh mỗi ô = tổng các đoạn hàng của đĩa, mỗi đoạn lấy từ
+  prefix sum theo hàng (summed-area table 1 chiều) -> O(ô × số hàng của đĩa), không truy vấn từng ô
+"""
+
+import numpy as np
+
+from distance_engine import EARTH_RADIUS_KM
+
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+# Bảng màu overlay (trong suốt -> vàng -> cam -> đỏ)
+HEAT_COLORS = np.array([
+    [255, 255, 178, 0],
+    [254, 204, 92, 150],
+    [253, 141, 60, 180],
+    [240, 59, 32, 200],
+    [189, 0, 38, 220],
+], dtype=float)
+
+
+class HeatSurface:
+    """Lưới TAM: tam[i, j] tại (lats[i], lons[j]); dòng 0 = phía nam"""
+
+    def __init__(self, tam, lats, lons, cell_km, radius_km):
+        self.tam = tam
+        self.lats = lats
+        self.lons = lons
+        self.cell_km = cell_km
+        self.radius_km = radius_km
+
+    @property
+    def bounds(self):
+        """[[nam, tây], [bắc, đông]] theo mép ô (cho ImageOverlay)"""
+        half_lat = (self.lats[1] - self.lats[0]) / 2 if len(self.lats) > 1 else 0
+        half_lon = (self.lons[1] - self.lons[0]) / 2 if len(self.lons) > 1 else 0
+        return [[self.lats[0] - half_lat, self.lons[0] - half_lon],
+                [self.lats[-1] + half_lat, self.lons[-1] + half_lon]]
+
+    def peak(self):
+        """(lat, lon, TAM) của ô có TAM cao nhất"""
+        i, j = np.unravel_index(np.argmax(self.tam), self.tam.shape)
+        return self.lats[i], self.lons[j], self.tam[i, j]
+
+    def to_rgba(self, vmax=None):
+        """Ảnh RGBA uint8 (dòng 0 = phía bắc, như ảnh) theo HEAT_COLORS"""
+        vmax = float(self.tam.max()) if vmax is None else float(vmax)
+        scaled = np.clip(self.tam / vmax, 0, 1) if vmax > 0 else np.zeros_like(self.tam)
+        position = scaled * (len(HEAT_COLORS) - 1)
+        lower = np.minimum(position.astype(int), len(HEAT_COLORS) - 2)
+        fraction = (position - lower)[..., None]
+        rgba = HEAT_COLORS[lower] * (1 - fraction) + HEAT_COLORS[lower + 1] * fraction
+        return rgba[::-1].round().astype(np.uint8)
+
+    def save(self, path):
+        np.savez_compressed(path, tam=self.tam, lats=self.lats, lons=self.lons,
+                            cell_km=self.cell_km, radius_km=self.radius_km)
+
+
+def disc_sum(grid, radius_cells):
+    """Tổng grid trong đĩa bán kính radius_cells (đơn vị ô) quanh mỗi ô
+
+    Đĩa = các đoạn hàng [j - h(dy), j + h(dy)], h(dy) = floor(sqrt(r² - dy²));
+    mỗi đoạn là hiệu 2 phần tử của prefix sum theo hàng.
+    """
+    n_rows, n_cols = grid.shape
+    reach = int(np.floor(radius_cells))
+    padded = np.zeros((n_rows + 2 * reach, n_cols + 2 * reach + 1))
+    padded[reach:reach + n_rows, reach + 1:reach + 1 + n_cols] = grid
+    prefix = np.cumsum(padded, axis=1)
+
+    result = np.zeros(grid.shape)
+    for dy in range(-reach, reach + 1):
+        half = int(np.floor(np.sqrt(max(radius_cells ** 2 - dy ** 2, 0.0))))
+        rows = prefix[reach + dy:reach + dy + n_rows]
+        result += rows[:, reach + half + 1:reach + half + 1 + n_cols]
+        result -= rows[:, reach - half:reach - half + n_cols]
+    return result
+
+
+def heat_surface(school_lats, school_lons, students, existing_counts, radius_km, cell_km=0.1,
+                 bounds=None, overlap_share=0.5, penetration_rate=0.0162):
+    """TAM của 1 campus giả định tại mỗi ô lưới
+
+    - existing_counts: số campus hiện có phủ mỗi trường (membership.campus_counts)
+    - bounds: [[nam, tây], [bắc, đông]]; None = vùng chứa 99% trường (bỏ tọa độ lệch) + bán kính
+    TAM ô = (học sinh chưa phủ + overlap_share × học sinh đã phủ trong bán kính) × penetration_rate
+    """
+    lats = np.asarray(school_lats, dtype=float)
+    lons = np.asarray(school_lons, dtype=float)
+    students = np.asarray(students, dtype=float)
+    weights = students * np.where(np.asarray(existing_counts) == 0, 1.0, overlap_share)
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+    lats, lons, weights = lats[valid], lons[valid], weights[valid]
+
+    lat0 = np.median(lats)
+    lat_step = cell_km / KM_PER_DEGREE
+    lon_step = cell_km / (KM_PER_DEGREE * np.cos(np.radians(lat0)))
+    if bounds is None:
+        pad_lat, pad_lon = radius_km / cell_km * lat_step, radius_km / cell_km * lon_step
+        (south, north), (west, east) = np.percentile(lats, [0.5, 99.5]), np.percentile(lons, [0.5, 99.5])
+        bounds = [[south - pad_lat, west - pad_lon], [north + pad_lat, east + pad_lon]]
+    (south, west), (north, east) = bounds
+
+    grid_lats = np.arange(south + lat_step / 2, north, lat_step)
+    grid_lons = np.arange(west + lon_step / 2, east, lon_step)
+
+    # Rasterize: cộng trọng số trường vào ô chứa nó (trường ngoài vùng bị bỏ)
+    rows = np.floor((lats - south) / lat_step).astype(int)
+    cols = np.floor((lons - west) / lon_step).astype(int)
+    inside = (rows >= 0) & (rows < len(grid_lats)) & (cols >= 0) & (cols < len(grid_lons))
+    raster = np.zeros((len(grid_lats), len(grid_lons)))
+    np.add.at(raster, (rows[inside], cols[inside]), weights[inside])
+
+    tam = disc_sum(raster, radius_km / cell_km) * penetration_rate
+    return HeatSurface(tam, grid_lats, grid_lons, cell_km, radius_km)
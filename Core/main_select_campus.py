@@ -10,11 +10,52 @@ import traceback
 import os
 from datetime import datetime
 
+import pandas as pd
+
+from pipeline import run_pipeline, StageMemo, STAGES
+
 # ==== CẤU HÌNH HỆ THỐNG ====
 PENETRATION_RATE = 0.0162  # Tỷ lệ chuyển đổi từ học sinh công thành học viên (1.62%)
 COVERAGE_RADIUS_KM = 3     # Bán kính vùng phủ (km)
+CATCHMENT_MODE = 'radius'  # Vùng phủ: 'radius' (đường thẳng) | 'road' (thời gian đi trên mạng đường OSM)
+ROAD_NETWORK_FILE = './Input/roads.osm'  # File OSM XML cục bộ (.osm/.osm.gz/.osm.bz2) cho CATCHMENT_MODE = 'road'
+CATCHMENT_MINUTES = 15     # Thời gian đi tối đa (phút) cho CATCHMENT_MODE = 'road'
+ROAD_PROFILE = 'motorbike' # Tốc độ theo loại đường: 'motorbike' | 'car'
 OVERLAP_SHARE = 0.5        # Tỷ lệ chia sẻ vùng overlap (50-50)
+CALIBRATE_PENETRATION = True      # Tính penetration quan sát theo campus / dải khoảng cách (sheet Penetration_Calibration)
+USE_CALIBRATED_PENETRATION = False # Dùng penetration quan sát theo campus cho TAM thay vì PENETRATION_RATE
+CALIBRATION_BAND_KM = 1.0          # Độ rộng dải khoảng cách (km)
+ALLOCATION_MODE = 'flat'   # Chia học sinh trường shared: 'flat' (OVERLAP_SHARE) | 'huff' (theo khoảng cách)
+HUFF_DECAY = 2.0           # Hệ số suy giảm theo khoảng cách (Huff)
+HUFF_MODEL = 'power'       # 'power': d^-decay | 'exponential': exp(-decay·d)
 STUDENTS_PER_ROOM = 100    # Số học viên tối đa mỗi phòng
+SWEEP_RADII = [1, 2, 3, 4, 5]  # Các bán kính (km) cho sheet Radius_Sweep, [] = tắt
+HEAT_SURFACE_CELL_KM = 0.1     # Ô lưới (km) cho lớp TAM heat surface trên bản đồ, 0 = tắt
+MAP_RENDER_MODE = 'fast'           # Bản đồ: 'fast' (canvas + cluster, mở nhanh) | 'markers' (popup chi tiết từng trường)
+STUDENT_CHUNK_SIZE = 50000          # Số học viên mỗi khối khi gán campus gần nhất
+TRANSFER_MIN_SAVING_KM = 1.0       # Gợi ý chuyển campus khi gần hơn ít nhất (km)
+CAPACITY_ALLOCATION = True         # Phân bổ nhu cầu theo capacity (min quãng đường) cho Market_Opp
+
+# ==== 🎲 MONTE CARLO TAM ====
+MONTE_CARLO_DRAWS = 100000       # Số lượt rút cho sheet TAM_Monte_Carlo, 0 = tắt
+MONTE_CARLO_PENETRATION = None   # Phân phối penetration rate, None = tam giác ±30% quanh PENETRATION_RATE
+                                 # vd. {'dist': 'uniform', 'low': 0.01, 'high': 0.025}
+MONTE_CARLO_OVERLAP = None       # Phân phối overlap share, None = tam giác ±40% quanh OVERLAP_SHARE
+MONTE_CARLO_ENROLLMENT_CV = 0.1  # Độ lệch tương đối sĩ số từng trường
+
+# ==== 📍 GỢI Ý VỊ TRÍ CAMPUS MỚI ====
+SITE_SELECTION_K = 5                  # Số vị trí gợi ý (lazy greedy), 0 = tắt
+SITE_SELECTION_OBJECTIVE = 'exclusive'  # 'exclusive' (học sinh chưa được phủ) | 'tam'
+SITE_CANDIDATES_FILE = None           # Excel ứng viên có cột lat/lon, None = lưới quanh các trường
+SITE_GRID_SPACING_KM = 0.5            # Bước lưới ứng viên (km)
+
+# ==== 📏 DISTANCE KERNEL ====
+DISTANCE_METRIC = 'haversine'  # Kernel khoảng cách dùng chung mọi bước: 'haversine' | 'vincenty'
+SKIP_REVALIDATION = False      # True: bỏ bước validate lại khoảng cách ở bước 5 (cùng kernel với bước 2)
+
+# ==== ⚡ INPUT CACHE ====
+USE_INPUT_CACHE = True         # Cache cột (.npy) cho file Excel input trong Input/.cache
+STAGE_MEMO_DIR = None          # Memo kết quả từng bước trên đĩa (vd. './Input/.cache/stages'), None = tắt
 
 # ==== 🎯 CAMPUS SELECTION CONFIG ====
 # Chọn campus từ 43 campus có sẵn trong Excel
@@ -53,6 +94,7 @@ def main():
     print(f"   • Bán kính phủ: {COVERAGE_RADIUS_KM} km")
     print(f"   • Overlap Share: {OVERLAP_SHARE:.0%}")
     print(f"   • Capacity/phòng: {STUDENTS_PER_ROOM} học viên")
+    print(f"   • Distance metric: {DISTANCE_METRIC}{' (skip revalidation)' if SKIP_REVALIDATION else ''}")
     print("=" * 80)
     
     # Campus Selection Info
@@ -84,71 +126,81 @@ def main():
     print("   6️⃣ Xuất báo cáo Excel")
     print("=" * 80)
     
-    # Tạo namespace global để chia sẻ biến
-    global_vars = globals()
+    # Cấu hình truyền cho pipeline (mỗi bước đọc qua namespace riêng)
+    config = {
+        'PENETRATION_RATE': PENETRATION_RATE,
+        'COVERAGE_RADIUS_KM': COVERAGE_RADIUS_KM,
+        'CATCHMENT_MODE': CATCHMENT_MODE,
+        'ROAD_NETWORK_FILE': ROAD_NETWORK_FILE,
+        'CATCHMENT_MINUTES': CATCHMENT_MINUTES,
+        'ROAD_PROFILE': ROAD_PROFILE,
+        'OVERLAP_SHARE': OVERLAP_SHARE,
+        'CALIBRATE_PENETRATION': CALIBRATE_PENETRATION,
+        'USE_CALIBRATED_PENETRATION': USE_CALIBRATED_PENETRATION,
+        'CALIBRATION_BAND_KM': CALIBRATION_BAND_KM,
+        'ALLOCATION_MODE': ALLOCATION_MODE,
+        'HUFF_DECAY': HUFF_DECAY,
+        'HUFF_MODEL': HUFF_MODEL,
+        'STUDENTS_PER_ROOM': STUDENTS_PER_ROOM,
+        'SWEEP_RADII': SWEEP_RADII,
+        'HEAT_SURFACE_CELL_KM': HEAT_SURFACE_CELL_KM,
+        'MAP_RENDER_MODE': MAP_RENDER_MODE,
+        'STUDENT_CHUNK_SIZE': STUDENT_CHUNK_SIZE,
+        'TRANSFER_MIN_SAVING_KM': TRANSFER_MIN_SAVING_KM,
+        'CAPACITY_ALLOCATION': CAPACITY_ALLOCATION,
+        'MONTE_CARLO_DRAWS': MONTE_CARLO_DRAWS,
+        'MONTE_CARLO_PENETRATION': MONTE_CARLO_PENETRATION,
+        'MONTE_CARLO_OVERLAP': MONTE_CARLO_OVERLAP,
+        'MONTE_CARLO_ENROLLMENT_CV': MONTE_CARLO_ENROLLMENT_CV,
+        'DISTANCE_METRIC': DISTANCE_METRIC,
+        'SKIP_REVALIDATION': SKIP_REVALIDATION,
+        'USE_INPUT_CACHE': USE_INPUT_CACHE,
+        'SELECTED_CAMPUSES': SELECTED_CAMPUSES,
+        'NEW_CAMPUSES': NEW_CAMPUSES,
+        'USE_CAMPUS_SELECTION': USE_CAMPUS_SELECTION,
+    }
+    
+    step_icons = {'load': '📂', 'coverage': '🗺️', 'overlap': '🔄', 'tam': '📈', 'map': '🎨', 'export': '📊'}
     
-    # Export các biến cấu hình để các module khác sử dụng
-    global_vars['PENETRATION_RATE'] = PENETRATION_RATE
-    global_vars['COVERAGE_RADIUS_KM'] = COVERAGE_RADIUS_KM
-    global_vars['OVERLAP_SHARE'] = OVERLAP_SHARE
-    global_vars['STUDENTS_PER_ROOM'] = STUDENTS_PER_ROOM
+    def on_stage_start(stage):
+        step_num = STAGES.index(stage) + 1
+        print(f"\n{step_icons.get(stage.name, '▶️')} BƯỚC {step_num}: {stage.title}...")
     
-    # Export campus selection config
-    global_vars['SELECTED_CAMPUSES'] = SELECTED_CAMPUSES
-    global_vars['NEW_CAMPUSES'] = NEW_CAMPUSES
-    global_vars['USE_CAMPUS_SELECTION'] = USE_CAMPUS_SELECTION
+    def on_stage_end(stage, outputs):
+        print(f"✅ Hoàn thành bước {STAGES.index(stage) + 1}")
     
     try:
-        # Bước 1: Load dữ liệu với campus selection
-        print("\n📂 BƯỚC 1: Load dữ liệu từ Excel với campus selection...")
-        with open("01_load_data_selection.py", "r", encoding="utf-8") as f:
-            exec(f.read(), global_vars)
-        print("✅ Hoàn thành bước 1")
-        
-        # Bước 2: Tính vùng phủ
-        print("\n🗺️ BƯỚC 2: Tính vùng phủ từng campus...")
-        with open("02_compute_coverage.py", "r", encoding="utf-8") as f:
-            exec(f.read(), global_vars)
-        print("✅ Hoàn thành bước 2")
-        
-        # Bước 3: Ma trận overlap
-        print("\n🔄 BƯỚC 3: Tính ma trận overlap...")
-        with open("03_overlap_matrix.py", "r", encoding="utf-8") as f:
-            exec(f.read(), global_vars)
-        print("✅ Hoàn thành bước 3")
-        
-        # Bước 4: Phân tích TAM
-        print("\n📈 BƯỚC 4: Phân tích TAM...")
-        with open("04_tam_analysis.py", "r", encoding="utf-8") as f:
-            exec(f.read(), global_vars)
-        print("✅ Hoàn thành bước 4")
-        
-        # Bước 5: Tạo bản đồ
-        print("\n🎨 BƯỚC 5: Tạo bản đồ interactive...")
-        with open("05_generate_map.py", "r", encoding="utf-8") as f:
-            exec(f.read(), global_vars)
-        print("✅ Hoàn thành bước 5")
-        
-        # Bước 6: Báo cáo Excel
-        print("\n📊 BƯỚC 6: Xuất báo cáo Excel...")
-        with open("06_export_excel.py", "r", encoding="utf-8") as f:
-            exec(f.read(), global_vars)
-        print("✅ Hoàn thành bước 6")
+        memo = StageMemo(cache_dir=STAGE_MEMO_DIR) if STAGE_MEMO_DIR else None
+        result = run_pipeline(config, on_stage_start=on_stage_start, on_stage_end=on_stage_end, memo=memo)
+        outputs = result.outputs
         
         # Tổng kết
         print("\n" + "="*80)
         print("🎉 PHÂN TÍCH HOÀN TẤT THÀNH CÔNG!")
         print("="*80)
+        print(f"⏱️  Thời gian: {result.total_seconds:.2f}s (" +
+              ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result.timings.items()) + ")")
+        
+        # Gợi ý vị trí campus mới so với các campus vừa phân tích
+        if SITE_SELECTION_K > 0:
+            candidates = pd.read_excel(SITE_CANDIDATES_FILE) if SITE_CANDIDATES_FILE else None
+            sites_df = result.select_sites(SITE_SELECTION_K, candidates, SITE_SELECTION_OBJECTIVE,
+                                           spacing_km=SITE_GRID_SPACING_KM)
+            print(f"\n📍 GỢI Ý {len(sites_df)} VỊ TRÍ CAMPUS MỚI (objective: {SITE_SELECTION_OBJECTIVE}):")
+            for _, site in sites_df.iterrows():
+                print(f"   #{int(site['Rank'])}: ({site['lat']:.5f}, {site['lon']:.5f}) - "
+                      f"{site['New Students']:,.0f} học sinh mới, {site['Shared Students']:,.0f} học sinh đã phủ, "
+                      f"TAM {site['TAM']:,.0f}")
         
         # Thống kê tổng kết
-        if 'campuses_df' in global_vars:
-            num_campuses = len(global_vars['campuses_df'])
+        if 'campuses_df' in outputs:
+            num_campuses = len(outputs['campuses_df'])
             print(f"📊 THỐNG KÊ TỔNG KẾT:")
             print(f"   🏢 Tổng số campus được phân tích: {num_campuses}")
             
             print(f"   📋 Chi tiết từng campus:")
-            if 'coverage_results' in global_vars:
-                coverage = global_vars['coverage_results']
+            if 'coverage_results' in outputs:
+                coverage = outputs['coverage_results']
                 for campus_code, data in coverage.items():
                     campus_name = data.get('campus_name', campus_code)
                     print(f"      📍 {campus_code} ({campus_name})")
@@ -156,14 +208,14 @@ def main():
                     print(f"         • {data['total_students']:,} học sinh nguồn")
                     print(f"         • {data['capacity']:,} capacity")
             
-            if 'overlap_matrix' in global_vars:
-                matrix = global_vars['overlap_matrix']
+            if 'overlap_matrix' in outputs:
+                matrix = outputs['overlap_matrix']
                 total_overlaps = sum(1 for i in range(len(matrix)) for j in range(i+1, len(matrix)) if matrix.iloc[i,j] > 0)
                 print(f"   🔄 Số cặp campus có overlap: {total_overlaps}")
             
-            if 'tam_results' in global_vars:
-                total_tam = sum(data['tam'] for data in global_vars['tam_results'].values())
-                total_capacity = sum(data['capacity'] for data in global_vars['tam_results'].values())
+            if 'tam_results' in outputs:
+                total_tam = sum(data['tam'] for data in outputs['tam_results'].values())
+                total_capacity = sum(data['capacity'] for data in outputs['tam_results'].values())
                 utilization = total_tam / total_capacity if total_capacity > 0 else 0
                 print(f"   📈 Tổng TAM: {total_tam:,.0f} học viên")
                 print(f"   📊 Tổng capacity: {total_capacity:,} học viên")
@@ -10,11 +10,46 @@ import traceback
 import os
 from datetime import datetime
 
+import pandas as pd
+
+from distance_engine import distance_km
+from pipeline import DEFAULT_CONFIG, STAGES_BY_NAME
+
 # ==== CẤU HÌNH HỆ THỐNG ====
 PENETRATION_RATE = 0.0162  # Tỷ lệ chuyển đổi từ học sinh công thành học viên (1.62%)
 COVERAGE_RADIUS_KM = 3     # Bán kính vùng phủ (km)
+CATCHMENT_MODE = 'radius'  # Vùng phủ: 'radius' (đường thẳng) | 'road' (thời gian đi trên mạng đường OSM)
+ROAD_NETWORK_FILE = './Input/roads.osm'  # File OSM XML cục bộ (.osm/.osm.gz/.osm.bz2) cho CATCHMENT_MODE = 'road'
+CATCHMENT_MINUTES = 15     # Thời gian đi tối đa (phút) cho CATCHMENT_MODE = 'road'
+ROAD_PROFILE = 'motorbike' # Tốc độ theo loại đường: 'motorbike' | 'car'
 OVERLAP_SHARE = 0.5        # Tỷ lệ chia sẻ vùng overlap (50-50)
+CALIBRATE_PENETRATION = True      # Tính penetration quan sát theo campus / dải khoảng cách (sheet Penetration_Calibration)
+USE_CALIBRATED_PENETRATION = False # Dùng penetration quan sát theo campus cho TAM thay vì PENETRATION_RATE
+CALIBRATION_BAND_KM = 1.0          # Độ rộng dải khoảng cách (km)
+ALLOCATION_MODE = 'flat'   # Chia học sinh trường shared: 'flat' (OVERLAP_SHARE) | 'huff' (theo khoảng cách)
+HUFF_DECAY = 2.0           # Hệ số suy giảm theo khoảng cách (Huff)
+HUFF_MODEL = 'power'       # 'power': d^-decay | 'exponential': exp(-decay·d)
 STUDENTS_PER_ROOM = 100    # Số học viên tối đa mỗi phòng
+SWEEP_RADII = [1, 2, 3, 4, 5]  # Các bán kính (km) cho sheet Radius_Sweep, [] = tắt
+HEAT_SURFACE_CELL_KM = 0.1     # Ô lưới (km) cho lớp TAM heat surface trên bản đồ, 0 = tắt
+MAP_RENDER_MODE = 'fast'           # Bản đồ: 'fast' (canvas + cluster, mở nhanh) | 'markers' (popup chi tiết từng trường)
+STUDENT_CHUNK_SIZE = 50000          # Số học viên mỗi khối khi gán campus gần nhất
+TRANSFER_MIN_SAVING_KM = 1.0       # Gợi ý chuyển campus khi gần hơn ít nhất (km)
+CAPACITY_ALLOCATION = True         # Phân bổ nhu cầu theo capacity (min quãng đường) cho Market_Opp
+
+# ==== 🎲 MONTE CARLO TAM ====
+MONTE_CARLO_DRAWS = 100000       # Số lượt rút cho sheet TAM_Monte_Carlo, 0 = tắt
+MONTE_CARLO_PENETRATION = None   # Phân phối penetration rate, None = tam giác ±30% quanh PENETRATION_RATE
+                                 # vd. {'dist': 'uniform', 'low': 0.01, 'high': 0.025}
+MONTE_CARLO_OVERLAP = None       # Phân phối overlap share, None = tam giác ±40% quanh OVERLAP_SHARE
+MONTE_CARLO_ENROLLMENT_CV = 0.1  # Độ lệch tương đối sĩ số từng trường
+
+# ==== 📏 DISTANCE KERNEL ====
+DISTANCE_METRIC = 'haversine'  # Kernel khoảng cách dùng chung mọi bước: 'haversine' | 'vincenty'
+SKIP_REVALIDATION = False      # True: bỏ bước validate lại khoảng cách ở bước 5 (cùng kernel với bước 2)
+
+# ==== ⚡ INPUT CACHE ====
+USE_INPUT_CACHE = True         # Cache cột (.npy) cho file Excel input trong Input/.cache
 
 # ==== 🎯 CAMPUS SELECTION CONFIG ====
 SELECTED_CAMPUSES = [
@@ -74,8 +109,8 @@ def wait_for_user():
     if STEP_BY_STEP:
         input("⏸️  Nhấn Enter để tiếp tục...")
 
-def run_step_with_debug(step_name, file_name, step_num, global_vars):
-    """Chạy một bước với debug"""
+def run_step_with_debug(step_name, stage, step_num, config, global_vars):
+    """Chạy một bước (pipeline.Stage) với debug, output gộp vào global_vars"""
     if not STEPS_TO_RUN.get(step_name, True):
         print(f"⏭️  Bỏ qua {step_name}")
         return True
@@ -83,9 +118,8 @@ def run_step_with_debug(step_name, file_name, step_num, global_vars):
     print_step_header(step_num, step_name.replace('_', ' ').title())
     
     try:
-        # Chạy file
-        with open(file_name, "r", encoding="utf-8") as f:
-            exec(f.read(), global_vars)
+        # Chạy bước với input lấy từ output các bước trước
+        global_vars.update(stage.run(config, global_vars))
         
         print(f"✅ Hoàn thành {step_name}")
         
@@ -102,6 +136,23 @@ def run_step_with_debug(step_name, file_name, step_num, global_vars):
             traceback.print_exc()
         return False
 
+def campus_radius_lookup(global_vars):
+    """Tra cứu {campus_code: {vị trí trường: khoảng cách}} qua spatial index"""
+    school_index = global_vars.get('school_index')
+    campuses_df = global_vars['campuses_df']
+    lookup = {}
+    
+    if school_index is None:
+        return lookup
+    
+    for _, campus in campuses_df.iterrows():
+        positions, distances = school_index.query_radius(
+            float(campus['lat']), float(campus['lon']), COVERAGE_RADIUS_KM
+        )
+        lookup[campus['Campus Code']] = dict(zip(positions.tolist(), distances.tolist()))
+    
+    return lookup
+
 def run_step_debug(step_name, global_vars):
     """Chạy debug cho từng bước"""
     
@@ -178,28 +229,29 @@ def run_step_debug(step_name, global_vars):
             
             # Test with specific schools
             test_schools = ['Tiểu học Bùi Minh Trực', 'Tiểu học Lam Sơn']
+            radius_lookup = campus_radius_lookup(global_vars)
             
             for school_name in test_schools:
                 school_data = schools_df[schools_df['Tên trường'] == school_name]
                 if not school_data.empty:
                     school = school_data.iloc[0]
                     school_lat, school_lon = school['lat'], school['lon']
+                    school_pos = int(school['school_id'])
                     
                     print(f"\n🔍 Testing {school_name} ({school_lat}, {school_lon}):")
                     
-                    for _, campus in campuses_df.iterrows():
-                        campus_code = campus['Campus Code']
-                        campus_lat, campus_lon = campus['lat'], campus['lon']
-                        
-                        # Manual distance calculation
-                        from geopy.distance import geodesic
-                        distance = geodesic((school_lat, school_lon), (campus_lat, campus_lon)).km
+                    for campus_code, in_radius in radius_lookup.items():
+                        # Radius query qua spatial index
+                        distance = in_radius.get(school_pos)
                         
-                        print(f"   📍 {campus_code}: {distance:.2f}km")
+                        if distance is not None:
+                            print(f"   📍 {campus_code}: {distance:.2f}km")
+                        else:
+                            print(f"   📍 {campus_code}: > {COVERAGE_RADIUS_KM}km")
                         
                         # Check if in coverage
-                        in_coverage = school_name in coverage_results.get(campus_code, {}).get('schools_df', pd.DataFrame())['Tên trường'].values
-                        should_be_in = distance <= COVERAGE_RADIUS_KM
+                        in_coverage = school_pos in coverage_results.get(campus_code, {}).get('schools_df', pd.DataFrame()).get('school_id', pd.Series(dtype=int)).values
+                        should_be_in = distance is not None
                         
                         if in_coverage != should_be_in:
                             print(f"      ❌ MISMATCH: In coverage={in_coverage}, Should be={should_be_in}")
@@ -213,39 +265,28 @@ def run_step_debug(step_name, global_vars):
             school_classification = global_vars['school_classification']
             
             # Check shared schools
-            shared_schools = {name: data for name, data in school_classification.items() 
+            shared_schools = {school_id: data for school_id, data in school_classification.items() 
                             if data['type'] == 'shared'}
             
             print(f"📊 Found {len(shared_schools)} shared schools")
+            radius_lookup = campus_radius_lookup(global_vars) if 'campuses_df' in global_vars else {}
             
-            for school_name, data in list(shared_schools.items())[:5]:  # Top 5
+            for school_id, data in list(shared_schools.items())[:5]:  # Top 5
                 campuses = data['campuses']
-                print(f"\n🔍 {school_name}:")
+                print(f"\n🔍 {data.get('name', school_id)} (#{school_id}):")
                 print(f"   • Assigned to: {campuses}")
                 
-                # Verify distances manually
-                if 'schools_df' in global_vars and 'campuses_df' in global_vars:
-                    schools_df = global_vars['schools_df']
-                    campuses_df = global_vars['campuses_df']
+                # Verify distances qua spatial index (school_id = vị trí trong schools_df)
+                for campus_code in campuses:
+                    if campus_code not in radius_lookup:
+                        continue
                     
-                    school_data = schools_df[schools_df['Tên trường'] == school_name]
-                    if not school_data.empty:
-                        school = school_data.iloc[0]
-                        school_lat, school_lon = school['lat'], school['lon']
-                        
-                        for campus_code in campuses:
-                            campus_data = campuses_df[campuses_df['Campus Code'] == campus_code]
-                            if not campus_data.empty:
-                                campus = campus_data.iloc[0]
-                                campus_lat, campus_lon = campus['lat'], campus['lon']
-                                
-                                from geopy.distance import geodesic
-                                distance = geodesic((school_lat, school_lon), (campus_lat, campus_lon)).km
-                                
-                                print(f"   📍 Distance to {campus_code}: {distance:.2f}km")
-                                
-                                if distance > COVERAGE_RADIUS_KM:
-                                    print(f"      ❌ VIOLATION: {distance:.2f}km > {COVERAGE_RADIUS_KM}km")
+                    distance = radius_lookup[campus_code].get(school_id)
+                    
+                    if distance is not None:
+                        print(f"   📍 Distance to {campus_code}: {distance:.2f}km")
+                    else:
+                        print(f"      ❌ VIOLATION: > {COVERAGE_RADIUS_KM}km from {campus_code}")
     
     elif step_name == 'step5_generate_map' and DEBUG_STEPS.get('step5_validation_debug', False):
         print_debug_section("STEP 5 - Validation Debug")
@@ -267,10 +308,9 @@ def run_step_debug(step_name, global_vars):
                 schools_df = global_vars['schools_df']
                 campuses_df = global_vars['campuses_df']
                 
-                for school_name, classification in school_classification.items():
-                    school_data = schools_df[schools_df['Tên trường'] == school_name]
-                    if not school_data.empty:
-                        school = school_data.iloc[0]
+                for school_id, classification in school_classification.items():
+                    if 0 <= school_id < len(schools_df):
+                        school = schools_df.iloc[school_id]
                         school_lat, school_lon = school['lat'], school['lon']
                         
                         for campus_code in classification['campuses']:
@@ -279,11 +319,10 @@ def run_step_debug(step_name, global_vars):
                                 campus = campus_data.iloc[0]
                                 campus_lat, campus_lon = campus['lat'], campus['lon']
                                 
-                                from geopy.distance import geodesic
-                                distance = geodesic((school_lat, school_lon), (campus_lat, campus_lon)).km
+                                distance = distance_km(school_lat, school_lon, campus_lat, campus_lon, DISTANCE_METRIC)
                                 
                                 if distance > COVERAGE_RADIUS_KM:
-                                    print(f"   ❌ STILL VIOLATION: {school_name} → {campus_code}: {distance:.2f}km")
+                                    print(f"   ❌ STILL VIOLATION: {classification.get('name', school_id)} → {campus_code}: {distance:.2f}km")
                                     violations_found += 1
             
             if violations_found == 0:
@@ -315,39 +354,58 @@ def main():
     
     wait_for_user()
     
-    # Tạo namespace global
-    global_vars = globals()
-    
-    # Export cấu hình
-    for key, value in {
+    # Cấu hình truyền cho từng bước
+    config = {
+        **DEFAULT_CONFIG,
         'PENETRATION_RATE': PENETRATION_RATE,
         'COVERAGE_RADIUS_KM': COVERAGE_RADIUS_KM,
+        'CATCHMENT_MODE': CATCHMENT_MODE,
+        'ROAD_NETWORK_FILE': ROAD_NETWORK_FILE,
+        'CATCHMENT_MINUTES': CATCHMENT_MINUTES,
+        'ROAD_PROFILE': ROAD_PROFILE,
         'OVERLAP_SHARE': OVERLAP_SHARE,
+        'CALIBRATE_PENETRATION': CALIBRATE_PENETRATION,
+        'USE_CALIBRATED_PENETRATION': USE_CALIBRATED_PENETRATION,
+        'CALIBRATION_BAND_KM': CALIBRATION_BAND_KM,
+        'ALLOCATION_MODE': ALLOCATION_MODE,
+        'HUFF_DECAY': HUFF_DECAY,
+        'HUFF_MODEL': HUFF_MODEL,
         'STUDENTS_PER_ROOM': STUDENTS_PER_ROOM,
+        'SWEEP_RADII': SWEEP_RADII,
+        'HEAT_SURFACE_CELL_KM': HEAT_SURFACE_CELL_KM,
+        'MAP_RENDER_MODE': MAP_RENDER_MODE,
+        'STUDENT_CHUNK_SIZE': STUDENT_CHUNK_SIZE,
+        'TRANSFER_MIN_SAVING_KM': TRANSFER_MIN_SAVING_KM,
+        'CAPACITY_ALLOCATION': CAPACITY_ALLOCATION,
+        'MONTE_CARLO_DRAWS': MONTE_CARLO_DRAWS,
+        'MONTE_CARLO_PENETRATION': MONTE_CARLO_PENETRATION,
+        'MONTE_CARLO_OVERLAP': MONTE_CARLO_OVERLAP,
+        'MONTE_CARLO_ENROLLMENT_CV': MONTE_CARLO_ENROLLMENT_CV,
         'SELECTED_CAMPUSES': SELECTED_CAMPUSES,
         'NEW_CAMPUSES': NEW_CAMPUSES,
         'USE_CAMPUS_SELECTION': USE_CAMPUS_SELECTION,
+        'DISTANCE_METRIC': DISTANCE_METRIC,
+        'SKIP_REVALIDATION': SKIP_REVALIDATION,
+        'USE_INPUT_CACHE': USE_INPUT_CACHE,
         'DEBUG_MODE': DEBUG_MODE
-    }.items():
-        global_vars[key] = value
+    }
+    
+    # Output các bước (thay cho namespace global)
+    global_vars = {}
     
     try:
-        # Import pandas for debug functions
-        import pandas as pd
-        global_vars['pd'] = pd
-        
         # Chạy từng bước
         steps = [
-            ('step1_load_data', '01_load_data_selection.py', 1),
-            ('step2_compute_coverage', '02_compute_coverage.py', 2),
-            ('step3_overlap_matrix', '03_overlap_matrix.py', 3),
-            ('step4_tam_analysis', '04_tam_analysis.py', 4),
-            ('step5_generate_map', '05_generate_map.py', 5),
-            ('step6_export_excel', '06_export_excel.py', 6)
+            ('step1_load_data', STAGES_BY_NAME['load'], 1),
+            ('step2_compute_coverage', STAGES_BY_NAME['coverage'], 2),
+            ('step3_overlap_matrix', STAGES_BY_NAME['overlap'], 3),
+            ('step4_tam_analysis', STAGES_BY_NAME['tam'], 4),
+            ('step5_generate_map', STAGES_BY_NAME['map'], 5),
+            ('step6_export_excel', STAGES_BY_NAME['export'], 6)
         ]
         
-        for step_name, file_name, step_num in steps:
-            success = run_step_with_debug(step_name, file_name, step_num, global_vars)
+        for step_name, stage, step_num in steps:
+            success = run_step_with_debug(step_name, stage, step_num, config, global_vars)
             if not success:
                 print(f"❌ Dừng tại {step_name} do lỗi")
                 return False
@@ -0,0 +1,284 @@
+# membership.py
+"""
+Ma trận membership thưa trường × campus (CSR) + ma trận khoảng cách đi kèm
+- Build 1 lần ở bước 2 từ kết quả truy vấn spatial index
+- Exclusive/shared, tổng theo campus, input TAM = phép rút gọn theo dòng/cột
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+def overlap_products(matrix, weights, pairs=None):
+    """Ma trận overlap giữa các cột của membership `matrix`
+
+    Trả về (Mᵀ·diag(weights)·M, Mᵀ·M) dạng dense: tổng weights và số dòng
+    thuộc đồng thời 2 cột. Đường chéo = tổng/số dòng của từng cột.
+    Nếu có `pairs` (mảng (i, j) cột), chỉ tính các cặp đó; cặp khác = 0.
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    if pairs is None:
+        weighted = (matrix.T @ sparse.diags(weights) @ matrix).toarray()
+        counts = (matrix.T @ matrix).toarray().astype(int)
+        return weighted, counts
+
+    matrix_csc = matrix.tocsc()
+    matrix_csc.sort_indices()
+
+    n_cols = matrix.shape[1]
+    weighted = np.zeros((n_cols, n_cols))
+    counts = np.zeros((n_cols, n_cols), dtype=int)
+    np.fill_diagonal(weighted, matrix.T @ weights)
+    np.fill_diagonal(counts, np.diff(matrix_csc.indptr))
+
+    for i, j in pairs:
+        rows = shared_rows(matrix_csc, i, j)
+        if len(rows) > 0:
+            weighted[i, j] = weighted[j, i] = weights[rows].sum()
+            counts[i, j] = counts[j, i] = len(rows)
+    return weighted, counts
+
+
+def classification_matrix(classification, campus_codes, school_type=None):
+    """Membership (keys × campus) từ dict school_classification {key: {type, campuses}}
+
+    Chỉ giữ các key có type == school_type (nếu có). Trả về (keys, CSR bool).
+    """
+    campus_index = {code: i for i, code in enumerate(campus_codes)}
+    keys, rows, cols = [], [], []
+    for key, data in classification.items():
+        if school_type is not None and data.get('type') != school_type:
+            continue
+        row = len(keys)
+        keys.append(key)
+        for campus in data.get('campuses', []):
+            if campus in campus_index:
+                rows.append(row)
+                cols.append(campus_index[campus])
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, cols)), shape=(len(keys), len(campus_index))
+    )
+    return keys, matrix
+
+
+def shared_rows(matrix_csc, col1, col2):
+    """Các dòng thuộc đồng thời 2 cột của ma trận CSC (sắp theo chỉ số dòng)"""
+    rows1 = matrix_csc.indices[matrix_csc.indptr[col1]:matrix_csc.indptr[col1 + 1]]
+    rows2 = matrix_csc.indices[matrix_csc.indptr[col2]:matrix_csc.indptr[col2 + 1]]
+    return np.intersect1d(rows1, rows2, assume_unique=True)
+
+
+def pack_masks(matrix):
+    """Bitmask tập cột của mỗi dòng: uint8 (n_rows × ceil(n_cols/8)), bit j = cột j"""
+    matrix = sparse.csr_matrix(matrix)
+    n_rows, n_cols = matrix.shape
+    masks = np.zeros((n_rows, (n_cols + 7) // 8), dtype=np.uint8)
+    rows = np.repeat(np.arange(n_rows), np.diff(matrix.indptr))
+    cols = matrix.indices
+    np.bitwise_or.at(masks, (rows, cols // 8), np.left_shift(1, cols % 8).astype(np.uint8))
+    return masks
+
+
+def mask_groups(matrix, weights):
+    """Nhóm các dòng theo bitmask tập cột (1 lần np.unique trên mask)
+
+    Trả về list zone {'columns', 'rows', 'weight'}: mỗi zone = đúng 1 tập cột,
+    rows sắp theo chỉ số dòng. Dòng không thuộc cột nào bị bỏ qua.
+    """
+    matrix = sparse.csr_matrix(matrix)
+    weights = np.asarray(weights, dtype=float)
+    n_cols = matrix.shape[1]
+
+    covered = np.nonzero(np.diff(matrix.indptr) > 0)[0]
+    if len(covered) == 0:
+        return []
+
+    masks = pack_masks(matrix)[covered]
+    unique_masks, inverse = np.unique(masks, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=len(unique_masks)))])
+
+    zones = []
+    for g, mask in enumerate(unique_masks):
+        rows = covered[order[bounds[g]:bounds[g + 1]]]
+        zones.append({
+            'columns': np.nonzero(np.unpackbits(mask, bitorder='little')[:n_cols])[0],
+            'rows': rows,
+            'weight': weights[rows].sum()
+        })
+    return zones
+
+
+class CoverageMembership:
+    """Membership trường × campus
+
+    - matrix: CSR bool (n_schools × n_campuses), dòng = vị trí trong schools_df
+    - distances: CSR float cùng cấu trúc với matrix (km)
+    - students: số học sinh theo vị trí trường (bước 2 chuẩn hóa)
+    """
+
+    def __init__(self, indptr, indices, distance_data, campus_codes, students):
+        self.campus_codes = list(campus_codes)
+        self.campus_index = {code: i for i, code in enumerate(self.campus_codes)}
+        self.students = np.asarray(students, dtype=float)
+
+        shape = (len(self.students), len(self.campus_codes))
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=bool), indices, indptr), shape=shape
+        )
+        self.distances = sparse.csr_matrix((distance_data, indices, indptr), shape=shape)
+        self._csc = None
+
+    @classmethod
+    def from_neighbors(cls, campus_neighbors, campus_codes, students):
+        """Build từ list (positions, distances) theo thứ tự campus_codes"""
+        n_schools = len(students)
+        rows = np.concatenate([np.asarray(p, dtype=np.int64) for p, _ in campus_neighbors] or [np.array([], dtype=np.int64)])
+        cols = np.concatenate([np.full(len(p), j, dtype=np.int64) for j, (p, _) in enumerate(campus_neighbors)] or [np.array([], dtype=np.int64)])
+        data = np.concatenate([np.asarray(d, dtype=float) for _, d in campus_neighbors] or [np.array([], dtype=float)])
+
+        # Sắp theo (trường, campus) -> CSR với indices đã sort trong từng dòng
+        order = np.lexsort((cols, rows))
+        rows, cols, data = rows[order], cols[order], data[order]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_schools))])
+
+        return cls(indptr, cols, data, campus_codes, students)
+
+    @property
+    def n_schools(self):
+        return self.matrix.shape[0]
+
+    @property
+    def n_campuses(self):
+        return self.matrix.shape[1]
+
+    @property
+    def nnz(self):
+        return self.matrix.nnz
+
+    @property
+    def csc(self):
+        """Bản CSC (truy cập theo campus), tạo lazily"""
+        if self._csc is None:
+            self._csc = self.distances.tocsc()
+            self._csc.sort_indices()
+        return self._csc
+
+    # ----- Rút gọn theo dòng (trường) -----
+
+    @property
+    def campus_counts(self):
+        """Số campus phủ mỗi trường"""
+        return np.diff(self.matrix.indptr)
+
+    @property
+    def covered_mask(self):
+        return self.campus_counts > 0
+
+    @property
+    def exclusive_mask(self):
+        return self.campus_counts == 1
+
+    @property
+    def shared_mask(self):
+        return self.campus_counts > 1
+
+    def school_type(self, position):
+        """'exclusive' / 'shared' / None theo số campus phủ"""
+        count = self.campus_counts[position]
+        if count == 1:
+            return 'exclusive'
+        if count > 1:
+            return 'shared'
+        return None
+
+    def school_campuses(self, position):
+        """Danh sách campus phủ trường (theo thứ tự campus_codes)"""
+        start, end = self.matrix.indptr[position], self.matrix.indptr[position + 1]
+        return [self.campus_codes[j] for j in self.matrix.indices[start:end]]
+
+    # ----- Rút gọn theo cột (campus) -----
+
+    def campus_sum(self, weights=None, school_mask=None):
+        """Tổng weights (mặc định = students) của các trường thuộc mỗi campus"""
+        weights = self.students if weights is None else np.asarray(weights, dtype=float)
+        if school_mask is not None:
+            weights = np.where(school_mask, weights, 0.0)
+        return self.matrix.T.astype(float) @ weights
+
+    def huff_shares(self, decay=2.0, model='power', attractiveness=None, min_distance_km=0.1):
+        """Tỷ lệ chia học sinh mỗi trường cho các campus phủ (Huff / gravity), CSR cùng cấu trúc distances
+
+        Trọng số campus j với trường i: A_j · max(d_ij, min_distance_km)^-decay ('power')
+        hoặc A_j · exp(-decay · d_ij) ('exponential'); chuẩn hóa theo dòng -> tổng mỗi dòng = 1.
+        """
+        distances = np.maximum(self.distances.data, min_distance_km)
+        if model == 'power':
+            weights = distances ** -decay
+        elif model == 'exponential':
+            weights = np.exp(-decay * distances)
+        else:
+            raise ValueError(f"Huff model không hỗ trợ: {model} (chọn 'power' | 'exponential')")
+        if attractiveness is not None:
+            weights = weights * np.asarray(attractiveness, dtype=float)[self.matrix.indices]
+
+        rows = np.repeat(np.arange(self.n_schools), self.campus_counts)
+        row_sums = np.bincount(rows, weights=weights, minlength=self.n_schools)
+        shares = np.divide(weights, row_sums[rows], out=np.zeros_like(weights), where=row_sums[rows] > 0)
+        return sparse.csr_matrix((shares, self.matrix.indices, self.matrix.indptr), shape=self.matrix.shape)
+
+    def campus_allocation(self, shares, weights=None, school_mask=None):
+        """Học sinh phân bổ cho mỗi campus theo ma trận tỷ lệ `shares` (vd. huff_shares())"""
+        weights = self.students if weights is None else np.asarray(weights, dtype=float)
+        if school_mask is not None:
+            weights = np.where(school_mask, weights, 0.0)
+        return shares.T @ weights
+
+    def school_mean(self, campus_values, shares=None):
+        """Trung bình giá trị theo campus (vd. penetration) trên các campus phủ mỗi trường
+
+        Trọng số = shares (vd. huff_shares()) hoặc chia đều cho các campus phủ; trường không được phủ -> 0.
+        """
+        if shares is None:
+            counts = self.campus_counts
+            weights = np.repeat(1.0 / np.maximum(counts, 1), counts)
+            shares = sparse.csr_matrix((weights, self.matrix.indices, self.matrix.indptr), shape=self.matrix.shape)
+        return shares @ np.asarray(campus_values, dtype=float)
+
+    def campus_school_counts(self, school_mask=None):
+        """Số trường thuộc mỗi campus (lọc theo school_mask nếu có)"""
+        weights = np.ones(self.n_schools) if school_mask is None else np.asarray(school_mask, dtype=float)
+        return (self.matrix.T.astype(float) @ weights).astype(int)
+
+    def campus_schools(self, campus_code):
+        """(positions, distances) các trường thuộc campus, sắp theo vị trí"""
+        j = self.campus_index[campus_code]
+        start, end = self.csc.indptr[j], self.csc.indptr[j + 1]
+        return self.csc.indices[start:end], self.csc.data[start:end]
+
+    def overlap(self, weights=None, pairs=None):
+        """(học sinh chung, số trường chung) giữa các cặp campus: Mᵀ·diag(w)·M, Mᵀ·M"""
+        weights = self.students if weights is None else weights
+        return overlap_products(self.matrix, weights, pairs)
+
+    def shared_positions(self, campus1, campus2):
+        """Vị trí các trường thuộc cả 2 campus"""
+        return shared_rows(self.csc, self.campus_index[campus1], self.campus_index[campus2])
+
+    def zones(self, weights=None):
+        """Vùng overlap k-campus: nhóm trường theo đúng tập campus phủ (bitmask)"""
+        weights = self.students if weights is None else weights
+        zones = mask_groups(self.matrix, weights)
+        for zone in zones:
+            zone['campuses'] = [self.campus_codes[j] for j in zone['columns']]
+        return zones
+
+    def first_seen_order(self):
+        """Vị trí trường được phủ theo thứ tự duyệt (campus đầu tiên phủ, rồi vị trí)"""
+        covered = np.nonzero(self.covered_mask)[0]
+        first_campus = self.matrix.indices[self.matrix.indptr[covered]]
+        return covered[np.lexsort((covered, first_campus))]
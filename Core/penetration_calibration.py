@@ -0,0 +1,151 @@
+# penetration_calibration.py
+"""
+Hiệu chỉnh penetration rate từ học viên thực tế thay vì hằng số PENETRATION_RATE
+- Học viên đang học: cột '# of Active Students' của campus workbook (thiếu -> đếm studycampuscode)
+- Tọa độ nhà học viên (student_assignment bước 1) -> tỷ lệ học viên sống trong vùng phủ campus
+- Rate quan sát = học viên trong vùng phủ / TAM base (exclusive + shared được phân bổ)
+- Theo dải khoảng cách: bincount 2 chiều (campus × dải) cho cả học viên và học sinh trường công
+- Vùng phủ theo mạng đường (CATCHMENT_MODE = 'road'): học viên "trong vùng phủ" = tới campus đang học
+  trong CATCHMENT_MINUTES (road_catchment_mask), cùng định nghĩa với trường trong membership
+"""
+
+import numpy as np
+import pandas as pd
+
+ACTIVE_STUDENTS_COLUMN = '# of Active Students'
+
+
+def active_students(campuses_df, students_df=None):
+    """{Campus Code: số học viên đang học}: cột workbook, campus thiếu số liệu -> đếm trong students_df"""
+    campuses = campuses_df.drop_duplicates('Campus Code').set_index('Campus Code')
+    if ACTIVE_STUDENTS_COLUMN in campuses.columns:
+        active = pd.to_numeric(campuses[ACTIVE_STUDENTS_COLUMN], errors='coerce')
+    else:
+        active = pd.Series(np.nan, index=campuses.index)
+    if students_df is not None and 'studycampuscode' in students_df.columns:
+        counts = students_df['studycampuscode'].astype(str).str.strip().value_counts()
+        active = active.fillna(counts.reindex(active.index))
+    return active.dropna().to_dict()
+
+
+def road_catchment_mask(road_graph, assignments, students_df, campuses_df, max_minutes):
+    """Học viên tới được campus đang học trong max_minutes trên mạng đường, cùng thứ tự assignments
+
+    Dùng RoadGraph.catchments (Dijkstra giới hạn từ từng campus, gồm đoạn tiếp cận 2 đầu) như bước 2.
+    """
+    campuses = campuses_df.drop_duplicates('Campus Code')
+    codes = campuses['Campus Code'].astype(str).str.strip().to_numpy()
+    reach = road_graph.catchments(
+        pd.to_numeric(campuses['lat'], errors='coerce').to_numpy(dtype=float),
+        pd.to_numeric(campuses['lon'], errors='coerce').to_numpy(dtype=float),
+        pd.to_numeric(students_df['lat'], errors='coerce').to_numpy(dtype=float),
+        pd.to_numeric(students_df['lon'], errors='coerce').to_numpy(dtype=float),
+        max_minutes
+    )
+    current = assignments['Current Campus'].to_numpy()
+    inside = np.zeros(len(assignments), dtype=bool)
+    for code, (positions, _) in zip(codes, reach):
+        inside[positions[current[positions] == code]] = True
+    return inside
+
+
+def calibrate_penetration(campus_codes, tam_base, active, assignments, radius_km, global_rate,
+                          min_located=30, inside=None):
+    """Penetration quan sát theo campus
+
+    - tam_base: mảng theo campus_codes (exclusive + shared được phân bổ, như bước 4)
+    - active: {campus: học viên đang học}; assignments: student_assignment_df (bước 1)
+    - inside: mask học viên trong vùng phủ (vd. road_catchment_mask), None = khoảng cách <= radius_km
+    - Campus có < min_located học viên có tọa độ hoặc TAM base = 0 -> giữ global_rate
+    """
+    tam_base = np.asarray(tam_base, dtype=float)
+    known = assignments['Current Distance (km)'].notna().to_numpy()
+    if inside is None:
+        inside = (assignments['Current Distance (km)'] <= radius_km).to_numpy()
+    located = assignments[known]
+    grouped = located.groupby('Current Campus')['Current Distance (km)']
+    n_located = grouped.size().reindex(campus_codes).fillna(0).to_numpy()
+    n_inside = (
+        pd.Series(np.asarray(inside)[known], index=located.index).groupby(located['Current Campus']).sum()
+        .reindex(campus_codes).fillna(0).to_numpy()
+    )
+
+    active_count = np.array([active.get(code, np.nan) for code in campus_codes], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inside_share = np.where(n_located > 0, n_inside / n_located, np.nan)
+        catchment_students = active_count * inside_share
+        observed = np.where(tam_base > 0, catchment_students / tam_base, np.nan)
+
+    usable = (n_located >= min_located) & np.isfinite(observed)
+    return pd.DataFrame({
+        'Campus Code': list(campus_codes),
+        'Active Students': active_count,
+        'Located Students': n_located.astype(int),
+        'Within Catchment %': inside_share,
+        'Catchment Students': catchment_students,
+        'TAM Base': tam_base,
+        'Observed Rate': observed,
+        'Calibrated Rate': np.where(usable, observed, global_rate),
+        'Source': np.where(usable, 'observed', 'global'),
+    })
+
+
+def distance_band_penetration(membership, assignments, active, band_km=1.0, radius_km=None, inside=None):
+    """Penetration theo campus × dải khoảng cách [k·band_km, (k+1)·band_km)
+
+    Học viên (nhà -> campus đang học, quy đổi theo active) / học sinh trường công (trường -> campus)
+    trong cùng dải, cả hai chỉ tính tới radius_km (dải cuối = [k·band_km, radius_km]).
+    inside: mask học viên trong vùng phủ (vd. road_catchment_mask) thay cho khoảng cách <= radius_km,
+    khi đó radius_km mặc định = khoảng cách xa nhất của trường / học viên trong vùng phủ.
+    Dòng 'ALL' = toàn hệ thống theo dải.
+    """
+    matrix = membership.distances
+    n_campuses = membership.n_campuses
+    student_distances = assignments['Current Distance (km)'].to_numpy(dtype=float)
+    if inside is None:
+        if radius_km is None:
+            radius_km = matrix.data.max() if matrix.nnz else band_km
+        inside = student_distances <= radius_km
+    inside = np.asarray(inside, dtype=bool) & ~np.isnan(student_distances)
+    if radius_km is None:
+        radius_km = max(matrix.data.max() if matrix.nnz else 0.0,
+                        student_distances[inside].max() if inside.any() else 0.0) or band_km
+    n_bands = max(int(np.ceil(radius_km / band_km)), 1)
+
+    # Học sinh trường công theo (campus, dải)
+    schools = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    public_band = np.minimum((matrix.data // band_km).astype(int), n_bands - 1)
+    public = np.bincount(matrix.indices * n_bands + public_band, weights=membership.students[schools],
+                         minlength=n_campuses * n_bands).reshape(n_campuses, n_bands)
+
+    # Học viên theo (campus, dải), mỗi học viên có trọng số active / số học viên có tọa độ của campus
+    located = assignments[assignments['Current Distance (km)'].notna()]
+    inside = inside[assignments['Current Distance (km)'].notna().to_numpy()]
+    campus_positions = located['Current Campus'].map(membership.campus_index)
+    inside = inside[campus_positions.notna().to_numpy()]
+    located = located[campus_positions.notna()]
+    campus_positions = campus_positions[campus_positions.notna()].to_numpy(dtype=int)
+    distances = located['Current Distance (km)'].to_numpy(dtype=float)
+    n_located = np.bincount(campus_positions, minlength=n_campuses)
+    scale = np.array([active.get(code, np.nan) for code in membership.campus_codes], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(n_located > 0, scale / n_located, np.nan)
+    student_band = np.minimum((distances[inside] // band_km).astype(int), n_bands - 1)
+    enrolled = np.bincount(campus_positions[inside] * n_bands + student_band,
+                           weights=scale[campus_positions[inside]],
+                           minlength=n_campuses * n_bands).reshape(n_campuses, n_bands)
+
+    labels = [f"{k * band_km:g}-{min((k + 1) * band_km, radius_km):g}" for k in range(n_bands)]
+    codes = list(membership.campus_codes) + ['ALL']
+    enrolled = np.vstack([enrolled, np.nansum(enrolled, axis=0)])
+    public = np.vstack([public, public.sum(axis=0)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(public > 0, enrolled / public, np.nan)
+
+    return pd.DataFrame({
+        'Campus Code': np.repeat(codes, n_bands),
+        'Band (km)': labels * len(codes),
+        'Enrolled Students': enrolled.ravel(),
+        'Public Students': public.ravel(),
+        'Penetration': rate.ravel(),
+    })
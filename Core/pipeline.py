@@ -0,0 +1,428 @@
+# pipeline.py
+"""
+API thư viện cho pipeline phân tích campus: run_pipeline(config) -> AnalysisResult
+- Mỗi bước (01..06) là 1 Stage: input / output khai báo rõ, chạy trong namespace riêng
+- Source mỗi bước chỉ compile 1 lần (cache theo mtime), không exec vào globals() của caller
+- Nhiều lần chạy dùng chung dữ liệu đã load: truyền inputs={'loaded_inputs': ...}
+- Memo theo DAG (StageMemo): key mỗi bước = config bước đó dùng + file input + key các
+  bước sinh ra input của nó -> chạy lại chỉ các bước bị ảnh hưởng
+- AnalysisResult.tam_grid(): sweep PENETRATION_RATE × OVERLAP_SHARE × STUDENTS_PER_ROOM
+  trên kết quả bước 4, không chạy lại pipeline
+- AnalysisResult.select_sites(): chọn k vị trí campus mới (lazy greedy) so với campus hiện có
+"""
+
+import os
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+from data_loader import INPUT_FILES
+from tam_grid import tam_grid, campus_aggregates
+from site_selection import candidate_grid, candidate_coverage, select_sites, sites_frame
+
+STAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_CONFIG = {
+    'PENETRATION_RATE': 0.0162,
+    'COVERAGE_RADIUS_KM': 3,
+    'OVERLAP_SHARE': 0.5,
+    'ALLOCATION_MODE': 'flat',
+    'HUFF_DECAY': 2.0,
+    'HUFF_MODEL': 'power',
+    'STUDENTS_PER_ROOM': 100,
+    'DISTANCE_METRIC': 'haversine',
+    'SKIP_REVALIDATION': False,
+    'USE_INPUT_CACHE': True,
+    'SELECTED_CAMPUSES': [],
+    'NEW_CAMPUSES': [],
+    'USE_CAMPUS_SELECTION': False,
+    'INPUT_DIR': './Input',
+    'OUTPUT_DIR': './Output',
+    'SWEEP_RADII': [],
+    'HEAT_SURFACE_CELL_KM': 0,
+    'MONTE_CARLO_DRAWS': 0,
+    'MONTE_CARLO_PENETRATION': None,
+    'MONTE_CARLO_OVERLAP': None,
+    'MONTE_CARLO_ENROLLMENT_CV': 0.1,
+    'MONTE_CARLO_SEED': 42,
+    'STUDENT_CHUNK_SIZE': 50000,
+    'TRANSFER_MIN_SAVING_KM': 1.0,
+    'CAPACITY_ALLOCATION': False,
+    'CALIBRATE_PENETRATION': False,
+    'USE_CALIBRATED_PENETRATION': False,
+    'CALIBRATION_BAND_KM': 1.0,
+    'CATCHMENT_MODE': 'radius',
+    'ROAD_NETWORK_FILE': None,
+    'CATCHMENT_MINUTES': 15,
+    'ROAD_PROFILE': 'motorbike',
+    'MAP_RENDER_MODE': 'markers',
+}
+
+_code_cache = {}
+_code_cache_lock = threading.Lock()
+
+
+def compile_stage(path):
+    """Code object của 1 file bước, compile lại chỉ khi file thay đổi (mtime)"""
+    mtime_ns = os.stat(path).st_mtime_ns
+    with _code_cache_lock:
+        cached = _code_cache.get(path)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        code = compile(f.read(), path, "exec")
+    with _code_cache_lock:
+        _code_cache[path] = (mtime_ns, code)
+    return code
+
+
+def input_file_paths(config):
+    """Các file Excel input bước load đọc (cùng logic fallback thư mục như bước 01)"""
+    input_dir = config.get('INPUT_DIR', './Input')
+    if not os.path.exists(input_dir):
+        input_dir = "."
+    return [os.path.join(input_dir, filename) for filename in INPUT_FILES.values()]
+
+
+def road_network_paths(config):
+    """File OSM bước coverage đọc khi CATCHMENT_MODE = 'road'"""
+    if config.get('CATCHMENT_MODE', 'radius') == 'road' and config.get('ROAD_NETWORK_FILE'):
+        return [config['ROAD_NETWORK_FILE']]
+    return []
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return (os.path.abspath(path), None, None)
+
+
+class Stage:
+    """1 bước pipeline: script + input bắt buộc / tùy chọn + output
+
+    Gọi stage(config, **inputs) -> {tên output: giá trị}. Script chạy trong namespace
+    mới gồm config + inputs, không đụng tới state của các lần chạy khác.
+
+    - config_keys: các field config bước này đọc (thành phần của key memo)
+    - file_deps(config): file ngoài pipeline bước này đọc (mtime/size vào key memo)
+    - artifacts: output là đường dẫn file; memo chỉ hợp lệ khi file chưa bị ghi đè / xóa
+    - warm_start: output của lần chạy trước truyền vào dạng previous_<tên> (chỉ để tăng tốc,
+      kết quả không phụ thuộc -> không nằm trong key memo)
+    """
+
+    def __init__(self, name, script, title, inputs=(), optional=(), outputs=(),
+                 config_keys=(), file_deps=None, artifacts=(), warm_start=()):
+        self.name = name
+        self.script = script
+        self.title = title
+        self.inputs = tuple(inputs)
+        self.optional = tuple(optional)
+        self.outputs = tuple(outputs)
+        self.config_keys = tuple(config_keys)
+        self.file_deps = file_deps
+        self.artifacts = tuple(artifacts)
+        self.warm_start = tuple(warm_start)
+
+    @property
+    def path(self):
+        return os.path.join(STAGE_DIR, self.script)
+
+    def __call__(self, config, **inputs):
+        missing = [name for name in self.inputs if name not in inputs]
+        if missing:
+            raise ValueError(f"Bước '{self.name}' thiếu input: {missing}")
+
+        namespace = {'__name__': f"campus_stage_{self.name}", '__file__': self.path}
+        namespace.update(config)
+        namespace.update(inputs)
+        exec(compile_stage(self.path), namespace)
+
+        return {name: namespace[name] for name in self.outputs if name in namespace}
+
+    def run(self, config, state, previous=None):
+        """Chạy với input lấy từ state (dict các output trước đó)
+
+        previous: output của lần chạy trước (warm start), có thể None
+        """
+        names = self.inputs + self.optional
+        inputs = {name: state[name] for name in names if name in state}
+        if previous is not None:
+            inputs.update({
+                f"previous_{name}": previous[name] for name in self.warm_start if name in previous
+            })
+        return self(config, **inputs)
+
+    def key(self, config, state, provenance):
+        """Key memo của bước; None nếu có input không rõ nguồn (truyền từ ngoài pipeline)"""
+        parts = [
+            self.name,
+            _file_signature(self.path),
+            [(name, config.get(name)) for name in self.config_keys],
+        ]
+        if self.file_deps is not None:
+            parts.append([_file_signature(path) for path in self.file_deps(config)])
+        for name in self.inputs + self.optional:
+            if name in state:
+                origin = provenance.get(name)
+                if origin is None:
+                    return None
+                parts.append((name, origin))
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, {self.script!r})"
+
+
+STAGES = [
+    Stage('load', '01_load_data_selection.py', "Load dữ liệu từ Excel",
+          optional=('loaded_inputs',),
+          outputs=('loaded_inputs', 'campuses_df', 'students_df', 'schools_df', 'campus_codes',
+                   'school_index', 'transfer_df', 'student_assignment_df', 'campus_distance_df'),
+          config_keys=('INPUT_DIR', 'USE_CAMPUS_SELECTION', 'SELECTED_CAMPUSES', 'NEW_CAMPUSES',
+                       'STUDENTS_PER_ROOM', 'DISTANCE_METRIC', 'STUDENT_CHUNK_SIZE', 'TRANSFER_MIN_SAVING_KM'),
+          file_deps=input_file_paths,
+          warm_start=('loaded_inputs',)),
+    Stage('coverage', '02_compute_coverage.py', "Tính vùng phủ từng campus",
+          inputs=('campuses_df', 'schools_df', 'campus_codes'),
+          optional=('school_index',),
+          outputs=('coverage_results', 'coverage_membership', 'campus_overlap_pairs', 'campus_coverage_cache',
+                   'coverage_catchment'),
+          config_keys=('COVERAGE_RADIUS_KM', 'DISTANCE_METRIC', 'CATCHMENT_MODE', 'ROAD_NETWORK_FILE',
+                       'CATCHMENT_MINUTES', 'ROAD_PROFILE'),
+          file_deps=road_network_paths,
+          warm_start=('campus_coverage_cache',)),
+    Stage('overlap', '03_overlap_matrix.py', "Tính ma trận overlap",
+          inputs=('schools_df', 'coverage_results', 'coverage_membership'),
+          optional=('campus_overlap_pairs', 'campus_coverage_cache'),
+          outputs=('school_classification', 'overlap_matrix', 'overlap_details', 'overlap_zones',
+                   'overlap_cache'),
+          warm_start=('overlap_cache',)),
+    Stage('tam', '04_tam_analysis.py', "Phân tích TAM",
+          inputs=('campus_codes', 'coverage_results', 'coverage_membership', 'overlap_details'),
+          optional=('campuses_df', 'students_df', 'student_assignment_df', 'coverage_catchment'),
+          outputs=('tam_analysis', 'tam_results', 'tam_df', 'penetration_calibration_df', 'penetration_band_df'),
+          config_keys=('PENETRATION_RATE', 'OVERLAP_SHARE', 'ALLOCATION_MODE', 'HUFF_DECAY', 'HUFF_MODEL',
+                       'COVERAGE_RADIUS_KM', 'CALIBRATE_PENETRATION', 'USE_CALIBRATED_PENETRATION',
+                       'CALIBRATION_BAND_KM')),
+    Stage('map', '05_generate_map.py', "Tạo bản đồ interactive",
+          inputs=('campuses_df', 'schools_df', 'campus_codes', 'coverage_results', 'tam_results',
+                  'school_classification', 'overlap_details'),
+          optional=('coverage_membership', 'coverage_catchment'),
+          outputs=('school_classification', 'coverage_results', 'heat_surface', 'map_path'),
+          config_keys=('COVERAGE_RADIUS_KM', 'DISTANCE_METRIC', 'SKIP_REVALIDATION', 'USE_CAMPUS_SELECTION',
+                       'SELECTED_CAMPUSES', 'NEW_CAMPUSES', 'OUTPUT_DIR', 'HEAT_SURFACE_CELL_KM',
+                       'OVERLAP_SHARE', 'PENETRATION_RATE', 'MAP_RENDER_MODE'),
+          artifacts=('map_path',)),
+    Stage('export', '06_export_excel.py', "Xuất báo cáo Excel",
+          inputs=('campuses_df', 'schools_df', 'campus_codes', 'coverage_results', 'school_classification'),
+          optional=('campus_overlap_pairs', 'school_index', 'coverage_membership', 'transfer_df',
+                    'campus_distance_df', 'penetration_calibration_df', 'penetration_band_df'),
+          outputs=('validated_exclusive_students', 'validated_tam_results', 'validated_overlap_zones',
+                   'radius_sweep_df', 'radius_sweep_system_df', 'tam_simulation_df', 'tam_simulation_system_df',
+                   'report_path'),
+          config_keys=('PENETRATION_RATE', 'OVERLAP_SHARE', 'STUDENTS_PER_ROOM', 'COVERAGE_RADIUS_KM',
+                       'OUTPUT_DIR', 'SWEEP_RADII', 'DISTANCE_METRIC', 'ALLOCATION_MODE', 'HUFF_DECAY',
+                       'HUFF_MODEL', 'MONTE_CARLO_DRAWS',
+                       'MONTE_CARLO_PENETRATION', 'MONTE_CARLO_OVERLAP', 'MONTE_CARLO_ENROLLMENT_CV',
+                       'MONTE_CARLO_SEED', 'CAPACITY_ALLOCATION', 'USE_CALIBRATED_PENETRATION'),
+          artifacts=('report_path',)),
+]
+
+STAGES_BY_NAME = {stage.name: stage for stage in STAGES}
+
+# Các bước tính toán (không tạo map / Excel): dùng cho what-if lặp nhanh với memo
+ANALYSIS_STAGES = ('load', 'coverage', 'overlap', 'tam')
+
+
+class StageMemo:
+    """Memo output từng bước theo key (Stage.key): trong RAM (LRU), tùy chọn pickle ra đĩa
+
+    Output được dùng chung giữa các lần chạy -> các bước không được sửa input tại chỗ.
+    Lỗi đọc / ghi đĩa chỉ làm mất memo, không làm hỏng lần chạy.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=32):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _disk_path(self, stage, key):
+        return os.path.join(self.cache_dir, f"{stage.name}_{key}.pkl")
+
+    def get(self, stage, key):
+        """Output đã memo của bước, None nếu chưa có / file artifact đã bị ghi đè hoặc xóa"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.cache_dir is not None:
+            try:
+                with open(self._disk_path(stage, key), "rb") as f:
+                    entry = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+
+        if entry is None:
+            return None
+        for path, signature in entry['artifacts'].items():
+            if _file_signature(path) != signature:
+                return None
+        return entry['outputs']
+
+    def put(self, stage, key, outputs):
+        entry = {
+            'outputs': outputs,
+            'artifacts': {
+                outputs[name]: _file_signature(outputs[name]) for name in stage.artifacts if name in outputs
+            },
+        }
+        self._remember(key, entry)
+        if self.cache_dir is None:
+            return
+        path = self._disk_path(stage, key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            pass
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class AnalysisResult:
+    """Kết quả 1 lần chạy: config, output các bước (dict), thời gian từng bước (giây)
+
+    cached: tên các bước lấy lại từ memo (không chạy lại)
+    """
+
+    def __init__(self, config, outputs=None, timings=None):
+        self.config = config
+        self.outputs = outputs if outputs is not None else {}
+        self.timings = timings if timings is not None else {}
+        self.cached = []
+
+    def __getitem__(self, key):
+        return self.outputs[key]
+
+    def __contains__(self, key):
+        return key in self.outputs
+
+    def get(self, key, default=None):
+        return self.outputs.get(key, default)
+
+    @property
+    def map_path(self):
+        return self.outputs.get('map_path')
+
+    @property
+    def report_path(self):
+        return self.outputs.get('report_path')
+
+    @property
+    def total_seconds(self):
+        return sum(self.timings.values())
+
+    def tam_grid(self, penetration_rates=None, overlap_shares=None, students_per_room=None):
+        """Sweep TAM trên lưới tham số từ tam_analysis của lần chạy này (không chạy lại pipeline)
+
+        Tham số bỏ trống -> giá trị trong config của lần chạy (lưới 1 điểm = TAM bước 4).
+        Huff: overlap_shares co giãn phần shared Huff theo share / OVERLAP_SHARE;
+        penetration hiệu chỉnh: rate campus = penetration_rates × rate campus / PENETRATION_RATE.
+        """
+        config_rooms = self.config.get('STUDENTS_PER_ROOM', 100)
+        config_rate = self.config.get('PENETRATION_RATE', 0.0162)
+        config_share = self.config.get('OVERLAP_SHARE', 0.5)
+        campus_codes, exclusive, shared, rooms, rate_scale = campus_aggregates(
+            self['tam_analysis'], self['campuses_df'], config_rooms, config_share, config_rate
+        )
+        return tam_grid(
+            campus_codes, exclusive, shared, rooms,
+            config_rate if penetration_rates is None else penetration_rates,
+            config_share if overlap_shares is None else overlap_shares,
+            config_rooms if students_per_room is None else students_per_room,
+            rate_scale=rate_scale,
+        )
+
+    def select_sites(self, k, candidates=None, objective='tam', spacing_km=0.5, radius_km=None):
+        """k vị trí campus mới tốt nhất so với các campus của lần chạy này (bảng sites_frame)
+
+        - candidates: DataFrame có lat/lon (vd. danh sách địa chỉ), None = lưới quanh các trường
+        - objective: 'exclusive' (học sinh chưa được phủ) | 'tam'
+        """
+        membership = self['coverage_membership']
+        schools_df = self['schools_df']
+        if candidates is None:
+            candidates = candidate_grid(schools_df['lat'], schools_df['lon'], spacing_km)
+        radius_km = self.config.get('COVERAGE_RADIUS_KM', 3) if radius_km is None else radius_km
+
+        coverage = candidate_coverage(
+            self['school_index'], candidates['lat'], candidates['lon'], radius_km, membership.n_schools
+        )
+        selected = select_sites(
+            coverage, membership.students, k, membership.campus_counts, objective,
+            self.config.get('OVERLAP_SHARE', 0.5), self.config.get('PENETRATION_RATE', 0.0162)
+        )
+        return sites_frame(selected, candidates.reset_index(drop=True))
+
+
+def run_pipeline(config=None, stages=None, inputs=None, on_stage_start=None, on_stage_end=None, memo=None,
+                 previous=None):
+    """Chạy pipeline, trả về AnalysisResult
+
+    - config: ghi đè DEFAULT_CONFIG (PENETRATION_RATE, COVERAGE_RADIUS_KM, INPUT_DIR, ...)
+    - stages: tên các bước cần chạy theo thứ tự (mặc định cả 6 bước)
+    - inputs: output có sẵn (vd. loaded_inputs của lần chạy trước) -> dùng lại, không load lại
+    - on_stage_start(stage) / on_stage_end(stage, outputs): hook cho GUI / debug runner
+    - memo: StageMemo dùng chung giữa các lần chạy -> chỉ chạy lại bước có key thay đổi
+      (bước nhận input từ `inputs` không được memo)
+    - previous: AnalysisResult lần chạy trước -> thêm / bớt 1 campus chỉ tính lại campus đó
+      (cột khoảng cách, trường đổi exclusive/shared, cặp overlap liên quan)
+    Lỗi trong 1 bước được raise lại nguyên vẹn.
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    selected = STAGES if stages is None else [STAGES_BY_NAME[name] for name in stages]
+    result = AnalysisResult(config, outputs=dict(inputs or {}))
+    provenance = {}  # tên output -> key của bước sinh ra nó
+
+    for stage in selected:
+        if on_stage_start is not None:
+            on_stage_start(stage)
+        start = time.perf_counter()
+
+        key = stage.key(config, result.outputs, provenance) if memo is not None else None
+        outputs = memo.get(stage, key) if key is not None else None
+        if outputs is not None:
+            print(f"♻️  Bước '{stage.name}': dùng lại kết quả đã memo")
+            result.cached.append(stage.name)
+        else:
+            outputs = stage.run(config, result.outputs, previous.outputs if previous is not None else None)
+            if key is not None:
+                memo.put(stage, key, outputs)
+
+        result.outputs.update(outputs)
+        for name in outputs:
+            provenance[name] = key
+        result.timings[stage.name] = time.perf_counter() - start
+        if on_stage_end is not None:
+            on_stage_end(stage, result.outputs)
+
+    return result
@@ -0,0 +1,155 @@
+# radius_sweep.py
+"""
+Sweep nhiều bán kính trong 1 lần: coverage / overlap / TAM theo bán kính
+- Truy vấn spatial index 1 lần ở bán kính lớn nhất
+- Mỗi cặp (trường, campus) có 2 ngưỡng: d (vào vùng phủ) và max(d, o) (thành shared,
+  o = campus gần nhất còn lại) -> tổng theo bán kính = searchsorted trên mảng đã sort + cumsum
+- Kết quả tại 1 bán kính trùng với pipeline chạy với COVERAGE_RADIUS_KM đó
+"""
+
+import numpy as np
+import pandas as pd
+
+from distance_engine import BOUNDARY_TOLERANCE_KM, haversine_distance
+from membership import CoverageMembership
+
+
+def _cumulative_at(thresholds, weights, radii):
+    """Σ weights[thresholds <= r] cho từng r (sort 1 lần + searchsorted)"""
+    order = np.argsort(thresholds, kind='stable')
+    sorted_thresholds = thresholds[order]
+    cumulative = np.concatenate([[0.0], np.cumsum(weights[order])])
+    return cumulative[np.searchsorted(sorted_thresholds, radii, side='right')]
+
+
+def _grouped_cumulative_at(groups, n_groups, thresholds, weights, radii):
+    """_cumulative_at theo từng nhóm: mảng (n_groups × len(radii))"""
+    result = np.zeros((n_groups, len(radii)))
+    order = np.lexsort((thresholds, groups))
+    groups, thresholds, weights = groups[order], thresholds[order], weights[order]
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(groups, minlength=n_groups))])
+    cumulative = np.concatenate([[0.0], np.cumsum(weights)])
+    for g in range(n_groups):
+        start, end = bounds[g], bounds[g + 1]
+        if start == end:
+            continue
+        idx = start + np.searchsorted(thresholds[start:end], radii, side='right')
+        result[g] = cumulative[idx] - cumulative[start]
+    return result
+
+
+def radius_sweep(school_index, campus_codes, campus_lats, campus_lons, students, radii,
+                 overlap_share=0.5, penetration_rate=0.0162):
+    """Coverage / exclusive / shared / overlap / TAM cho danh sách bán kính
+
+    Trả về (campus_df, system_df):
+    - campus_df: 1 dòng / (bán kính, campus)
+    - system_df: 1 dòng / bán kính (trường/học sinh được phủ, cặp campus overlap, tổng TAM)
+    """
+    radii = np.array(sorted({float(r) for r in radii}), dtype=float)
+    campus_codes = list(campus_codes)
+    campus_lats = np.asarray(campus_lats, dtype=float)
+    campus_lons = np.asarray(campus_lons, dtype=float)
+    students = np.asarray(students, dtype=float)
+    n_campuses, n_radii = len(campus_codes), len(radii)
+
+    neighbors = school_index.query_radius_many(campus_lats, campus_lons, radii.max() if n_radii else 0)
+    membership = CoverageMembership.from_neighbors(neighbors, campus_codes, students)
+    matrix = membership.distances
+    rows = np.repeat(np.arange(membership.n_schools), np.diff(matrix.indptr))
+    cols = matrix.indices
+    distances = matrix.data.copy()
+
+    # Biên bán kính: đối chiếu lại bằng hàm scalar như coverage_mask của pipeline
+    if school_index.metric == 'haversine':
+        near = np.zeros(len(distances), dtype=bool)
+        for radius in radii:
+            near |= np.abs(distances - radius) <= BOUNDARY_TOLERANCE_KM
+        for e in np.nonzero(near)[0]:
+            distances[e] = haversine_distance(
+                campus_lats[cols[e]], campus_lons[cols[e]],
+                school_index.lats[rows[e]], school_index.lons[rows[e]]
+            )
+
+    # Khoảng cách gần nhất / gần nhì của mỗi trường (trong bán kính lớn nhất)
+    counts = np.diff(matrix.indptr)
+    starts = matrix.indptr[:-1]
+    order = np.lexsort((distances, rows))
+    sorted_distances = distances[order]
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order)) - np.repeat(starts, counts)
+
+    nearest = np.full(membership.n_schools, np.inf)
+    second = np.full(membership.n_schools, np.inf)
+    nearest[counts >= 1] = sorted_distances[starts[counts >= 1]]
+    second[counts >= 2] = sorted_distances[starts[counts >= 2] + 1]
+
+    # o = campus gần nhất còn lại; trường thành shared với campus này khi r >= max(d, o)
+    other = np.where(rank == 0, second[rows], nearest[rows])
+    shared_from = np.maximum(distances, other)
+    weights = students[rows]
+    ones = np.ones(len(rows))
+
+    campus_students = _grouped_cumulative_at(cols, n_campuses, distances, weights, radii)
+    campus_shared_students = _grouped_cumulative_at(cols, n_campuses, shared_from, weights, radii)
+    campus_schools = _grouped_cumulative_at(cols, n_campuses, distances, ones, radii)
+    campus_shared_schools = _grouped_cumulative_at(cols, n_campuses, shared_from, ones, radii)
+    campus_exclusive_students = campus_students - campus_shared_students
+    campus_tam = (campus_exclusive_students + overlap_share * campus_shared_students) * penetration_rate
+
+    # Cặp campus: mỗi trường phủ bởi k campus góp k(k-1)/2 cặp, ngưỡng = max(d_i, d_j)
+    pair_keys, pair_thresholds, pair_weights = [], [], []
+    for school in np.nonzero(counts >= 2)[0]:
+        entries = slice(starts[school], starts[school] + counts[school])
+        school_cols, school_distances = cols[entries], distances[entries]
+        i, j = np.triu_indices(len(school_cols), k=1)
+        pair_keys.append(school_cols[i] * n_campuses + school_cols[j])
+        pair_thresholds.append(np.maximum(school_distances[i], school_distances[j]))
+        pair_weights.append(np.full(len(i), students[school]))
+    if pair_keys:
+        pair_keys = np.concatenate(pair_keys)
+        pair_thresholds = np.concatenate(pair_thresholds)
+        pair_weights = np.concatenate(pair_weights)
+        unique_pairs, inverse = np.unique(pair_keys, return_inverse=True)
+        first_overlap = np.full(len(unique_pairs), np.inf)
+        np.minimum.at(first_overlap, inverse, pair_thresholds)
+        overlapping_pairs = _cumulative_at(first_overlap, np.ones(len(first_overlap)), radii)
+        pair_overlap_students = _cumulative_at(pair_thresholds, pair_weights, radii)
+    else:
+        overlapping_pairs = pair_overlap_students = np.zeros(n_radii)
+
+    covered = counts >= 1
+    school_weights = students[covered]
+    covered_students = _cumulative_at(nearest[covered], school_weights, radii)
+    covered_schools = _cumulative_at(nearest[covered], np.ones(covered.sum()), radii)
+    shared_students = _cumulative_at(second[covered], school_weights, radii)
+    shared_schools = _cumulative_at(second[covered], np.ones(covered.sum()), radii)
+
+    campus_rows = []
+    for r, radius in enumerate(radii):
+        for c, campus_code in enumerate(campus_codes):
+            campus_rows.append({
+                'Radius (km)': radius,
+                'Campus Code': campus_code,
+                'Schools': int(campus_schools[c, r]),
+                'Students': campus_students[c, r],
+                'Exclusive Schools': int(campus_schools[c, r] - campus_shared_schools[c, r]),
+                'Exclusive Students': campus_exclusive_students[c, r],
+                'Shared Schools': int(campus_shared_schools[c, r]),
+                'Shared Students': campus_shared_students[c, r],
+                'TAM': campus_tam[c, r],
+            })
+
+    system_df = pd.DataFrame({
+        'Radius (km)': radii,
+        'Covered Schools': covered_schools.astype(int),
+        'Covered Students': covered_students,
+        'Exclusive Schools': (covered_schools - shared_schools).astype(int),
+        'Exclusive Students': covered_students - shared_students,
+        'Shared Schools': shared_schools.astype(int),
+        'Shared Students': shared_students,
+        'Overlapping Pairs': overlapping_pairs.astype(int),
+        'Pair Overlap Students': pair_overlap_students,
+        'Total TAM': campus_tam.sum(axis=0),
+    })
+    return pd.DataFrame(campus_rows), system_df
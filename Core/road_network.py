@@ -0,0 +1,253 @@
+# road_network.py
+"""
+Vùng phủ theo thời gian di chuyển trên mạng đường (OSM offline) thay vì bán kính đường thẳng
+- Đọc file OSM XML cục bộ (.osm / .osm.gz / .osm.bz2), không cần mạng
+- Graph CSR có hướng: nút = node OSM thuộc đường đi được, trọng số = giây theo tốc độ loại đường
+- Build 1 lần, cache ra <file>.<profile>.npz (kiểm tra mtime/size file gốc)
+- Tìm kiếm: Dijkstra của scipy.sparse.csgraph có giới hạn thời gian (limit) -> chỉ duyệt vùng lân cận
+- Trường / campus gắn vào nút đường gần nhất (KD-tree), cộng thêm thời gian đi đoạn tiếp cận
+"""
+
+import bz2
+import gzip
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from distance_engine import EARTH_RADIUS_KM
+from spatial_index import to_unit_xyz
+
+# Tốc độ trung bình (km/h) theo highway=*; loại đường không có trong profile bị bỏ qua
+SPEED_PROFILES = {
+    # Xe máy không được đi cao tốc
+    'motorbike': {
+        'trunk': 35, 'trunk_link': 30, 'primary': 30, 'primary_link': 25,
+        'secondary': 25, 'secondary_link': 22, 'tertiary': 22, 'tertiary_link': 20,
+        'unclassified': 18, 'residential': 18, 'living_street': 10, 'service': 12, 'road': 15,
+    },
+    'car': {
+        'motorway': 70, 'motorway_link': 40, 'trunk': 40, 'trunk_link': 30, 'primary': 30,
+        'primary_link': 25, 'secondary': 25, 'secondary_link': 22, 'tertiary': 20, 'tertiary_link': 18,
+        'unclassified': 15, 'residential': 15, 'living_street': 8, 'service': 10, 'road': 12,
+    },
+}
+DEFAULT_PROFILE = 'motorbike'
+
+# Tốc độ đoạn tiếp cận (trường / campus -> nút đường gần nhất)
+ACCESS_SPEED_KMH = 10
+
+ONEWAY_FORWARD = ('yes', 'true', '1')
+ONEWAY_BACKWARD = ('-1', 'reverse')
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _segment_km(lat1, lon1, lat2, lon2):
+    """Khoảng cách haversine (km) theo từng cặp điểm"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def parse_osm(path, profile=DEFAULT_PROFILE):
+    """Đọc OSM XML: (node_ids, lats, lons, edge_from_ids, edge_to_ids, speeds_kmh)
+
+    Cạnh có hướng theo thứ tự node của way; đường 2 chiều sinh thêm cạnh ngược.
+    """
+    speeds = SPEED_PROFILES[profile]
+    node_ids, node_lats, node_lons = [], [], []
+    edge_from, edge_to, edge_speed = [], [], []
+
+    way_nodes, way_tags = [], {}
+    with _open(path) as f:
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            tag = elem.tag
+            if event == 'start':
+                if tag == 'way':
+                    way_nodes, way_tags = [], {}
+                continue
+            if tag == 'node':
+                node_ids.append(int(elem.get('id')))
+                node_lats.append(float(elem.get('lat')))
+                node_lons.append(float(elem.get('lon')))
+                elem.clear()
+            elif tag == 'nd':
+                way_nodes.append(int(elem.get('ref')))
+            elif tag == 'tag':
+                way_tags[elem.get('k')] = elem.get('v')
+            elif tag == 'way':
+                speed = speeds.get(way_tags.get('highway'))
+                if speed is not None and len(way_nodes) >= 2:
+                    oneway = way_tags.get('oneway', 'yes' if way_tags.get('junction') == 'roundabout' else 'no')
+                    two_way = oneway not in ONEWAY_FORWARD + ONEWAY_BACKWARD
+                    nodes = way_nodes[::-1] if oneway in ONEWAY_BACKWARD else way_nodes
+                    pairs_from, pairs_to = nodes[:-1], nodes[1:]
+                    edge_from.extend(pairs_from + pairs_to if two_way else pairs_from)
+                    edge_to.extend(pairs_to + pairs_from if two_way else pairs_to)
+                    edge_speed.extend([speed] * (len(pairs_from) * (2 if two_way else 1)))
+                elem.clear()
+            elif tag == 'relation':
+                elem.clear()
+
+    return (np.array(node_ids, dtype=np.int64), np.array(node_lats), np.array(node_lons),
+            np.array(edge_from, dtype=np.int64), np.array(edge_to, dtype=np.int64),
+            np.array(edge_speed, dtype=float))
+
+
+class RoadGraph:
+    """Graph đường có hướng dạng CSR (giây) + KD-tree trên tọa độ nút"""
+
+    def __init__(self, lats, lons, graph, profile=DEFAULT_PROFILE):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.graph = sparse.csr_matrix(graph)
+        self.profile = profile
+        self.tree = cKDTree(to_unit_xyz(self.lats, self.lons))
+
+    @property
+    def n_nodes(self):
+        return len(self.lats)
+
+    @property
+    def n_edges(self):
+        return self.graph.nnz
+
+    @classmethod
+    def from_osm(cls, path, profile=DEFAULT_PROFILE):
+        """Build graph từ file OSM: chỉ giữ node thuộc đường đi được, cạnh trùng lấy thời gian nhỏ nhất"""
+        node_ids, lats, lons, edge_from, edge_to, speeds = parse_osm(path, profile)
+        order = np.argsort(node_ids)
+        node_ids, lats, lons = node_ids[order], lats[order], lons[order]
+
+        # Bỏ cạnh tham chiếu node không có trong file (extract bị cắt biên)
+        from_pos = np.minimum(np.searchsorted(node_ids, edge_from), len(node_ids) - 1)
+        to_pos = np.minimum(np.searchsorted(node_ids, edge_to), len(node_ids) - 1)
+        known = (node_ids[from_pos] == edge_from) & (node_ids[to_pos] == edge_to) & (from_pos != to_pos)
+        from_pos, to_pos, speeds = from_pos[known], to_pos[known], speeds[known]
+
+        # Đánh số lại chỉ các node có cạnh
+        used, inverse = np.unique(np.concatenate([from_pos, to_pos]), return_inverse=True)
+        u, v = inverse[:len(from_pos)], inverse[len(from_pos):]
+        seconds = _segment_km(lats[used][u], lons[used][u], lats[used][v], lons[used][v]) / speeds * 3600
+
+        # Cạnh trùng (u, v): giữ thời gian nhỏ nhất (csr_matrix sẽ cộng dồn nếu để trùng)
+        order = np.lexsort((seconds, v, u))
+        u, v, seconds = u[order], v[order], seconds[order]
+        first = np.ones(len(u), dtype=bool)
+        first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        # Trọng số 0 bị csgraph coi là không có cạnh -> giữ số dương rất nhỏ
+        seconds = np.maximum(seconds[first], 1e-3)
+        graph = sparse.csr_matrix((seconds, (u[first], v[first])), shape=(len(used), len(used)))
+        return cls(lats[used], lons[used], graph, profile)
+
+    @classmethod
+    def load(cls, path, profile=DEFAULT_PROFILE, use_cache=True):
+        """Graph từ file OSM, dùng cache .npz cạnh file gốc nếu file gốc chưa đổi"""
+        stat = os.stat(path)
+        signature = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+        cache_path = f"{path}.{profile}.npz"
+        if use_cache and os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as cached:
+                    if np.array_equal(cached['signature'], signature):
+                        graph = sparse.csr_matrix(
+                            (cached['data'], cached['indices'], cached['indptr']),
+                            shape=(len(cached['lats']),) * 2
+                        )
+                        return cls(cached['lats'], cached['lons'], graph, profile)
+            except (OSError, KeyError, ValueError):
+                pass
+
+        road_graph = cls.from_osm(path, profile)
+        if use_cache:
+            try:
+                np.savez_compressed(
+                    cache_path, signature=signature, lats=road_graph.lats, lons=road_graph.lons,
+                    data=road_graph.graph.data, indices=road_graph.graph.indices, indptr=road_graph.graph.indptr
+                )
+            except OSError:
+                pass
+        return road_graph
+
+    def snap(self, lats, lons):
+        """(nút gần nhất, khoảng cách tới nút km) cho từng điểm; thiếu tọa độ -> nút -1, inf"""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        nodes = np.full(len(lats), -1, dtype=int)
+        snap_km = np.full(len(lats), np.inf)
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        if valid.any():
+            chord, idx = self.tree.query(to_unit_xyz(lats[valid], lons[valid]))
+            nodes[valid] = idx
+            snap_km[valid] = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+        return nodes, snap_km
+
+    def travel_minutes(self, source_nodes, max_minutes=None):
+        """Dijkstra từ các nút nguồn, dừng ở max_minutes: mảng phút (n_sources × n_nodes), inf = ngoài tầm"""
+        limit = np.inf if max_minutes is None else max_minutes * 60
+        return dijkstra(self.graph, indices=np.atleast_1d(source_nodes), limit=limit) / 60
+
+    def catchments(self, campus_lats, campus_lons, school_lats, school_lons, max_minutes):
+        """Trường trong max_minutes (gồm đoạn tiếp cận 2 đầu) của từng campus
+
+        Trả về list (positions, minutes) theo campus, positions sắp tăng dần (như query_radius).
+        """
+        school_nodes, school_snap_km = self.snap(school_lats, school_lons)
+        campus_nodes, campus_snap_km = self.snap(campus_lats, campus_lons)
+        school_access = school_snap_km / ACCESS_SPEED_KMH * 60
+        campus_access = campus_snap_km / ACCESS_SPEED_KMH * 60
+        located = np.nonzero(school_nodes >= 0)[0]
+
+        results = []
+        for node, access in zip(campus_nodes, campus_access):
+            budget = max_minutes - access
+            if node < 0 or budget < 0:
+                results.append((np.array([], dtype=int), np.array([], dtype=float)))
+                continue
+            node_minutes = self.travel_minutes(node, budget)[0]
+            minutes = access + node_minutes[school_nodes[located]] + school_access[located]
+            inside = minutes <= max_minutes
+            results.append((located[inside], minutes[inside]))
+        return results
+
+    def nearest_campus(self, campus_lats, campus_lons, school_lats, school_lons, max_minutes=None):
+        """Multi-source Dijkstra: (phút, vị trí campus gần nhất) cho từng trường; không tới được -> inf, -1
+
+        Mỗi campus là 1 nút ảo nối vào nút đường gần nhất bằng cạnh = thời gian tiếp cận,
+        1 lần Dijkstra min_only từ mọi nút ảo cho campus gần nhất của toàn graph.
+        """
+        school_nodes, school_snap_km = self.snap(school_lats, school_lons)
+        campus_nodes, campus_snap_km = self.snap(campus_lats, campus_lons)
+        minutes = np.full(len(school_nodes), np.inf)
+        nearest = np.full(len(school_nodes), -1, dtype=int)
+        valid_campuses = np.nonzero(campus_nodes >= 0)[0]
+        if len(valid_campuses) == 0:
+            return minutes, nearest
+
+        n, k = self.n_nodes, len(valid_campuses)
+        access_seconds = np.maximum(campus_snap_km[valid_campuses] / ACCESS_SPEED_KMH * 3600, 1e-3)
+        virtual = sparse.csr_matrix((access_seconds, (np.arange(k), campus_nodes[valid_campuses])), shape=(k, n + k))
+        graph = sparse.vstack([sparse.hstack([self.graph, sparse.csr_matrix((n, k))]), virtual]).tocsr()
+
+        limit = np.inf if max_minutes is None else max_minutes * 60
+        seconds, _, sources = dijkstra(graph, indices=n + np.arange(k), limit=limit,
+                                       min_only=True, return_predecessors=True)
+        reached = school_nodes >= 0
+        reached[reached] = sources[school_nodes[reached]] >= 0
+        nearest[reached] = valid_campuses[sources[school_nodes[reached]] - n]
+        minutes[reached] = (seconds[school_nodes[reached]] / 60
+                            + school_snap_km[reached] / ACCESS_SPEED_KMH * 60)
+        if max_minutes is not None:
+            beyond = minutes > max_minutes
+            minutes[beyond], nearest[beyond] = np.inf, -1
+        return minutes, nearest
@@ -0,0 +1,139 @@
+# schema.py
+"""
+Schema cột cho dữ liệu input: alias -> tên chuẩn, kiểu dữ liệu, giá trị mặc định
+- Resolve 1 lần khi load (data_loader), các bước sau chỉ dùng tên chuẩn
+- usecols/dtype được đẩy xuống pd.read_excel
+"""
+
+import pandas as pd
+
+
+class ColumnSpec:
+    """1 cột chuẩn: tên, alias (theo thứ tự ưu tiên), kiểu, mặc định
+
+    - dtype: 'float' | 'str' | None (giữ nguyên)
+    - default: giá trị khi không có cột nào khớp (None = bỏ qua)
+    - fill_value: thay NaN sau khi ép kiểu (chỉ cho 'float')
+    """
+
+    def __init__(self, name, aliases=(), dtype=None, required=False, default=None, fill_value=None):
+        self.name = name
+        self.aliases = tuple(aliases)
+        self.dtype = dtype
+        self.required = required
+        self.default = default
+        self.fill_value = fill_value
+
+    @property
+    def candidates(self):
+        return (self.name,) + self.aliases
+
+    def coerce(self, values):
+        if self.dtype == 'float':
+            values = pd.to_numeric(values, errors='coerce').astype(float)
+            if self.fill_value is not None:
+                values = values.fillna(self.fill_value)
+        elif self.dtype == 'str':
+            values = values.astype(str).str.strip()
+        return values
+
+
+class ColumnFilter:
+    """usecols dạng callable, repr ổn định (dùng làm key cache)"""
+
+    def __init__(self, names):
+        self.names = frozenset(names)
+
+    def __call__(self, column):
+        return str(column).strip() in self.names
+
+    def __repr__(self):
+        return f"ColumnFilter({sorted(self.names)})"
+
+
+class TableSchema:
+    """Schema 1 bảng input; keep_extra=False -> chỉ đọc các cột trong schema"""
+
+    def __init__(self, name, columns, keep_extra=False):
+        self.name = name
+        self.columns = list(columns)
+        self.keep_extra = keep_extra
+
+    def read_kwargs(self):
+        """usecols/dtype cho pd.read_excel"""
+        kwargs = {
+            'dtype': {
+                candidate: str
+                for spec in self.columns if spec.dtype == 'str'
+                for candidate in spec.candidates
+            }
+        }
+        if not self.keep_extra:
+            kwargs['usecols'] = ColumnFilter(
+                candidate for spec in self.columns for candidate in spec.candidates
+            )
+        return kwargs
+
+    def resolve(self, df):
+        """Đổi alias -> tên chuẩn, ép kiểu, điền mặc định
+
+        Trả về (df, report) với report = {tên chuẩn: cột nguồn | 'default' | None}.
+        Thiếu cột bắt buộc -> ValueError.
+        """
+        df.columns = [col.strip() if isinstance(col, str) else col for col in df.columns]
+        canonical = {spec.name for spec in self.columns}
+        report = {}
+
+        for spec in self.columns:
+            source = next((col for col in spec.candidates if col in df.columns), None)
+
+            if source is None:
+                if spec.required:
+                    raise ValueError(
+                        f"{self.name}: thiếu cột bắt buộc '{spec.name}' (alias: {list(spec.aliases)})"
+                    )
+                if spec.default is not None:
+                    df[spec.name] = spec.default
+                    report[spec.name] = 'default'
+                else:
+                    report[spec.name] = None
+                continue
+
+            df[spec.name] = spec.coerce(df[source])
+            report[spec.name] = source
+
+            # Bỏ các alias còn lại để không có 2 cột cùng nghĩa
+            if not self.keep_extra:
+                stale = [col for col in spec.aliases if col in df.columns and col not in canonical]
+                df = df.drop(columns=stale)
+
+        return df, report
+
+
+SCHOOLS_SCHEMA = TableSchema('schools', [
+    ColumnSpec('Tên trường', aliases=('Tên Trường', 'School Name'), dtype='str', required=True),
+    ColumnSpec('lat', aliases=('Lat', 'latitude', 'Latitude'), dtype='float', required=True),
+    ColumnSpec('lon', aliases=('Lon', 'lng', 'longitude', 'Longitude'), dtype='float', required=True),
+    ColumnSpec('Tổng học sinh 2023', aliases=('Số lượng', 'Số học sinh', 'Total Students'),
+               dtype='float', default=500, fill_value=0),
+])
+
+CAMPUSES_SCHEMA = TableSchema('campuses', [
+    ColumnSpec('Campus Code', aliases=('Campus code', 'campus_code'), dtype='str', required=True),
+    ColumnSpec('Campus Name', aliases=('Campus name', 'campus_name')),
+    ColumnSpec('lat', aliases=('Lat', 'latitude', 'Latitude'), dtype='float', required=True),
+    ColumnSpec('lon', aliases=('Lon', 'lng', 'longitude', 'Longitude'), dtype='float', required=True),
+], keep_extra=True)
+
+STUDENTS_SCHEMA = TableSchema('students', [
+    ColumnSpec('studentcode', aliases=('Student Code', 'student_code'), dtype='str'),
+    ColumnSpec('studycampuscode', aliases=('Study Campus Code', 'study_campus_code'), dtype='str'),
+    ColumnSpec('lat', aliases=('Lat', 'latitude', 'Latitude'), dtype='float'),
+    ColumnSpec('lon', aliases=('Lon', 'lng', 'longitude', 'Longitude'), dtype='float'),
+])
+
+INPUT_SCHEMAS = {
+    'campuses': CAMPUSES_SCHEMA,
+    'students': STUDENTS_SCHEMA,
+    'schools': SCHOOLS_SCHEMA,
+}
@@ -0,0 +1,157 @@
+# site_selection.py
+"""
+Chọn vị trí campus mới (maximal covering location): chọn k điểm ứng viên tối đa hóa học sinh / TAM tăng thêm
+- Ma trận phủ ứng viên × trường (CSR) build 1 lần từ KD-tree của spatial index
+- Mỗi trường có trọng số, chỉ tính 1 lần cho campus mới đầu tiên phủ nó:
+  'exclusive': học sinh trường chưa campus nào phủ
+  'tam': (học sinh chưa phủ + OVERLAP_SHARE × học sinh đã phủ) × PENETRATION_RATE
+  -> hàm phủ có trọng số, submodular đơn điệu
+- Lazy greedy (CELF): lợi ích biên chỉ giảm khi chọn thêm -> chỉ tính lại ứng viên ở đỉnh heap
+"""
+
+import heapq
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from distance_engine import EARTH_RADIUS_KM
+from spatial_index import to_unit_xyz, chord_length
+
+OBJECTIVES = ('exclusive', 'tam')
+
+
+def candidate_grid(lats, lons, spacing_km=0.5, margin_km=1.0):
+    """Lưới ứng viên bước spacing_km quanh các điểm lat/lon (vd. trường)
+
+    Chỉ giữ ô lưới chứa điểm + các ô trong margin_km xung quanh, không phủ cả bounding box
+    (1 tọa độ sai lệch không làm lưới phình ra).
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+    lats, lons = lats[valid], lons[valid]
+
+    km_per_degree = np.pi * EARTH_RADIUS_KM / 180
+    lat_step = spacing_km / km_per_degree
+    lon_step = spacing_km / (km_per_degree * np.cos(np.radians(np.median(lats))))
+
+    cells = np.column_stack([np.round(lats / lat_step), np.round(lons / lon_step)]).astype(np.int64)
+    reach = int(np.ceil(margin_km / spacing_km))
+    offsets = np.array([(di, dj) for di in range(-reach, reach + 1) for dj in range(-reach, reach + 1)])
+    cells = np.unique((cells[:, None, :] + offsets[None, :, :]).reshape(-1, 2), axis=0)
+
+    return pd.DataFrame({'lat': cells[:, 0] * lat_step, 'lon': cells[:, 1] * lon_step})
+
+
+def candidate_coverage(school_index, candidate_lats, candidate_lons, radius_km, n_schools=None):
+    """Ma trận phủ CSR bool (ứng viên × trường): KD-tree ứng viên × KD-tree trường, 1 lần gọi
+
+    Khoảng cách theo mặt cầu (dây cung), đủ cho sàng lọc ứng viên; site được chọn nên chạy lại
+    pipeline (NEW_CAMPUSES) để có số liệu theo kernel DISTANCE_METRIC.
+    """
+    n_schools = len(school_index.lats) if n_schools is None else n_schools
+    candidate_tree = cKDTree(to_unit_xyz(candidate_lats, candidate_lons))
+    pairs = candidate_tree.sparse_distance_matrix(
+        school_index.tree, chord_length(radius_km), output_type='coo_matrix'
+    )
+    return sparse.csr_matrix(
+        (np.ones(pairs.nnz, dtype=bool), (pairs.row, school_index.positions[pairs.col])),
+        shape=(len(candidate_tree.data), n_schools)
+    )
+
+
+def select_sites(coverage, students, k, existing_counts=None, objective='tam', overlap_share=0.5,
+                 penetration_rate=0.0162):
+    """Lazy greedy (CELF) chọn k ứng viên
+
+    - coverage: CSR (ứng viên × trường), vd. candidate_coverage()
+    - existing_counts: số campus hiện có phủ mỗi trường (membership.campus_counts)
+    Trả về list dict theo thứ tự chọn: candidate, gain, học sinh/trường mới phủ và đã có campus phủ
+    (chỉ tính trường lần đầu được site mới phủ), TAM của site.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Objective không hỗ trợ: {objective} (chọn {OBJECTIVES})")
+
+    coverage = sparse.csr_matrix(coverage)
+    students = np.asarray(students, dtype=float)
+    uncovered = (np.ones(len(students), dtype=bool) if existing_counts is None
+                 else np.asarray(existing_counts) == 0)
+    if objective == 'tam':
+        values = students * np.where(uncovered, 1.0, overlap_share) * penetration_rate
+    else:
+        values = np.where(uncovered, students, 0.0)
+
+    # Heap: (-gain, candidate, vòng tính gain); gain tính ở vòng cũ là cận trên (submodular)
+    gains = coverage.astype(float) @ values
+    heap = [(-gain, candidate, 0) for candidate, gain in enumerate(gains) if gain > 0]
+    heapq.heapify(heap)
+
+    selected = []
+    while heap and len(selected) < k:
+        negative_gain, candidate, round_ = heapq.heappop(heap)
+        schools = coverage.indices[coverage.indptr[candidate]:coverage.indptr[candidate + 1]]
+        if round_ != len(selected):
+            gain = values[schools].sum()
+            if gain > 0:
+                heapq.heappush(heap, (-gain, candidate, len(selected)))
+            continue
+
+        # Trường lần đầu được site mới phủ (values > 0), tách theo đã / chưa có campus phủ
+        captured = schools[values[schools] > 0]
+        new = captured[uncovered[captured]]
+        shared = captured[~uncovered[captured]]
+        selected.append({
+            'candidate': int(candidate),
+            'gain': -negative_gain,
+            'new_schools': len(new),
+            'new_students': students[new].sum(),
+            'shared_schools': len(shared),
+            'shared_students': students[shared].sum(),
+            'tam': (students[new].sum() + overlap_share * students[shared].sum()) * penetration_rate,
+        })
+        values[schools] = 0.0
+
+    return selected
+
+
+def sites_frame(selected, candidates):
+    """Bảng kết quả select_sites() kèm tọa độ ứng viên (candidates: DataFrame có lat/lon)
+
+    Các cột khác của candidates (vd. địa chỉ) được giữ lại ở cuối bảng.
+    """
+    extra_columns = [col for col in candidates.columns if col not in ('lat', 'lon')]
+    rows = []
+    cumulative = 0.0
+    for rank, site in enumerate(selected, start=1):
+        cumulative += site['gain']
+        candidate = candidates.iloc[site['candidate']]
+        rows.append({
+            'Rank': rank,
+            'lat': float(candidate['lat']),
+            'lon': float(candidate['lon']),
+            'Gain': site['gain'],
+            'Cumulative Gain': cumulative,
+            'New Schools': site['new_schools'],
+            'New Students': site['new_students'],
+            'Shared Schools': site['shared_schools'],
+            'Shared Students': site['shared_students'],
+            'TAM': site['tam'],
+            **{col: candidate[col] for col in extra_columns},
+        })
+    return pd.DataFrame(rows)
+
+
+def to_new_campuses(sites_df, rooms=8, prefix='SITE'):
+    """sites_frame() -> list cấu hình NEW_CAMPUSES để chạy lại pipeline với các site đã chọn"""
+    return [
+        {
+            'Campus Code': f"{prefix}_{int(row['Rank'])}",
+            'Campus Name': f"Candidate site #{int(row['Rank'])}",
+            'lat': round(float(row['lat']), 6),
+            'lon': round(float(row['lon']), 6),
+            'Số phòng học': rooms,
+        }
+        for _, row in sites_df.iterrows()
+    ]
@@ -0,0 +1,162 @@
+# spatial_index.py
+"""
+Spatial index cho trường công: KD-tree trên tọa độ mặt cầu đơn vị (x, y, z)
+- Build 1 lần khi load dữ liệu (01_load_data_selection.py)
+- Truy vấn bán kính / k-nearest không phải quét toàn bộ schools_df
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from distance_engine import (
+    EARTH_RADIUS_KM, DEFAULT_DISTANCE_METRIC, METRIC_SLACK, BOUNDARY_TOLERANCE_KM,
+    check_metric, distance_matrix, coverage_mask
+)
+
+# Nới nhẹ bán kính dây cung để không bỏ sót điểm nằm đúng biên do sai số float;
+# khoảng cách chính xác được lọc lại bằng kernel ngay sau đó.
+CHORD_SLACK = 1e-9
+
+
+def to_unit_xyz(lats, lons):
+    """Chuyển lat/lon (độ) sang tọa độ 3D trên mặt cầu đơn vị"""
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def chord_length(distance_km):
+    """Độ dài dây cung (mặt cầu đơn vị) tương ứng khoảng cách cung distance_km"""
+    angle = min(float(distance_km) / EARTH_RADIUS_KM, np.pi)
+    return 2 * np.sin(angle / 2)
+
+
+class SchoolSpatialIndex:
+    """KD-tree cho truy vấn bán kính và k-nearest trên tập trường
+
+    Kết quả trả về là vị trí dòng (dùng với schools_df.iloc) và khoảng cách (km)
+    theo kernel `metric` của distance_engine. Trường thiếu tọa độ không được đưa vào index.
+    """
+
+    def __init__(self, lats, lons, metric=DEFAULT_DISTANCE_METRIC):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.metric = check_metric(metric)
+
+        valid = ~(np.isnan(self.lats) | np.isnan(self.lons))
+        self.positions = np.nonzero(valid)[0]
+        self.tree = cKDTree(to_unit_xyz(self.lats[valid], self.lons[valid]))
+
+    @classmethod
+    def from_dataframe(cls, df, lat_col='lat', lon_col='lon', metric=DEFAULT_DISTANCE_METRIC):
+        """Build index từ DataFrame có cột lat/lon"""
+        import pandas as pd
+        lats = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype=float)
+        lons = pd.to_numeric(df[lon_col], errors='coerce').to_numpy(dtype=float)
+        return cls(lats, lons, metric=metric)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _distances_to(self, lat, lon, positions):
+        return distance_matrix([lat], [lon], self.lats[positions], self.lons[positions], self.metric)
+
+    def query_radius(self, lat, lon, radius_km):
+        """Các trường có khoảng cách <= radius_km, sắp theo vị trí dòng"""
+        if np.isnan(lat) or np.isnan(lon) or len(self) == 0:
+            return np.array([], dtype=int), np.array([], dtype=float)
+
+        chord = chord_length(radius_km * (1 + METRIC_SLACK[self.metric])) * (1 + CHORD_SLACK)
+        tree_idx = self.tree.query_ball_point(to_unit_xyz([lat], [lon])[0], r=chord)
+        positions = np.sort(self.positions[np.asarray(tree_idx, dtype=int)])
+
+        distances = self._distances_to(lat, lon, positions)
+        mask = coverage_mask(
+            distances, [lat], [lon], self.lats[positions], self.lons[positions], radius_km, self.metric
+        )[0]
+        return positions[mask], distances[0, mask]
+
+    def query_radius_many(self, lats, lons, radius_km):
+        """query_radius cho nhiều điểm gốc, trả về list (positions, distances)"""
+        return [self.query_radius(lat, lon, radius_km) for lat, lon in zip(lats, lons)]
+
+    def query_knn(self, lat, lon, k=1):
+        """k trường gần nhất, sắp theo khoảng cách tăng dần"""
+        k = min(int(k), len(self))
+        if k <= 0 or np.isnan(lat) or np.isnan(lon):
+            return np.array([], dtype=int), np.array([], dtype=float)
+
+        # Lấy dư ứng viên khi kernel khác mặt cầu để thứ tự theo kernel vẫn đúng
+        n_candidates = k if self.metric == 'haversine' else min(2 * k + 8, len(self))
+        _, tree_idx = self.tree.query(to_unit_xyz([lat], [lon])[0], k=n_candidates)
+        positions = self.positions[np.atleast_1d(tree_idx)]
+
+        distances = self._distances_to(lat, lon, positions)[0]
+        order = np.argsort(distances, kind='stable')[:k]
+        return positions[order], distances[order]
+
+    def query_knn_many(self, lats, lons, k=1):
+        """query_knn cho nhiều điểm gốc trong 1 lần gọi KD-tree, trả về mảng (n, k)
+
+        Điểm thiếu tọa độ / thiếu điểm trong index -> position -1, distance inf.
+        Khoảng cách kernel tính theo từng điểm của index (1 lần gọi / điểm được chọn làm ứng viên)
+        -> phù hợp với index nhỏ (vd. campus) và rất nhiều điểm gốc (vd. học viên).
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        positions = np.full((len(lats), int(k)), -1, dtype=int)
+        distances = np.full((len(lats), int(k)), np.inf)
+
+        k = min(int(k), len(self))
+        valid = np.nonzero(~(np.isnan(lats) | np.isnan(lons)))[0]
+        if k <= 0 or len(valid) == 0:
+            return positions, distances
+
+        n_candidates = k if self.metric == 'haversine' else min(2 * k + 8, len(self))
+        _, tree_idx = self.tree.query(to_unit_xyz(lats[valid], lons[valid]), k=n_candidates)
+        candidates = self.positions[np.asarray(tree_idx).reshape(len(valid), n_candidates)]
+
+        origin_lats = np.broadcast_to(lats[valid][:, None], candidates.shape)
+        origin_lons = np.broadcast_to(lons[valid][:, None], candidates.shape)
+        candidate_distances = np.empty(candidates.shape)
+        for position in np.unique(candidates):
+            mask = candidates == position
+            candidate_distances[mask] = distance_matrix(
+                [self.lats[position]], [self.lons[position]], origin_lats[mask], origin_lons[mask], self.metric
+            )[0]
+
+        order = np.argsort(candidate_distances, axis=1, kind='stable')[:, :k]
+        positions[valid, :k] = np.take_along_axis(candidates, order, axis=1)
+        distances[valid, :k] = np.take_along_axis(candidate_distances, order, axis=1)
+        return positions, distances
+
+
+def candidate_pairs(lats, lons, max_distance_km, metric=DEFAULT_DISTANCE_METRIC):
+    """Các cặp điểm (i < j) cách nhau <= max_distance_km, dùng KD-tree query_pairs
+
+    Dùng để loại trước các cặp campus chắc chắn không overlap
+    (khoảng cách > 2 × bán kính). Điểm thiếu tọa độ bị bỏ qua.
+    """
+    metric = check_metric(metric)
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+
+    valid = np.nonzero(~(np.isnan(lats) | np.isnan(lons)))[0]
+    if len(valid) < 2:
+        return np.empty((0, 2), dtype=int)
+
+    tree = cKDTree(to_unit_xyz(lats[valid], lons[valid]))
+    chord = chord_length(max_distance_km * (1 + METRIC_SLACK[metric])) * (1 + CHORD_SLACK)
+    pairs = tree.query_pairs(r=chord, output_type='ndarray')
+    if len(pairs) == 0:
+        return np.empty((0, 2), dtype=int)
+
+    pairs = np.sort(valid[pairs], axis=1)
+    i, j = pairs[:, 0], pairs[:, 1]
+    distances = np.array([
+        distance_matrix([lats[a]], [lons[a]], [lats[b]], [lons[b]], metric)[0, 0]
+        for a, b in zip(i, j)
+    ])
+    pairs = pairs[distances <= max_distance_km + BOUNDARY_TOLERANCE_KM]
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
@@ -0,0 +1,110 @@
+# student_assignment.py
+"""
+Gán campus gần nhất / gần nhì cho từng học viên (Students_with_latlon.xlsx)
+- KD-tree trên tọa độ campus (SchoolSpatialIndex), truy vấn k-nearest theo khối học viên (chunk)
+- So với campus đang học (studycampuscode) -> bảng gợi ý chuyển campus
+- Percentile quãng đường đi học theo campus
+"""
+
+import numpy as np
+import pandas as pd
+
+from distance_engine import DEFAULT_DISTANCE_METRIC, distance_matrix
+from spatial_index import SchoolSpatialIndex
+
+DEFAULT_PERCENTILES = (25, 50, 75, 90, 95)
+
+
+def _campus_points(campuses_df):
+    """(codes, lats, lons) của campus, mỗi Campus Code 1 dòng"""
+    campuses = campuses_df.drop_duplicates('Campus Code')
+    codes = campuses['Campus Code'].astype(str).str.strip().to_numpy()
+    lats = pd.to_numeric(campuses['lat'], errors='coerce').to_numpy(dtype=float)
+    lons = pd.to_numeric(campuses['lon'], errors='coerce').to_numpy(dtype=float)
+    return codes, lats, lons
+
+
+def _current_distances(student_lats, student_lons, current_codes, campus_codes, campus_lats, campus_lons, metric):
+    """Khoảng cách học viên -> campus đang học (NaN nếu không rõ campus / tọa độ)"""
+    distances = np.full(len(student_lats), np.nan)
+    for code, lat, lon in zip(campus_codes, campus_lats, campus_lons):
+        mask = current_codes == code
+        if mask.any() and not (np.isnan(lat) or np.isnan(lon)):
+            distances[mask] = distance_matrix([lat], [lon], student_lats[mask], student_lons[mask], metric)[0]
+    return distances
+
+
+def assign_students(students_df, campuses_df, current_campuses_df=None, metric=DEFAULT_DISTANCE_METRIC,
+                    chunk_size=50000):
+    """Campus gần nhất / gần nhì (trong campuses_df) và khoảng cách tới campus đang học
+
+    - current_campuses_df: bảng campus để tra tọa độ campus đang học (mặc định = campuses_df),
+      vd. toàn bộ campus khi chỉ phân tích 1 phần (campus selection)
+    Trả về 1 dòng / học viên, cùng thứ tự students_df.
+    """
+    codes, lats, lons = _campus_points(campuses_df)
+    campus_index = SchoolSpatialIndex(lats, lons, metric=metric)
+    current_codes, current_lats, current_lons = _campus_points(
+        campuses_df if current_campuses_df is None else current_campuses_df
+    )
+
+    student_lats = pd.to_numeric(students_df['lat'], errors='coerce').to_numpy(dtype=float)
+    student_lons = pd.to_numeric(students_df['lon'], errors='coerce').to_numpy(dtype=float)
+    studying = (students_df['studycampuscode'].astype(str).str.strip().to_numpy()
+                if 'studycampuscode' in students_df.columns else np.full(len(students_df), '', dtype=object))
+
+    n_students = len(students_df)
+    positions = np.full((n_students, 2), -1, dtype=int)
+    distances = np.full((n_students, 2), np.inf)
+    current_distances = np.full(n_students, np.nan)
+    for start in range(0, n_students, chunk_size):
+        chunk = slice(start, min(start + chunk_size, n_students))
+        positions[chunk], distances[chunk] = campus_index.query_knn_many(student_lats[chunk], student_lons[chunk], k=2)
+        current_distances[chunk] = _current_distances(
+            student_lats[chunk], student_lons[chunk], studying[chunk],
+            current_codes, current_lats, current_lons, metric
+        )
+
+    campus_codes = np.append(codes, None)  # position -1 -> None
+    distances[np.isinf(distances)] = np.nan
+    assignments = pd.DataFrame({
+        'studentcode': students_df['studentcode'].to_numpy() if 'studentcode' in students_df.columns
+        else np.arange(n_students),
+        'Current Campus': studying,
+        'Current Distance (km)': current_distances,
+        'Nearest Campus': campus_codes[positions[:, 0]],
+        'Nearest Distance (km)': distances[:, 0],
+        'Second Campus': campus_codes[positions[:, 1]],
+        'Second Distance (km)': distances[:, 1],
+    })
+    assignments['Saving (km)'] = assignments['Current Distance (km)'] - assignments['Nearest Distance (km)']
+    return assignments
+
+
+def transfer_suggestions(assignments, min_saving_km=1.0):
+    """Học viên có campus khác gần hơn campus đang học ít nhất min_saving_km, sắp theo quãng đường tiết kiệm"""
+    candidates = assignments[
+        assignments['Nearest Campus'].notna()
+        & (assignments['Nearest Campus'] != assignments['Current Campus'])
+        & (assignments['Saving (km)'] >= min_saving_km)
+    ]
+    return candidates.sort_values('Saving (km)', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def campus_distance_percentiles(assignments, transfers=None, percentiles=DEFAULT_PERCENTILES):
+    """Percentile quãng đường tới campus đang học + tỷ lệ học viên học đúng campus gần nhất, theo campus"""
+    known = assignments[assignments['Current Distance (km)'].notna()]
+    grouped = known.groupby('Current Campus', sort=True)['Current Distance (km)']
+
+    campus_df = pd.DataFrame({'Students': grouped.size(), 'Mean (km)': grouped.mean()})
+    quantiles = grouped.quantile([p / 100 for p in percentiles]).unstack()
+    for p, column in zip(percentiles, quantiles.columns):
+        campus_df[f'P{p:g} (km)'] = quantiles[column]
+    campus_df['Nearest Is Current %'] = (
+        (known['Nearest Campus'] == known['Current Campus']).groupby(known['Current Campus']).mean()
+    )
+    if transfers is not None:
+        campus_df['Transfer Suggestions'] = (
+            transfers.groupby('Current Campus').size().reindex(campus_df.index).fillna(0).astype(int)
+        )
+    return campus_df.rename_axis('Campus Code').reset_index()
@@ -0,0 +1,143 @@
+# tam_grid.py
+"""
+Sweep tham số TAM: PENETRATION_RATE × OVERLAP_SHARE (× STUDENTS_PER_ROOM) cho mọi campus
+- TAM tuyến tính theo exclusive / shared -> cả lưới tính bằng 1 phép broadcast NumPy
+- Trục kết quả: (campus, penetration_rate, overlap_share, students_per_room)
+- Tại đúng cấu hình đang chạy, kết quả trùng bước 4 (TAM, kể cả Huff / penetration hiệu chỉnh) và
+  bước 6 (utilization/gap/overflow), sai khác chỉ ở mức làm tròn float
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_ROOMS = 8
+
+
+class TAMGrid:
+    """Kết quả sweep: các mảng shape (n_campus, n_rate, n_share, n_room)"""
+
+    def __init__(self, campus_codes, penetration_rates, overlap_shares, students_per_room,
+                 tam, capacity, utilization, gap, overflow, rooms_needed):
+        self.campus_codes = list(campus_codes)
+        self.penetration_rates = penetration_rates
+        self.overlap_shares = overlap_shares
+        self.students_per_room = students_per_room
+        self.tam = tam
+        self.capacity = capacity
+        self.utilization = utilization
+        self.gap = gap
+        self.overflow = overflow
+        self.rooms_needed = rooms_needed
+
+    @property
+    def shape(self):
+        return self.tam.shape
+
+    def system(self):
+        """Tổng hệ thống theo từng điểm lưới (rút gọn trục campus)"""
+        total_tam = self.tam.sum(axis=0)
+        total_capacity = self.capacity.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            utilization = np.where(total_capacity > 0, total_tam / total_capacity, 0.0)
+        return {
+            'tam': total_tam,
+            'capacity': total_capacity,
+            'utilization': utilization,
+            'gap': self.gap.sum(axis=0),
+            'overflow': self.overflow.sum(axis=0),
+            'rooms_needed': self.rooms_needed.sum(axis=0),
+            'overflow_campuses': (self.overflow > 0).sum(axis=0),
+        }
+
+    def system_frame(self):
+        """system() dạng bảng dài: 1 dòng / điểm lưới"""
+        rates, shares, rooms = np.meshgrid(
+            self.penetration_rates, self.overlap_shares, self.students_per_room, indexing='ij'
+        )
+        columns = {
+            'Penetration Rate': rates.ravel(),
+            'Overlap Share': shares.ravel(),
+            'Students/Room': rooms.ravel(),
+        }
+        for name, values in self.system().items():
+            columns[name] = values.ravel()
+        return pd.DataFrame(columns)
+
+    def campus_frame(self):
+        """Bảng dài: 1 dòng / (campus, điểm lưới)"""
+        n_points = int(np.prod(self.shape[1:]))
+        grid = self.system_frame()[['Penetration Rate', 'Overlap Share', 'Students/Room']]
+        frame = pd.concat([grid] * len(self.campus_codes), ignore_index=True)
+        frame.insert(0, 'Campus Code', np.repeat(self.campus_codes, n_points))
+        for name in ('tam', 'capacity', 'utilization', 'gap', 'overflow', 'rooms_needed'):
+            frame[name] = getattr(self, name).ravel()
+        return frame
+
+
+def tam_grid(campus_codes, exclusive_students, shared_students, rooms,
+             penetration_rates, overlap_shares, students_per_room=(100,), rate_scale=None):
+    """TAM / capacity / utilization / gap / overflow cho mọi điểm lưới tham số
+
+    - exclusive_students, shared_students, rooms: mảng theo campus (cùng thứ tự campus_codes)
+    - capacity = rooms × students_per_room (như bước 1)
+    - TAM = (exclusive + overlap_share × shared) × penetration_rate × rate_scale (như bước 4)
+    - rate_scale: hệ số penetration theo campus (vd. rate hiệu chỉnh / PENETRATION_RATE), None = 1
+    """
+    exclusive = np.asarray(exclusive_students, dtype=float)[:, None, None, None]
+    shared = np.asarray(shared_students, dtype=float)[:, None, None, None]
+    rooms = np.asarray(rooms, dtype=float)[:, None, None, None]
+    rates = np.atleast_1d(np.asarray(penetration_rates, dtype=float))
+    shares = np.atleast_1d(np.asarray(overlap_shares, dtype=float))
+    per_room = np.atleast_1d(np.asarray(students_per_room, dtype=float))
+
+    # Mọi phép chia làm trên mảng nhỏ (campus × room), lưới lớn chỉ còn nhân / trừ / max
+    tam = (exclusive + shared * shares[None, None, :, None]) * rates[None, :, None, None]
+    if rate_scale is not None:
+        tam = tam * np.asarray(rate_scale, dtype=float)[:, None, None, None]
+    tam = np.broadcast_to(tam, tam.shape[:3] + (len(per_room),))
+    capacity = rooms * per_room[None, None, None, :]
+    with np.errstate(divide='ignore'):
+        inverse_capacity = np.where(capacity > 0, 1.0 / capacity, 0.0)
+        inverse_per_room = np.where(per_room > 0, 1.0 / per_room, 0.0)[None, None, None, :]
+
+    utilization = tam * inverse_capacity
+    surplus = tam - capacity
+    overflow = np.maximum(surplus, 0.0)
+    gap = np.maximum(-surplus, 0.0)
+    rooms_needed = overflow * inverse_per_room
+    capacity = np.broadcast_to(capacity, tam.shape)
+
+    return TAMGrid(campus_codes, rates, shares, per_room,
+                   tam, capacity, utilization, gap, overflow, rooms_needed)
+
+
+def campus_aggregates(tam_analysis, campuses_df, students_per_room=100, overlap_share=0.5, penetration_rate=None):
+    """(campus_codes, exclusive, shared, rooms, rate_scale) từ tam_analysis (bước 4) + campuses_df (bước 1)
+
+    - shared = allocated_shared_students / overlap_share: phần shared bước 4 tính vào TAM (flat hoặc Huff)
+      quy về share = 1 -> tại overlap_share của lần chạy TAM trùng bước 4, share khác co giãn tỷ lệ
+    - rate_scale = penetration_rate theo campus (bước 4) / penetration_rate cấu hình, None nếu không truyền
+    """
+    campus_codes = list(tam_analysis)
+    exclusive = np.array([tam_analysis[code]['exclusive_students'] for code in campus_codes], dtype=float)
+    if overlap_share > 0:
+        shared = np.array([tam_analysis[code].get('allocated_shared_students',
+                                                  overlap_share * tam_analysis[code]['shared_students'])
+                           for code in campus_codes], dtype=float) / overlap_share
+    else:
+        shared = np.array([tam_analysis[code]['shared_students'] for code in campus_codes], dtype=float)
+    rate_scale = None
+    if penetration_rate:
+        rate_scale = np.array([tam_analysis[code].get('penetration_rate', penetration_rate)
+                               for code in campus_codes], dtype=float) / penetration_rate
+
+    campuses = campuses_df.drop_duplicates('Campus Code').set_index('Campus Code')
+    if 'Số phòng học' in campuses.columns:
+        rooms = campuses['Số phòng học'].fillna(DEFAULT_ROOMS)
+    elif 'capacity' in campuses.columns and students_per_room > 0:
+        rooms = campuses['capacity'] / students_per_room
+    else:
+        rooms = pd.Series(DEFAULT_ROOMS, index=campuses.index)
+    rooms = rooms.reindex(campus_codes).fillna(DEFAULT_ROOMS).to_numpy(dtype=float)
+
+    return campus_codes, exclusive, shared, rooms, rate_scale
@@ -0,0 +1,124 @@
+# tam_simulation.py
+"""
+Monte Carlo cho TAM: khoảng giá trị thay vì 1 điểm ước lượng
+- Mỗi lượt rút: penetration rate, overlap share (theo phân phối cấu hình) + nhiễu sĩ số từng trường
+- Dùng lại membership của bước 2 (exclusive/shared là phép nhân ma trận thưa), không tính lại coverage
+- Nhiễu sĩ số: hệ số ~ N(1, cv²) độc lập theo trường -> tổng exclusive/shared theo campus là Gaussian
+  nhiều chiều với hiệp phương sai cv²·A·diag(s²)·Aᵀ -> rút trực tiếp 2×campus biến thay vì từng trường
+- Chạy theo khối lượt rút (chunk) để giới hạn bộ nhớ trung gian
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def _draw(spec, size, rng):
+    """Rút `size` giá trị từ spec: số cố định | {'dist': 'uniform' | 'triangular' | 'normal', ...}"""
+    if spec is None:
+        raise ValueError("Thiếu phân phối")
+    if not isinstance(spec, dict):
+        return np.full(size, float(spec))
+
+    dist = spec.get('dist', 'triangular')
+    if dist == 'uniform':
+        values = rng.uniform(spec['low'], spec['high'], size)
+    elif dist == 'triangular':
+        values = rng.triangular(spec['low'], spec['mode'], spec['high'], size)
+    elif dist == 'normal':
+        values = rng.normal(spec['mean'], spec['std'], size)
+    else:
+        raise ValueError(f"Phân phối không hỗ trợ: {dist}")
+    return np.clip(values, spec.get('min', 0.0), spec.get('max', np.inf))
+
+
+def default_spread(value, spread, upper=np.inf):
+    """Phân phối tam giác quanh giá trị cấu hình: [value·(1-spread), value, value·(1+spread)]"""
+    return {
+        'dist': 'triangular',
+        'low': max(0.0, value * (1 - spread)),
+        'mode': value,
+        'high': min(upper, value * (1 + spread)),
+    }
+
+
+def simulate_tam(membership, capacity, n_draws, penetration_rate, overlap_share, enrollment_cv=0.0,
+                 chunk_size=5000, seed=None, percentiles=DEFAULT_PERCENTILES, shared_shares=None,
+                 rate_scale=None):
+    """Monte Carlo TAM / utilization cho mọi campus của membership
+
+    - capacity: mảng theo membership.campus_codes
+    - penetration_rate, overlap_share: số cố định hoặc spec phân phối (xem _draw)
+    - enrollment_cv: hệ số biến thiên sĩ số từng trường (hệ số nhân ~ N(1, cv²)), 0 = tắt
+    - shared_shares: ma trận tỷ lệ chia trường shared (vd. membership.huff_shares()), thay overlap_share
+      -> trường shared chia theo tỷ lệ cố định này, không rút overlap share
+    - rate_scale: hệ số penetration theo campus (vd. rate hiệu chỉnh / PENETRATION_RATE),
+      penetration campus j ở mỗi lượt = penetration rút được × rate_scale[j]
+    Trả về (campus_df, system_df): percentile TAM / utilization + xác suất overflow theo campus,
+    percentile tổng TAM toàn hệ thống.
+    """
+    rng = np.random.default_rng(seed)
+    capacity = np.asarray(capacity, dtype=float)
+    percentiles = list(percentiles)
+    rate_scale = np.ones(membership.n_campuses) if rate_scale is None else np.asarray(rate_scale, dtype=float)
+
+    # Chỉ giữ trường được phủ; exclusive / shared = ma trận chỉ thị (trường × campus)
+    covered = np.nonzero(membership.covered_mask)[0]
+    matrix = membership.matrix[covered].astype(float)
+    counts = membership.campus_counts[covered]
+    exclusive_matrix = sparse.csr_matrix(matrix.multiply((counts == 1)[:, None]))
+    if shared_shares is not None:
+        matrix = sparse.csr_matrix(shared_shares)[covered].astype(float)
+    shared_matrix = sparse.csr_matrix(matrix.multiply((counts > 1)[:, None]))
+    students = membership.students[covered]
+
+    base_exclusive = exclusive_matrix.T @ students
+    base_shared = shared_matrix.T @ students
+
+    # Phân rã hiệp phương sai của (exclusive, shared) theo campus: noise = z · factorᵀ, z ~ N(0, I)
+    n_campuses = membership.n_campuses
+    if enrollment_cv > 0:
+        weighted = sparse.vstack([exclusive_matrix.T, shared_matrix.T]).tocsr() @ sparse.diags(students)
+        covariance = (weighted @ weighted.T).toarray() * enrollment_cv ** 2
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        keep = eigenvalues > eigenvalues.max() * 1e-12
+        factor = eigenvectors[:, keep] * np.sqrt(eigenvalues[keep])
+
+    tam = np.empty((n_draws, n_campuses))
+    for start in range(0, n_draws, chunk_size):
+        size = min(chunk_size, n_draws - start)
+        rates = _draw(penetration_rate, size, rng)
+        shares = np.ones(size) if shared_shares is not None else _draw(overlap_share, size, rng)
+
+        if enrollment_cv > 0:
+            noise = rng.standard_normal((size, factor.shape[1])) @ factor.T
+            exclusive = base_exclusive + noise[:, :n_campuses]
+            shared = base_shared + noise[:, n_campuses:]
+        else:
+            exclusive, shared = base_exclusive[None, :], base_shared[None, :]
+
+        tam[start:start + size] = (exclusive + shares[:, None] * shared) * rates[:, None] * rate_scale
+
+    # capacity cố định theo campus -> percentile utilization = percentile TAM / capacity
+    tam_percentiles = np.percentile(tam, percentiles, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inverse_capacity = np.where(capacity > 0, 1.0 / capacity, 0.0)
+
+    campus_df = pd.DataFrame({'Campus Code': membership.campus_codes, 'Capacity': capacity})
+    campus_df['TAM Mean'] = tam.mean(axis=0)
+    for p, values in zip(percentiles, tam_percentiles):
+        campus_df[f'TAM P{p:g}'] = values
+    for p, values in zip(percentiles, tam_percentiles):
+        campus_df[f'Utilization P{p:g}'] = values * inverse_capacity
+    campus_df['P(Overflow)'] = (tam > capacity).mean(axis=0)
+
+    total_tam = tam.sum(axis=1)
+    system_df = pd.DataFrame({
+        'Metric': ['Total TAM'],
+        'Draws': [n_draws],
+        'Mean': [total_tam.mean()],
+        **{f'P{p:g}': [value] for p, value in zip(percentiles, np.percentile(total_tam, percentiles))},
+    })
+    return campus_df, system_df